@@ -12,17 +12,91 @@
 """
 
 import argparse
+import hashlib
+import json
+import multiprocessing
 import os
+import shutil
+import sys
+import weakref
+from multiprocessing.pool import ThreadPool
 
 import portage
 
 from .compatibility import configparser
 from .g_collections import Package, elist
 from .fileutils import fast_manifest, FileJSON
-from .exceptions import DependencyError, DigestError, InvalidKeyError
+from .exceptions import DependencyError, DigestError
 from .logger import Logger
 from .mangler import package_managers
-from .package_db import PackageDB
+from .package_db import PackageDB, version_key
+from .serialization import JSONSerializer
+from .solver import DependencySolver
+
+# Version of package hashes stored in tree.json, change it
+# when generated files change for the same input data.
+TREE_HASH_VERSION = 1
+
+# State shared with worker processes of a parallel tree generation,
+# it is set in every worker by _init_tree_generation.
+_tree_generation_context = None
+
+def _init_tree_generation(context):
+    """
+    Initialize a worker process of a parallel tree generation.
+
+    Args:
+        context: Tuple with backend, overlay, package database,
+    generators, chunks of packages and a flag telling whether
+    packages should be hashed.
+    """
+    global _tree_generation_context
+    _tree_generation_context = context
+
+def _get_fork_context():
+    """
+    Get multiprocessing context that starts workers with fork.
+
+    Workers of a tree generation should be forked, as a backend,
+    a database and generators can not be pickled in general.
+
+    Returns:
+        Multiprocessing context or None if fork is not available.
+    """
+    get_context = getattr(multiprocessing, 'get_context', None)
+    if get_context is None:
+        # python 2 always forks on posix
+        if os.name == 'posix':
+            return multiprocessing
+        return None
+    try:
+        return get_context('fork')
+    except ValueError:
+        return None
+
+def _generate_tree_chunk(index):
+    """
+    Generate one chunk of packages in a worker process.
+
+    Args:
+        index: Index of a chunk in the shared context.
+
+    Returns:
+        A pair with number of generated ebuilds and dictionary with hashes
+    of packages (None if they are not computed).
+    """
+    backend, overlay, package_db, ebuild_g, metadata_g, chunks, with_hashes = \
+        _tree_generation_context
+    packages = chunks[index]
+    hashes = None
+    if with_hashes:
+        hashes = {}
+    backend.write_packages(overlay,
+                           ((package, package_db.get_package_view(package))
+                            for package in packages),
+                           ebuild_g, metadata_g, hashes)
+    return (len(packages), hashes)
+
 
 class Backend(object):
     """
@@ -36,7 +110,8 @@ class Backend(object):
     list
     search word
     generate package_name
-    generate-tree [-d --digest]
+    rdeps package_name
+    generate-tree [-d --digest] [-j --jobs N] [--digest-jobs N] [-i --incremental]
     install package_name [portage flags]
 
     If no overlay directory is given the default one from backend config is used.
@@ -53,11 +128,14 @@ class Backend(object):
         self.ebuild_g_without_digest_class = ebuild_g_without_digest_class
         self.eclass_g_class = eclass_g_class
         self.metadata_g_class = metadata_g_class
+        self.solvers = weakref.WeakKeyDictionary()
+        self.overlays_info_dir = '/var/lib/g-sorcery'
 
         self.parser = \
             argparse.ArgumentParser(description='Automatic ebuild generator.')
         self.parser.add_argument('-o', '--overlay')
         self.parser.add_argument('-r', '--repository')
+        self.parser.add_argument('--verify', choices=['fast', 'full'], default='fast')
 
         subparsers = self.parser.add_subparsers()
 
@@ -71,8 +149,15 @@ class Backend(object):
         p_generate.add_argument('pkgname')
         p_generate.set_defaults(func=self.generate)
 
+        p_rdeps = subparsers.add_parser('rdeps')
+        p_rdeps.add_argument('pkgname')
+        p_rdeps.set_defaults(func=self.rdeps)
+
         p_generate_tree = subparsers.add_parser('generate-tree')
         p_generate_tree.add_argument('-d', '--digest', action='store_true')
+        p_generate_tree.add_argument('-j', '--jobs', type=int, default=1)
+        p_generate_tree.add_argument('--digest-jobs', type=int, default=0)
+        p_generate_tree.add_argument('-i', '--incremental', action='store_true')
         p_generate_tree.set_defaults(func=self.generate_tree)
 
         p_install = subparsers.add_parser('install')
@@ -188,7 +273,7 @@ class Backend(object):
             Exit status.
         """
         pkg_db = self._get_package_db(args, config, global_config)
-        pkg_db.read()
+        pkg_db.read(full_verify=args.verify == 'full')
         try:
             categories = pkg_db.list_categories()
             for category in categories:
@@ -196,9 +281,10 @@ class Backend(object):
                 print('\n')
                 packages = pkg_db.list_package_names(category)
                 for pkg in packages:
-                    max_ver = pkg_db.get_max_version(category, pkg)
-                    versions = pkg_db.list_package_versions(category, pkg)
-                    desc = pkg_db.get_package_description(Package(category,
+                    versions = pkg_db.list_package_versions(category, pkg,
+                                                            sorted=True)
+                    max_ver = versions[-1]
+                    desc = pkg_db.get_package_view(Package(category,
                                                             pkg, max_ver))
                     print('  ' + pkg + ': ' + desc['description'])
                     print('    Available versions: ' + ' '.join(versions))
@@ -206,6 +292,8 @@ class Backend(object):
         except Exception as e:
             self.logger.error('list failed: ' + str(e) + '\n')
             return -1
+        finally:
+            pkg_db.close()
         return 0
 
     def generate(self, args, config, global_config):
@@ -222,25 +310,54 @@ class Backend(object):
         """
         overlay = self._get_overlay(args, config, global_config)
         pkg_db = self._get_package_db(args, config, global_config)
-        pkg_db.read()
+        pkg_db.read(lazy=True, full_verify=args.verify == 'full')
 
         pkgname = args.pkgname
 
         try:
-            dependencies = self.get_dependencies(pkg_db, pkgname)
-        except Exception as e:
-            self.logger.error('dependency solving failed: ' + str(e) + '\n')
-            return -1
+            try:
+                dependencies = self.get_dependencies(pkg_db, pkgname)
+            except Exception as e:
+                self.logger.error('dependency solving failed: ' + str(e) + '\n')
+                return -1
 
-        eclasses = []
-        for package in dependencies:
-            eclasses += pkg_db.get_package_description(package)['eclasses']
-        eclasses = list(set(eclasses))
-        self.generate_eclasses(overlay, eclasses)
-        self.generate_ebuilds(pkg_db, overlay, dependencies, True)
-        self.generate_metadatas(pkg_db, overlay, dependencies)
-        self.digest(overlay)
-        return 0
+            eclasses = []
+            for package in dependencies:
+                eclasses += pkg_db.get_package_view(package)['eclasses']
+            eclasses = list(set(eclasses))
+            self.generate_eclasses(overlay, eclasses)
+            self.generate_ebuilds(pkg_db, overlay, dependencies, True)
+            self.generate_metadatas(pkg_db, overlay, dependencies)
+            self.digest(overlay)
+            return 0
+        finally:
+            pkg_db.close()
+
+    def rdeps(self, args, config, global_config):
+        """
+        List packages that depend on a given package.
+
+        Args:
+            args: Command line arguments.
+            config: Backend config.
+            global_config: g-sorcery config.
+
+        Returns:
+            Exit status.
+        """
+        pkg_db = self._get_package_db(args, config, global_config)
+        pkg_db.read(lazy=True, full_verify=args.verify == 'full')
+        try:
+            try:
+                category, name = self.resolve_package_name(pkg_db, args.pkgname)
+            except Exception as e:
+                self.logger.error('rdeps failed: ' + str(e) + '\n')
+                return -1
+            for catpkg in pkg_db.reverse_dependencies(category, name):
+                print(catpkg)
+            return 0
+        finally:
+            pkg_db.close()
 
     def generate_ebuilds(self, package_db, overlay, packages, digest=False):
         """
@@ -284,13 +401,66 @@ class Backend(object):
         """
         self.logger.info("metadata generation")
         metadata_g = self.metadata_g_class(package_db)
+        for (category, name), versions in \
+            sorted(self.group_versions(packages).items()):
+            self.write_metadata(overlay, metadata_g, category, name, versions)
+
+    def group_versions(self, packages):
+        """
+        Group versions of given packages by package.
+
+        Args:
+            packages: Iterable of g_collections.Package instances.
+
+        Returns:
+            Dictionary with (category, name) keys and lists of versions.
+        """
+        catpkgs = {}
         for package in packages:
-            path = os.path.join(overlay, package.category, package.name)
-            if not os.path.exists(path):
-                os.makedirs(path)
-            source = metadata_g.generate(package)
-            with open(os.path.join(path, 'metadata.xml'), 'w') as f:
-                f.write('\n'.join(source))
+            catpkgs.setdefault((package.category, package.name),
+                               []).append(package.version)
+        return catpkgs
+
+    def select_metadata_version(self, package_db, category, name, versions):
+        """
+        Select a version metadata.xml of a package is generated from.
+
+        Override this method to use another version. Result should not
+        depend on the order of versions.
+
+        Args:
+            package_db: Package database.
+            category: Category name.
+            name: Package name.
+            versions: List of versions being generated.
+
+        Returns:
+            Selected version, the maximal one by default.
+        """
+        return max(versions, key=version_key)
+
+    def write_metadata(self, overlay, metadata_g, category, name, versions):
+        """
+        Write metadata.xml for a package.
+
+        Metadata is rendered only once per package from
+        the version returned by select_metadata_version.
+
+        Args:
+            overlay: Overlay directory.
+            metadata_g: Metadata generator.
+            category: Category name.
+            name: Package name.
+            versions: List of versions being generated.
+        """
+        version = self.select_metadata_version(metadata_g.package_db,
+                                               category, name, versions)
+        path = os.path.join(overlay, category, name)
+        if not os.path.exists(path):
+            os.makedirs(path)
+        source = metadata_g.generate(Package(category, name, version))
+        with open(os.path.join(path, 'metadata.xml'), 'wb') as f:
+            f.write('\n'.join(source).encode('utf-8'))
 
     def generate_eclasses(self, overlay, eclasses):
         """
@@ -325,6 +495,25 @@ class Backend(object):
         Package version is ignored currently and a returned set contains all
         the versions of packages pkgname depends on.
         """
+        category, name = self.resolve_package_name(package_db, pkgname)
+        versions = package_db.list_package_versions(category, name)
+        solver = self.get_solver(package_db)
+        dependencies = set()
+        for version in versions:
+            dependencies |= solver.solve(Package(category, name, version))
+        return dependencies
+
+    def resolve_package_name(self, package_db, pkgname):
+        """
+        Find category of a package.
+
+        Args:
+            package_db: Database.
+            pkgname: package name (string), with or without category.
+
+        Returns:
+            A pair (category, name).
+        """
         parts = pkgname.split('/')
         category = None
         if len(parts) == 1:
@@ -338,11 +527,7 @@ class Backend(object):
             raise DependencyError(error)
 
         if not category:
-            all_categories = package_db.list_categories()
-            categories = []
-            for cat in all_categories:
-                if package_db.in_category(cat, name):
-                    categories.append(cat)
+            categories = package_db.list_package_categories(name)
 
             if not len(categories):
                 error = 'no package with name ' \
@@ -359,12 +544,26 @@ class Backend(object):
                 raise DependencyError("ambiguous packagename")
 
             category = categories[0]
-        versions = package_db.list_package_versions(category, name)
-        dependencies = set()
-        for version in versions:
-            dependencies |= self.solve_dependencies(package_db,
-                                    Package(category, name, version))[0]
-        return dependencies
+        return (category, name)
+
+    def get_solver(self, package_db):
+        """
+        Get dependency solver for a package database.
+
+        Solver is created once per database, so all the dependency
+        solving done by a backend shares solved subgraphs.
+
+        Args:
+            package_db: Package database.
+
+        Returns:
+            solver.DependencySolver instance.
+        """
+        solver = self.solvers.get(package_db)
+        if solver is None:
+            solver = DependencySolver(package_db)
+            self.solvers[package_db] = solver
+        return solver
 
     def solve_dependencies(self, package_db, package,
                            solved_deps=None, unsolved_deps=None):
@@ -381,49 +580,13 @@ class Backend(object):
             A pair (solved_deps, unsolved_deps).
 
         Note:
-            Each dependency is an object of class g_collections.Dependency.
+            Each dependency is an object of class g_collections.Package.
         """
         if not solved_deps:
             solved_deps = set()
         if not unsolved_deps:
             unsolved_deps = set()
-        if package in solved_deps:
-            return solved_deps
-        if package in unsolved_deps:
-            error = 'circular dependency for ' + package.category + '/' + \
-              package.name + '-' + package.version
-            raise DependencyError(error)
-        unsolved_deps.add(package)
-        found = True
-        try:
-            desc = package_db.get_package_description(package)
-        except KeyError:
-            found = False
-        if not found:
-            error = "package " + package.category + '/' + \
-                package.name + '-' + package.version + " not found"
-            self.logger.error(error)
-            # at the moment ignore unsolved dependencies, as those deps can be in other repo
-            # or can be external: portage will catch it
-            unsolved_deps.remove(package)
-            return (solved_deps, unsolved_deps)
-
-        dependencies = desc["dependencies"]
-        for pkg in dependencies:
-            try:
-                versions = package_db.list_package_versions(pkg.category,
-                                                        pkg.package)
-                for version in versions:
-                    solved_deps, unsolved_deps = self.solve_dependencies(package_db,
-                                    Package(pkg.category, pkg.package, version),
-                                    solved_deps, unsolved_deps)
-            except InvalidKeyError:
-                # ignore non existing packages
-                continue
-
-        solved_deps.add(package)
-        unsolved_deps.remove(package)
-
+        solved_deps |= self.get_solver(package_db).solve(package)
         return (solved_deps, unsolved_deps)
 
 
@@ -441,18 +604,28 @@ class Backend(object):
             raise DigestError('repoman manifest failed')
         os.chdir(prev)
 
-    def fast_digest(self, overlay, pkgnames):
+    def fast_digest(self, overlay, pkgnames, jobs=1):
         """
         Digest an overlay using custom method faster than repoman.
+        Directories whose Manifest is up to date are skipped.
 
         Args:
             overlay: Overlay directory.
             pkgnames: List of full package names (category/package).
+            jobs: Number of threads used for digesting.
         """
         self.logger.info("fast digesting overlay")
-        for pkgname in pkgnames:
-            directory = os.path.join(overlay, pkgname)
-            fast_manifest(directory)
+        directories = [os.path.join(overlay, pkgname) for pkgname in pkgnames]
+        if jobs > 1:
+            pool = ThreadPool(jobs)
+            try:
+                pool.map(fast_manifest, directories)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for directory in directories:
+                fast_manifest(directory)
 
     def generate_tree(self, args, config, global_config):
         """
@@ -474,67 +647,277 @@ class Backend(object):
         self.logger.info("tree generation")
         overlay = self._get_overlay(args, config, global_config)
         pkg_db = self._get_package_db(args, config, global_config)
-        pkg_db.read()
+        pkg_db.read(full_verify=args.verify == 'full')
 
-        os.system('rm -rf ' + overlay + '/*')
-        os.makedirs(os.path.join(overlay, 'profiles'))
-        os.system("echo " + os.path.basename(overlay) + '>' + \
-                  os.path.join(overlay, 'profiles', 'repo_name'))
+        try:
+            tree_f = FileJSON(os.path.join(overlay, self.sorcery_dir,
+                                           config["package"], args.repository),
+                              "tree.json", [])
+            old_hashes = {}
+            if args.incremental:
+                old_hashes = tree_f.read()
+            if not old_hashes:
+                self.clean_overlay(overlay)
+
+            for directory in ['profiles', 'metadata']:
+                path = os.path.join(overlay, directory)
+                if not os.path.exists(path):
+                    os.makedirs(path)
+            os.system("echo " + os.path.basename(overlay) + '>' + \
+                      os.path.join(overlay, 'profiles', 'repo_name'))
+
+            if not "masters" in config["repositories"][args.repository]:
+                masters = elist(["gentoo"])
+            else:
+                masters = elist(config["repositories"][args.repository]["masters"])
 
-        os.makedirs(os.path.join(overlay, 'metadata'))
-        if not "masters" in config["repositories"][args.repository]:
-            masters = elist(["gentoo"])
-        else:
-            masters = elist(config["repositories"][args.repository]["masters"])
+            overlays = FileJSON(self.overlays_info_dir, "overlays.json", [])
+            overlays_old_info = overlays.read()
+            overlays_info = {}
+            masters_overlays = elist()
+            portage_overlays = [repo.location for repo in portage.settings.repositories]
 
-        overlays = FileJSON("/var/lib/g-sorcery", "overlays.json", [])
-        overlays_old_info = overlays.read()
-        overlays_info = {}
-        masters_overlays = elist()
-        portage_overlays = [repo.location for repo in portage.settings.repositories]
+            for repo, info in overlays_old_info.items():
+                if info["path"] in portage_overlays:
+                    overlays_info[repo] = info
 
-        for repo, info in overlays_old_info.items():
-            if info["path"] in portage_overlays:
-                overlays_info[repo] = info
+            overlays.write(overlays_info)
 
-        overlays.write(overlays_info)
+            for repo in masters:
+                if repo != "gentoo":
+                    if not repo in overlays_info:
+                        self.logger.error("Master repository " + repo + " not available on your system")
+                        self.logger.error("Please, add it with layman -a " + repo)
+                        return -1
+                    masters_overlays.append(overlays_info[repo]["repo-name"])
 
-        for repo in masters:
-            if repo != "gentoo":
-                if not repo in overlays_info:
-                    self.logger.error("Master repository " + repo + " not available on your system")
-                    self.logger.error("Please, add it with layman -a " + repo)
-                    return -1
-                masters_overlays.append(overlays_info[repo]["repo-name"])
+            masters_overlays.append("gentoo")
 
-        masters_overlays.append("gentoo")
+            overlays_info[args.repository] = {"repo-name": os.path.basename(overlay), "path": overlay}
+            with open(os.path.join(overlay, 'metadata', 'layout.conf'), 'w') as f:
+                f.write("repo-name = %s\n" % os.path.basename(overlay))
+                f.write("masters = %s\n" % masters_overlays)
 
-        overlays_info[args.repository] = {"repo-name": os.path.basename(overlay), "path": overlay}
-        with open(os.path.join(overlay, 'metadata', 'layout.conf'), 'w') as f:
-            f.write("repo-name = %s\n" % os.path.basename(overlay))
-            f.write("masters = %s\n" % masters_overlays)
+            if args.digest:
+                ebuild_g = self.ebuild_g_with_digest_class(pkg_db)
+            else:
+                ebuild_g = self.ebuild_g_without_digest_class(pkg_db)
+            metadata_g = self.metadata_g_class(pkg_db)
+
+            packages_iter = pkg_db
+            catpkg_names = pkg_db.list_catpkg_names()
+            if packages:
+                dependencies = set()
+                catpkg_names = set()
+                packages_dict = {}
+                for pkg in packages:
+                    dependencies |= self.get_dependencies(pkg_db, pkg)
+
+                for pkg in dependencies:
+                    catpkg_names |= set([pkg.category + '/' + pkg.name])
+                    packages_dict[pkg] = pkg_db.get_package_view(pkg)
+                packages_iter = packages_dict.items()
+
+            if old_hashes:
+                hashes = self.hash_packages(packages_iter, ebuild_g, metadata_g)
+                changed = set()
+                for catpkg, value in hashes.items():
+                    if old_hashes.get(catpkg) != value \
+                       or not os.path.isdir(os.path.join(overlay, catpkg)):
+                        changed.add(catpkg)
+                removed = set(old_hashes) - set(hashes)
+                self.remove_packages(overlay, (changed | removed) & set(old_hashes))
+                self.logger.info("regenerating " + str(len(changed)) +
+                                 " packages, removing " + str(len(removed)))
+                catpkg_names = changed
+                packages_iter = ((package, ebuild_data)
+                                 for package, ebuild_data in packages_iter
+                                 if package.category + '/' + package.name in changed)
+                generated_hashes = None
+            else:
+                # all the packages are generated, they are hashed on the way
+                hashes = {}
+                generated_hashes = hashes
 
-        if args.digest:
-            ebuild_g = self.ebuild_g_with_digest_class(pkg_db)
-        else:
-            ebuild_g = self.ebuild_g_without_digest_class(pkg_db)
-        metadata_g = self.metadata_g_class(pkg_db)
-
-        packages_iter = pkg_db
-        catpkg_names = pkg_db.list_catpkg_names()
-        if packages:
-            dependencies = set()
-            catpkg_names = set()
-            packages_dict = {}
-            for pkg in packages:
-                dependencies |= self.get_dependencies(pkg_db, pkg)
-
-            for pkg in dependencies:
-                catpkg_names |= set([pkg.category + '/' + pkg.name])
-                packages_dict[pkg] = pkg_db.get_package_description(pkg)
-            packages_iter = packages_dict.items()
+            if args.jobs > 1:
+                if packages:
+                    all_packages = list(packages_dict)
+                else:
+                    all_packages = pkg_db.list_all_packages()
+                if old_hashes:
+                    all_packages = [package for package in all_packages
+                                    if package.category + '/' + package.name in changed]
+                self.write_packages_parallel(overlay, pkg_db, all_packages,
+                                             ebuild_g, metadata_g, args.jobs,
+                                             generated_hashes)
+            else:
+                self.write_packages(overlay, packages_iter, ebuild_g, metadata_g,
+                                    generated_hashes)
+
+            eclass_g = self.eclass_g_class()
+            path = os.path.join(overlay, 'eclass')
+            if not os.path.exists(path):
+                os.makedirs(path)
+
+            for eclass in eclass_g.list():
+                source = eclass_g.generate(eclass)
+                with open(os.path.join(path, eclass + '.eclass'), 'w') as f:
+                    f.write('\n'.join(source))
+
+            if args.digest:
+                self.digest(overlay)
+            else:
+                pkgnames = catpkg_names
+                digest_jobs = args.digest_jobs
+                if digest_jobs < 1:
+                    digest_jobs = multiprocessing.cpu_count()
+                self.fast_digest(overlay, pkgnames, digest_jobs)
+            overlays.write(overlays_info)
+            tree_f.write(hashes)
+
+            try:
+                clean_db = config["repositories"][args.repository]["clean_db"]
+            except KeyError:
+                clean_db = False
+            if clean_db:
+                pkg_db.clean()
+        finally:
+            pkg_db.close()
+
+    def clean_overlay(self, overlay):
+        """
+        Remove all the non-hidden entries of an overlay directory.
+
+        Args:
+            overlay: Overlay directory.
+        """
+        if not os.path.isdir(overlay):
+            return
+        for name in os.listdir(overlay):
+            if name.startswith('.'):
+                continue
+            path = os.path.join(overlay, name)
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+
+    def get_generators_fingerprint(self, ebuild_g, metadata_g):
+        """
+        Get a string identifying code that renders package directories.
+
+        It includes TREE_HASH_VERSION, version of a backend package
+        (its __version__ attribute if any), classes of generators
+        and metadata schema. Ebuild templates are hashed per package
+        by hash_packages. Backends whose output depends on anything
+        else should extend it.
+
+        Args:
+            ebuild_g: Ebuild generator.
+            metadata_g: Metadata generator.
+
+        Returns:
+            Fingerprint string.
+        """
+        backend_package = sys.modules.get(self.__class__.__module__.split('.')[0])
+        schema = getattr(getattr(metadata_g, 'xmlg', None), 'schema', None)
+        return json.dumps([TREE_HASH_VERSION,
+                           str(getattr(backend_package, '__version__', '')),
+                           ebuild_g.__class__.__module__,
+                           ebuild_g.__class__.__name__,
+                           metadata_g.__class__.__module__,
+                           metadata_g.__class__.__name__,
+                           getattr(metadata_g, 'fast_serializer', False),
+                           schema],
+                          sort_keys=True, default=repr)
+
+    def hash_packages(self, packages_iter, ebuild_g, metadata_g):
+        """
+        Compute hashes of data used to render package directories.
+
+        A hash covers ebuild data (with category common data) and
+        ebuild template of all package versions and fingerprint
+        of generators (see get_generators_fingerprint).
 
+        Args:
+            packages_iter: Iterable of (package, ebuild_data) pairs.
+            ebuild_g: Ebuild generator.
+            metadata_g: Metadata generator.
+
+        Returns:
+            Dictionary with category/package entries as keys and hashes as values.
+        """
+        hashes = {}
+        for _ in self.iter_hashing(packages_iter, ebuild_g, metadata_g, hashes):
+            pass
+        return hashes
+
+    def iter_hashing(self, packages_iter, ebuild_g, metadata_g, hashes):
+        """
+        Iterate over packages computing their hashes (see hash_packages)
+        on the way.
+
+        Args:
+            packages_iter: Iterable of (package, ebuild_data) pairs.
+            ebuild_g: Ebuild generator.
+            metadata_g: Metadata generator.
+            hashes: Dictionary hashes are stored into when iteration is finished.
+
+        Returns:
+            Iterator over (package, ebuild_data) pairs of packages_iter.
+        """
+        generators = self.get_generators_fingerprint(ebuild_g, metadata_g)
+        hashers = {}
+        for package, ebuild_data in packages_iter:
+            catpkg = package.category + '/' + package.name
+            if not catpkg in hashers:
+                hashers[catpkg] = hashlib.md5(generators.encode('utf-8'))
+            template = ebuild_g.get_template(package,
+                                             ebuild_g.process_ebuild_data(ebuild_data))
+            entry = json.dumps([package.version, ebuild_data, list(template)],
+                               sort_keys=True, cls=JSONSerializer)
+            hashers[catpkg].update(entry.encode('utf-8'))
+            yield (package, ebuild_data)
+        for catpkg, hasher in hashers.items():
+            hashes[catpkg] = hasher.hexdigest()
+
+    def remove_packages(self, overlay, catpkg_names):
+        """
+        Remove package directories from an overlay.
+        Category directories left empty are removed too.
+
+        Args:
+            overlay: Overlay directory.
+            catpkg_names: List of category/package entries.
+        """
+        for catpkg in catpkg_names:
+            path = os.path.join(overlay, catpkg)
+            if os.path.exists(path):
+                shutil.rmtree(path)
+            category_path = os.path.dirname(path)
+            if os.path.isdir(category_path) and not os.listdir(category_path):
+                os.rmdir(category_path)
+
+    def write_packages(self, overlay, packages_iter, ebuild_g, metadata_g, hashes=None):
+        """
+        Write ebuilds and metadata for given packages.
+
+        Metadata is written once per package after all its ebuilds.
+
+        Args:
+            overlay: Overlay directory.
+            packages_iter: Iterable of (package, ebuild_data) pairs.
+            ebuild_g: Ebuild generator.
+            metadata_g: Metadata generator.
+            hashes: Dictionary hashes of written packages (see hash_packages)
+        are stored into, they are not computed if None.
+        """
+        if hashes is not None:
+            packages_iter = self.iter_hashing(packages_iter, ebuild_g, metadata_g, hashes)
+        catpkgs = {}
         for package, ebuild_data in packages_iter:
+            catpkgs.setdefault((package.category, package.name),
+                               []).append(package.version)
             category = package.category
             name = package.name
             version = package.version
@@ -549,33 +932,86 @@ class Backend(object):
                       'wb') as f:
                 f.write('\n'.join(source).encode('utf-8'))
 
-            source = metadata_g.generate(package)
-            with open(os.path.join(path, 'metadata.xml'), 'wb') as f:
-                f.write('\n'.join(source).encode('utf-8'))
+        for (category, name), versions in sorted(catpkgs.items()):
+            self.write_metadata(overlay, metadata_g, category, name, versions)
 
-        eclass_g = self.eclass_g_class()
-        path = os.path.join(overlay, 'eclass')
-        if not os.path.exists(path):
-            os.makedirs(path)
+    def split_packages(self, packages, jobs):
+        """
+        Split packages into chunks for parallel generation.
 
-        for eclass in eclass_g.list():
-            source = eclass_g.generate(eclass)
-            with open(os.path.join(path, eclass + '.eclass'), 'w') as f:
-                f.write('\n'.join(source))
+        Chunks are formed per category, big categories are split further
+        at package boundaries. All versions of a package always belong to
+        the same chunk, so metadata of every package is written
+        by exactly one worker.
 
-        if args.digest:
-            self.digest(overlay)
-        else:
-            pkgnames = catpkg_names
-            self.fast_digest(overlay, pkgnames)
-        overlays.write(overlays_info)
+        Args:
+            packages: List of g_collections.Package instances.
+            jobs: Number of worker processes.
+
+        Returns:
+            List of chunks, each chunk is a list of packages.
+        """
+        chunk_size = max(1, len(packages) // (jobs * 4))
+        categories = {}
+        catpkgs = {}
+        for package in packages:
+            cat_pkgs = categories.setdefault(package.category, [])
+            if not package.name in catpkgs.setdefault(package.category, {}):
+                catpkgs[package.category][package.name] = []
+                cat_pkgs.append(catpkgs[package.category][package.name])
+            catpkgs[package.category][package.name].append(package)
+
+        chunks = []
+        for category in sorted(categories):
+            chunk = []
+            for versions in categories[category]:
+                chunk.extend(versions)
+                if len(chunk) >= chunk_size:
+                    chunks.append(chunk)
+                    chunk = []
+            if chunk:
+                chunks.append(chunk)
+        return chunks
+
+    def write_packages_parallel(self, overlay, package_db, packages,
+                                ebuild_g, metadata_g, jobs, hashes=None):
+        """
+        Write ebuilds and metadata for given packages using worker processes.
 
+        Args:
+            overlay: Overlay directory.
+            package_db: Package database.
+            packages: List of g_collections.Package instances.
+            ebuild_g: Ebuild generator.
+            metadata_g: Metadata generator.
+            jobs: Number of worker processes.
+            hashes: Dictionary hashes of written packages (see hash_packages)
+        are stored into, they are not computed if None.
+        """
+        mp_context = _get_fork_context()
+        if mp_context is None:
+            self.logger.warn("parallel generation needs fork, using one job")
+            self.write_packages(overlay,
+                                ((package, package_db.get_package_view(package))
+                                 for package in packages),
+                                ebuild_g, metadata_g, hashes)
+            return
+        chunks = self.split_packages(packages, jobs)
+        context = (self, overlay, package_db, ebuild_g, metadata_g, chunks,
+                   hashes is not None)
+        pool = mp_context.Pool(jobs, _init_tree_generation, (context,))
         try:
-            clean_db = config["repositories"][args.repository]["clean_db"]
-        except KeyError:
-            clean_db = False
-        if clean_db:
-            pkg_db.clean()
+            results = pool.map(_generate_tree_chunk, range(len(chunks)))
+        finally:
+            pool.close()
+            pool.join()
+        generated = 0
+        for count, chunk_hashes in results:
+            generated += count
+            if hashes is not None:
+                hashes.update(chunk_hashes)
+        self.logger.info("generated " + str(generated) + " ebuilds using " +
+                         str(jobs) + " jobs")
 
     def install(self, args, config, global_config):
         """
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    compact_storage.py
+    ~~~~~~~~~~~~~~~~~~
+
+    memory-compact storage of package descriptions
+
+    :copyright: (c) 2013-2015 by Jauhien Piatlicki
+    :license: GPL-2, see LICENSE for more details.
+"""
+
+from .compatibility import basestring, intern, Mapping
+from .g_collections import serializable_elist
+
+
+class PackedList(tuple):
+    """
+    Immutable list value that is shared between package descriptions.
+    It is returned as is when accessed and compares equal to lists
+    with the same items.
+    """
+    __slots__ = ()
+
+    def __eq__(self, other):
+        if type(other) is list:
+            other = tuple(other)
+        return tuple.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = tuple.__hash__
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+class KeySchema(object):
+    """
+    Ordered set of keys shared by package descriptions of a category.
+    """
+    __slots__ = ('keys', 'positions')
+
+    def __init__(self, keys):
+        self.keys = keys
+        self.positions = dict((key, i) for i, key in enumerate(keys))
+
+
+class PackedEntry(Mapping):
+    """
+    Read-only package description or dictionary value in it.
+
+    Keys are stored once per schema, values are stored in a tuple.
+    Values are shared, so they are frozen: lists are PackedList
+    instances and dictionaries are PackedEntry instances.
+    """
+    __slots__ = ('schema', 'values')
+
+    def __init__(self, schema, values):
+        self.schema = schema
+        self.values = values
+
+    def __getitem__(self, key):
+        return self.values[self.schema.positions[key]]
+
+    def __contains__(self, key):
+        return key in self.schema.positions
+
+    def __iter__(self):
+        return iter(self.schema.keys)
+
+    def __len__(self):
+        return len(self.schema.keys)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+    def serialize(self):
+        return dict(self)
+
+
+class CompactStorage(object):
+    """
+    Packer of package descriptions.
+
+    Strings (including separators of serializable_elist values) are
+    interned, lists are stored as tuples shared between all the equal
+    values, dictionaries are packed as read-only mappings and keys
+    of package descriptions are stored in per-category schemas.
+    """
+
+    def __init__(self):
+        self.schemas = {}
+        self.value_schemas = {}
+        self.shared = {}
+
+    def pack(self, category, ebuild_data):
+        """
+        Pack a package description.
+
+        Args:
+            category: Category name.
+            ebuild_data: Dictionary with package description.
+
+        Returns:
+            PackedEntry instance.
+        """
+        if isinstance(ebuild_data, PackedEntry):
+            return ebuild_data
+        return self.pack_dict(self.schemas.setdefault(category, {}), ebuild_data)
+
+    def pack_dict(self, schemas, value):
+        """
+        Pack a dictionary.
+
+        Args:
+            schemas: Dictionary with key tuples as keys and schemas as values.
+            value: Dictionary.
+
+        Returns:
+            PackedEntry instance.
+        """
+        keys = tuple(intern_value(key) for key in value)
+        schema = schemas.get(keys)
+        if schema is None:
+            schema = KeySchema(keys)
+            schemas[keys] = schema
+        values = tuple(self.pack_value(value[key]) for key in keys)
+        return PackedEntry(schema, values)
+
+    def pack_value(self, value):
+        """
+        Pack a value.
+
+        Args:
+            value: Value from a package description.
+
+        Returns:
+            Packed value.
+        """
+        if isinstance(value, basestring):
+            return intern_value(value)
+        if type(value) is dict:
+            return self.pack_dict(self.value_schemas, value)
+        if isinstance(value, serializable_elist):
+            value.data._sep_ = intern_value(value.data._sep_)
+            return value
+        if type(value) is list:
+            packed = PackedList(self.pack_value(item) for item in value)
+            try:
+                return self.shared.setdefault(packed, packed)
+            except TypeError:
+                # unhashable items, value can not be shared
+                return packed
+        return value
+
+
+def intern_value(value):
+    """
+    Intern a string.
+    """
+    if isinstance(value, str):
+        return intern(value)
+    return value
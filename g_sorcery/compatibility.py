@@ -43,3 +43,39 @@ else:
     unicode = str
     bytes = bytes
     basestring = (str, bytes)
+
+if py2k:
+    from collections import Mapping, MutableMapping
+    from __builtin__ import intern as _intern
+
+    def intern(string):
+        # only byte strings can be interned in python 2
+        if isinstance(string, bytes):
+            return _intern(string)
+        return string
+else:
+    from collections.abc import Mapping, MutableMapping
+    from sys import intern
+
+if py2k:
+    from urllib2 import urlopen, Request, HTTPError, URLError
+    from urllib import getproxies, proxy_bypass, unquote
+    from urlparse import urlparse
+else:
+    from urllib.request import urlopen, Request, getproxies, proxy_bypass
+    from urllib.error import HTTPError, URLError
+    from urllib.parse import urlparse, unquote
+
+if py2k:
+    import httplib as http_client
+else:
+    import http.client as http_client
+
+# lzma module is optional in python 2
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
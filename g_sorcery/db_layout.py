@@ -12,19 +12,28 @@
 """
 
 import hashlib
+import json
 import os
 import shutil
+import tempfile
 
-from .exceptions import DBLayoutError, DBStructureError, FileJSONError, IntegrityError
-from .fileutils import FileJSON, hash_file
+from .exceptions import DBLayoutError, DBReplacedError, DBStructureError, FileJSONError, \
+     IntegrityError
+from .compatibility import Mapping
+from .file_indexed import FileIndexed
+from .fileutils import FileJSON, HashingWriter, hash_file, replace_directory
+from .serialization import to_raw_serializable
 
 CATEGORIES_FILE_NAME = 'categories'
+INDEX_FILE_NAME = 'index'
 MANIFEST_FILE_NAME = 'manifest'
 METADATA_FILE_NAME = 'metadata'
 PACKAGES_FILE_NAME = 'packages'
+VERIFIED_FILE_NAME = 'verified'
 
 JSON_FILE_SUFFIX = 'json'
 BSON_FILE_SUFFIX = 'bson'
+INDEXED_FILE_SUFFIX = 'idx'
 
 SUPPORTED_DB_LAYOUTS=[0, 1]
 
@@ -37,7 +46,66 @@ class CategoryJSON(FileJSON):
                                            file_name(PACKAGES_FILE_NAME, JSON_FILE_SUFFIX))
 
 
-SUPPORTED_FILE_FORMATS = {JSON_FILE_SUFFIX: CategoryJSON}
+class CompactCategoryJSON(CategoryJSON):
+    """
+    Category file in JSON format written without indentation.
+
+    Content is written entry by entry: every entry is converted
+    to raw serializable types in one pass and then encoded
+    at once, so the fast json encoder is used and the whole
+    category is never held in a serialized form. The file
+    can be read by CategoryJSON.
+    """
+
+    def write_content(self, content):
+        """
+        Write JSON file.
+        """
+        encode = json.JSONEncoder(separators=(',', ':')).encode
+        with open(self.path, 'wb') as f:
+            writer = HashingWriter(f, hashlib.md5())
+            self._write_dict(writer, content, encode, 2)
+            writer.flush()
+        self.checksum = writer.hexdigest()
+
+    def _write_dict(self, f, content, encode, depth):
+        """
+        Write a dictionary streaming its values.
+
+        Args:
+            f: File object.
+            content: Dictionary.
+            encode: Encoding function.
+            depth: Number of nested dictionary levels to be streamed.
+        """
+        f.write('{')
+        first = True
+        for key, value in content.items():
+            if not first:
+                f.write(',')
+            first = False
+            f.write(encode(key) + ':')
+            if depth > 1 and isinstance(value, Mapping):
+                self._write_dict(f, value, encode, depth - 1)
+            else:
+                f.write(encode(to_raw_serializable(value)))
+        f.write('}')
+
+
+class CategoryIndexed(FileIndexed):
+    """
+    Category file in indexed binary format.
+
+    Every package is encoded separately, so only packages
+    that are accessed are decoded.
+    """
+    def __init__(self, directory, category):
+        super(CategoryIndexed, self).__init__(os.path.join(os.path.abspath(directory), category),
+                                              file_name(PACKAGES_FILE_NAME, INDEXED_FILE_SUFFIX))
+
+
+SUPPORTED_FILE_FORMATS = {JSON_FILE_SUFFIX: CategoryJSON,
+                          INDEXED_FILE_SUFFIX: CategoryIndexed}
 
 
 # bson module is optional, we should check if it is installed
@@ -73,34 +141,72 @@ class Manifest(FileJSON):
     def __init__(self, directory):
         super(Manifest, self).__init__(os.path.abspath(directory), file_name(MANIFEST_FILE_NAME))
 
-    def check(self):
+    def check(self, names=None, full=False):
         """
         Check manifest.
+
+        Files that were successfully checked before are not hashed
+        again if their size, modification time and inode have not changed.
+
+        Args:
+            names: List of files to be checked. If not given,
+        all the files from manifest are checked.
+            full: Whether all the files should be hashed.
         """
         manifest = self.read()
 
         result = True
         errors = []
 
-        names = [file_name(CATEGORIES_FILE_NAME)]
-        for name in names:
+        mandatory_names = [file_name(CATEGORIES_FILE_NAME)]
+        if names is not None:
+            mandatory_names += names
+        for name in mandatory_names:
             if not name in manifest:
                 raise DBLayoutError('Bad manifest: no ' + name + ' entry')
 
-        for name, value in manifest.items():
-            if hash_file(os.path.join(self.directory, name), hashlib.md5()) != \
-                value:
+        if names is None:
+            names = list(manifest)
+        verified_f = Verified(self.directory)
+        verified = verified_f.read()
+        changed = False
+        for name in names:
+            path = os.path.join(self.directory, name)
+            try:
+                state = [manifest[name]] + fingerprint(path)
+            except EnvironmentError:
+                errors.append(name)
+                continue
+            if not full and verified.get(name) == state:
+                continue
+            changed = True
+            if hash_file(path, hashlib.md5()) != manifest[name]:
                 errors.append(name)
+                verified.pop(name, None)
+            else:
+                verified[name] = state
+        if changed:
+            verified_f.write(verified)
 
         if errors:
             result = False
 
         return (result, errors)
 
-    def digest(self, mandatory_files):
+    def digest(self, mandatory_files, digests=None):
         """
         Generate manifest.
+
+        Files with known hashes are not read. Stat fingerprints
+        of all the files are recorded as verified.
+
+        Args:
+            mandatory_files: List of files in DB directory.
+            digests: Dictionary with file names relative to DB directory
+        as keys and their MD5 hashes as values.
         """
+        if digests is None:
+            digests = {}
         if not file_name(CATEGORIES_FILE_NAME) in mandatory_files:
             raise DBLayoutError('Categories file: ' + file_name(CATEGORIES_FILE_NAME) \
                                 + ' is not in the list of mandatory files')
@@ -111,8 +217,7 @@ class Manifest(FileJSON):
         manifest = {}
 
         for name in mandatory_files:
-            manifest[name] = hash_file(os.path.join(self.directory, name),
-                                       hashlib.md5())
+            manifest[name] = self._get_digest(name, digests)
 
         for category in categories:
             category_path = os.path.join(self.directory, category)
@@ -120,11 +225,78 @@ class Manifest(FileJSON):
                 raise DBStructureError('Empty category: ' + category)
             for root, _, files in os.walk(category_path):
                 for f in files:
-                    manifest[os.path.join(root[len(self.directory)+1:], f)] = \
-                    hash_file(os.path.join(root, f), hashlib.md5())
+                    name = os.path.join(root[len(self.directory)+1:], f)
+                    manifest[name] = self._get_digest(name, digests)
 
         self.write(manifest)
 
+        verified = {}
+        for name, value in manifest.items():
+            verified[name] = [value] + fingerprint(os.path.join(self.directory, name))
+        Verified(self.directory).write(verified)
+
+    def _get_digest(self, name, digests):
+        """
+        Get MD5 hash of a file.
+
+        Args:
+            name: File name relative to DB directory.
+            digests: Dictionary with known hashes.
+
+        Returns:
+            Hash value.
+        """
+        if name in digests:
+            return digests[name]
+        return hash_file(os.path.join(self.directory, name), hashlib.md5())
+
+
+def fingerprint(path):
+    """
+    Get stat fingerprint of a file.
+
+    Returns:
+        List with size, modification time and inode of a file.
+    """
+    st = os.stat(path)
+    return [st.st_size, getattr(st, 'st_mtime_ns', st.st_mtime), st.st_ino]
+
+
+class Verified(FileJSON):
+    """
+    Verified state file.
+
+    Contains manifest hashes and stat fingerprints of files
+    that were successfully checked. It is a cache: it is not
+    in manifest and errors during its reading or writing are ignored.
+    """
+    def __init__(self, directory):
+        super(Verified, self).__init__(os.path.abspath(directory),
+                                       file_name(VERIFIED_FILE_NAME))
+
+    def read(self):
+        """
+        Read verified state.
+        """
+        if not os.path.isfile(self.path):
+            return {}
+        try:
+            content = self.read_content()
+        except (EnvironmentError, ValueError):
+            return {}
+        if not isinstance(content, dict):
+            return {}
+        return content
+
+    def write(self, content):
+        """
+        Write verified state.
+        """
+        try:
+            super(Verified, self).write(content)
+        except EnvironmentError:
+            pass
+
 
 class Metadata(FileJSON):
     """
@@ -165,6 +337,15 @@ class Categories(FileJSON):
                                          file_name(CATEGORIES_FILE_NAME))
 
 
+class Index(FileJSON):
+    """
+    Index file.
+    """
+    def __init__(self, directory):
+        super(Index, self).__init__(os.path.abspath(directory),
+                                    file_name(INDEX_FILE_NAME))
+
+
 def get_layout(metadata):
     """
     Get layout parameters based on metadata.
@@ -210,26 +391,91 @@ class DBLayout(object):
         manifest.json: database manifest
         categories.json: information about categories
         metadata.json: DB metadata
+        index.json: DB index (optional)
         category1
-            packages.[b|j]son: information about available packages
+            packages.[json|bson|idx]: information about available packages
         category2
         ...
 
-    Packages file can be in json or bson formats.
+    verified.json (optional) is a cache of manifest check results:
+    files whose size, modification time and inode did not change
+    since the last successful check are not hashed again. It is not
+    listed in manifest. Set full_verify to hash all the files anyway.
+
+    Packages file can be in json, bson or indexed binary formats.
+    Indexed files are memory mapped and only accessed packages
+    are decoded. JSON packages
+    files can be written in a compact form without indentation.
+
+    Sync and incremental write replace the whole DB directory. Manifest
+    fingerprint is recorded when metadata is read, files read later are
+    checked to come from the same DB: DBReplacedError is raised otherwise.
+
+    Index file contains data that can be computed from packages files,
+    but is stored to avoid reading of all of them. At the moment it has
+    these entries:
+        packages -- dictionary with package names as keys and lists of
+                    categories that contain a package as values
+        reverse_dependencies -- dictionary with category/name of packages
+                    as keys and lists of category/name of packages
+                    that depend on them as values
     """
 
-    def __init__(self, directory):
+    def __init__(self, directory, compact_json=False):
+        """
+        Args:
+            directory: DB directory.
+            compact_json: Whether JSON packages files should be written
+        in a compact form.
+        """
         self.directory = os.path.abspath(directory)
+        self.compact_json = compact_json
+        self.full_verify = False
         self.manifest = Manifest(self.directory)
+        self.snapshot = None
+        self.open_files = []
 
-    def check_manifest(self):
+    def close(self):
+        """
+        Close memory mapped files of categories that have been read.
+        """
+        for category_f in self.open_files:
+            category_f.close()
+        self.open_files = []
+
+    def check_manifest(self, names=None):
         """
         Check manifest.
+
+        Args:
+            names: List of files to be checked, all files if not given.
         """
-        sane, errors = self.manifest.check()
+        sane, errors = self.manifest.check(names, self.full_verify)
         if not sane:
             raise IntegrityError('Manifest error: ' + str(errors))
 
+    def take_snapshot(self):
+        """
+        Remember fingerprint of the manifest of the current DB.
+        """
+        try:
+            self.snapshot = fingerprint(self.manifest.path)
+        except EnvironmentError:
+            self.snapshot = None
+
+    def check_snapshot(self):
+        """
+        Check that DB has not been replaced since the last snapshot.
+        """
+        if self.snapshot is None:
+            return
+        try:
+            current = fingerprint(self.manifest.path)
+        except EnvironmentError:
+            current = None
+        if current != self.snapshot:
+            raise DBReplacedError('DB was replaced while being read: ' + self.directory)
+
     def clean(self):
         """
         Remove DB files.
@@ -237,6 +483,7 @@ class DBLayout(object):
         if os.path.exists(self.directory):
             shutil.rmtree(self.directory)
         os.makedirs(self.directory)
+        self.snapshot = None
 
     def read(self):
         """
@@ -245,46 +492,221 @@ class DBLayout(object):
         Returns a tuple with metadata, list of categories
         and categories dictionary.
         """
+        self.take_snapshot()
         self.check_manifest()
 
-        metadata_f = Metadata(self.directory)
-        metadata = metadata_f.read()
-
-        category_cls, _ = get_layout(metadata)
-
-        categories_f = Categories(self.directory)
-        categories = categories_f.read()
+        metadata, categories = self._read_metadata()
 
         packages = {}
         for category in categories:
-            category_path = os.path.join(self.directory, category)
-            if not os.path.isdir(category_path):
-                raise DBLayoutError('Empty category: ' + category)
-            category_f = category_cls(self.directory, category)
-            pkgs = category_f.read()
-            if not pkgs:
-                raise DBLayoutError('Empty category: ' + category)
-            packages[category] = pkgs
+            packages[category] = self.read_category(metadata, category, check=False)
+        self.check_snapshot()
 
         return (metadata, categories, packages)
 
-    def write(self, metadata, categories, packages):
+    def read_metadata(self, check=True):
+        """
+        Read DB metadata and list of categories.
+
+        Args:
+            check: Whether manifest entries for files being read should be checked.
+
+        Returns a tuple with metadata and list of categories.
+        """
+        self.take_snapshot()
+        if check:
+            names = [file_name(CATEGORIES_FILE_NAME)]
+            metadata_f = Metadata(self.directory)
+            if os.path.isfile(metadata_f.path):
+                names.append(metadata_f.name)
+            self.check_manifest(names)
+        result = self._read_metadata()
+        self.check_snapshot()
+        return result
+
+    def _read_metadata(self):
+        """
+        Read DB metadata and list of categories without any checks.
+
+        Returns a tuple with metadata and list of categories.
+        """
+        metadata = Metadata(self.directory).read()
+        get_layout(metadata)
+        categories = Categories(self.directory).read()
+        return (metadata, categories)
+
+    def read_category(self, metadata, category, check=True):
+        """
+        Read packages file of a category.
+
+        Args:
+            metadata: DB metadata.
+            category: Category name.
+            check: Whether manifest entry for the category file should be checked.
+
+        Returns:
+            Content of a category file.
+        """
+        self.check_snapshot()
+        category_cls, _ = get_layout(metadata)
+        category_path = os.path.join(self.directory, category)
+        if not os.path.isdir(category_path):
+            raise DBLayoutError('Empty category: ' + category)
+        category_f = category_cls(self.directory, category)
+        if check:
+            self.check_manifest([os.path.join(category, category_f.name)])
+        pkgs = category_f.read()
+        if isinstance(category_f, FileIndexed):
+            self.open_files.append(category_f)
+        self.check_snapshot()
+        if not pkgs:
+            raise DBLayoutError('Empty category: ' + category)
+        return pkgs
+
+    def read_index(self, metadata, check=True):
+        """
+        Read DB index.
+
+        Args:
+            metadata: DB metadata.
+            check: Whether manifest entry for the index file should be checked.
+
+        Returns:
+            Content of the index file or None if DB has no index.
+        """
+        self.check_snapshot()
+        if metadata['layout_version'] == 0:
+            return None
+        index_f = Index(self.directory)
+        if not os.path.isfile(index_f.path) \
+           or not index_f.name in self.manifest.read():
+            return None
+        if check:
+            self.check_manifest([index_f.name])
+        index = index_f.read()
+        self.check_snapshot()
+        return index
+
+    def write(self, metadata, categories, packages, index=None):
         """
         Write DB files.
+
+        Args:
+            metadata: DB metadata.
+            categories: Categories dictionary.
+            packages: Dictionary with content of category files.
+            index: DB index, not written if None. Not supported by DB layout v. 0.
         """
         category_cls, mandatory_files = get_layout(metadata)
+        mandatory_files = list(mandatory_files)
+        if self.compact_json and category_cls is CategoryJSON:
+            category_cls = CompactCategoryJSON
 
         self.clean()
 
+        written = []
+
         if file_name(METADATA_FILE_NAME) in mandatory_files:
             metadata_f = Metadata(self.directory)
             metadata_f.write(metadata)
+            written.append(metadata_f)
+
+        if index is not None and metadata['layout_version'] != 0:
+            index_f = Index(self.directory)
+            index_f.write(index)
+            mandatory_files.append(index_f.name)
+            written.append(index_f)
 
         categories_f = Categories(self.directory)
         categories_f.write(categories)
+        written.append(categories_f)
 
         for category in categories:
             category_f = category_cls(self.directory, category)
             category_f.write(packages[category])
+            written.append(category_f)
+
+        digests = {}
+        for file_f in written:
+            if file_f.checksum is not None:
+                digests[os.path.relpath(file_f.path, self.directory)] = file_f.checksum
+
+        self.manifest.digest(mandatory_files, digests)
+        self.take_snapshot()
 
-        self.manifest.digest(mandatory_files)
+    def update(self, metadata, categories, packages, index=None):
+        """
+        Update DB files.
+
+        Only given category files are rewritten together with
+        categories and index files. Updated DB is built in a staging
+        directory next to the DB one: new files are written there,
+        other files listed in manifest are hardlinked (or copied if
+        hardlinking is not possible) and patched manifest is written.
+        Then staging directory replaces the DB one. If update is
+        interrupted old DB is left untouched.
+
+        Args:
+            metadata: DB metadata, should be the same as one of existing DB.
+            categories: Categories dictionary.
+            packages: Dictionary with content of changed category files.
+            index: DB index, not written if None. Not supported by DB layout v. 0.
+        """
+        category_cls, _ = get_layout(metadata)
+        if self.compact_json and category_cls is CategoryJSON:
+            category_cls = CompactCategoryJSON
+
+        if not os.path.isfile(self.manifest.path):
+            raise DBLayoutError('No manifest in ' + self.directory)
+        manifest = self.manifest.read()
+        verified = Verified(self.directory).read()
+
+        staging_dir = tempfile.mkdtemp(prefix='.' + os.path.basename(self.directory) + '.update-',
+                                       dir=os.path.dirname(self.directory))
+        try:
+            written = []
+
+            categories_f = Categories(staging_dir)
+            categories_f.write(categories)
+            written.append(categories_f)
+
+            if index is not None and metadata['layout_version'] != 0:
+                index_f = Index(staging_dir)
+                index_f.write(index)
+                written.append(index_f)
+
+            for category in sorted(packages):
+                category_f = category_cls(staging_dir, category)
+                category_f.write(packages[category])
+                written.append(category_f)
+
+            for file_f in written:
+                name = os.path.relpath(file_f.path, staging_dir)
+                checksum = file_f.checksum
+                if checksum is None:
+                    checksum = hash_file(file_f.path, hashlib.md5())
+                manifest[name] = checksum
+                verified[name] = [checksum] + fingerprint(file_f.path)
+
+            hardlink = True
+            for name in manifest:
+                path = os.path.join(staging_dir, name)
+                if os.path.exists(path):
+                    continue
+                if not os.path.isdir(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                if hardlink:
+                    try:
+                        os.link(os.path.join(self.directory, name), path)
+                        continue
+                    except OSError:
+                        hardlink = False
+                shutil.copy2(os.path.join(self.directory, name), path)
+                verified.pop(name, None)
+
+            Manifest(staging_dir).write(manifest)
+            Verified(staging_dir).write(verified)
+            replace_directory(staging_dir, self.directory)
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+        self.take_snapshot()
@@ -11,19 +11,106 @@
     :license: GPL-2, see LICENSE for more details.
 """
 
+import collections
+
 from .compatibility import basestring
 from .exceptions import DependencyError
 
+
+def _lru_get(cache, key):
+    """
+    Get a value from an LRU cache marking it as recently used.
+
+    Args:
+        cache: collections.OrderedDict instance.
+        key: Key.
+
+    Returns:
+        Value or None if there is no such key.
+    """
+    value = cache.pop(key, None)
+    if value is not None:
+        cache[key] = value
+    return value
+
+
+def _lru_put(cache, key, value, max_size):
+    """
+    Put a value to an LRU cache removing least recently used values.
+
+    Args:
+        cache: collections.OrderedDict instance.
+        key: Key.
+        value: Value.
+        max_size: Maximal number of values in cache.
+    """
+    cache[key] = value
+    while len(cache) > max_size:
+        cache.popitem(last=False)
+
+class EbuildTemplate(object):
+    """
+    Compiled ebuild template.
+
+    Template lines are joined once, so rendering fills all
+    the substitutions with a single formatting operation.
+    """
+
+    __slots__ = ('lines', 'text', 'dynamic')
+
+    def __init__(self, template):
+        """
+        Args:
+            template: Ebuild template as a list of strings.
+        """
+        self.lines = tuple(template)
+        self.text = '\n'.join(self.lines)
+        self.dynamic = '%' in self.text
+
+    def render(self, ebuild_data):
+        """
+        Fill template with data.
+
+        Args:
+            ebuild_data: Dictionary with ebuild data.
+
+        Returns:
+            Ebuild source as a list of strings.
+        """
+        if not self.dynamic:
+            return list(self.lines)
+        error = ""
+        try:
+            return (self.text % ebuild_data).split('\n')
+        except ValueError as e:
+            error = str(e)
+        # find a line substitution failed in
+        for line in self.lines:
+            if '%' in line:
+                try:
+                    line % ebuild_data
+                except ValueError as e:
+                    error = "substitution failed in line '" + line + "': " + str(e)
+                    break
+        raise DependencyError(error)
+
+
 class EbuildGenerator(object):
     """
     Ebuild generator.
     """
+
+    # Maximal number of compiled templates kept by a generator.
+    max_compiled_templates = 256
+
     def __init__(self, package_db):
         """
         Args:
             package_db: Package database.
         """
         self.package_db = package_db
+        self.compiled_templates = collections.OrderedDict()
+        self.compiled_by_content = collections.OrderedDict()
 
     def generate(self, package, ebuild_data=None):
         """
@@ -38,7 +125,7 @@ class EbuildGenerator(object):
         """
         #a possible exception should be catched in the caller
         if not ebuild_data:
-            ebuild_data = self.package_db.get_package_description(package)
+            ebuild_data = self.package_db.get_package_view(package)
         ebuild_data = self.process_ebuild_data(ebuild_data)
         ebuild = self.get_template(package, ebuild_data)
         ebuild = self.process(ebuild, ebuild_data)
@@ -68,19 +155,37 @@ class EbuildGenerator(object):
         Returns:
             Ebuild source as a list of strings.
         """
-        result = []
-        for line in ebuild:
-            error = ""
-            try:
-                line = line % ebuild_data
-            except ValueError as e:
-                error = str(e)
-            if error:
-                error = "substitution failed in line '" + line + "': " + error
-                raise DependencyError(error)
-            result.append(line)
+        return self.compile_template(ebuild).render(ebuild_data)
+
+    def compile_template(self, ebuild):
+        """
+        Get compiled version of an ebuild template.
+
+        Compiled templates are kept in two LRU caches. One is keyed
+        by identity of template objects, so a template returned by
+        get_template again is found without hashing its content.
+        Another one is keyed by content for generators that build
+        a new template for every package. A template should not
+        be changed after it was compiled.
+
+        Args:
+            ebuild: Ebuild template.
 
-        return result
+        Returns:
+            EbuildTemplate instance.
+        """
+        entry = _lru_get(self.compiled_templates, id(ebuild))
+        if entry is not None and entry[0] is ebuild:
+            return entry[1]
+        key = tuple(ebuild)
+        template = _lru_get(self.compiled_by_content, key)
+        if template is None:
+            template = EbuildTemplate(key)
+            _lru_put(self.compiled_by_content, key, template, self.max_compiled_templates)
+        # template object is kept, so its id is not reused while it is in cache
+        _lru_put(self.compiled_templates, id(ebuild), (ebuild, template),
+                 self.max_compiled_templates)
+        return template
 
     def get_template(self, package, ebuild_data):
         """
@@ -116,10 +221,13 @@ class EbuildGeneratorFromFile(EbuildGenerator):
     def __init__(self, package_db, filename=""):
         super(EbuildGeneratorFromFile, self).__init__(package_db)
         self.filename = filename
+        self.template_files = {}
 
     def get_template(self, package, ebuild_data):
         """
         Generate ebuild template.
+        Every template file is read only once, the same
+        tuple of lines is returned for it every time.
 
         Args:
             package: g_collections.Package instance.
@@ -129,11 +237,13 @@ class EbuildGeneratorFromFile(EbuildGenerator):
             Ebuild template.
         """
         name = self.get_template_file(package, ebuild_data)
-        with open(name, 'r') as f:
-            ebuild = f.read().split('\n')
-            if ebuild[-1] == '':
-                ebuild = ebuild[:-1]
-        return ebuild
+        if not name in self.template_files:
+            with open(name, 'r') as f:
+                ebuild = f.read().split('\n')
+                if ebuild[-1] == '':
+                    ebuild = ebuild[:-1]
+            self.template_files[name] = tuple(ebuild)
+        return self.template_files[name]
 
     def get_template_file(self, package, ebuild_data):
         """
@@ -20,6 +20,9 @@ class DBError(GSorceryError):
 class DBLayoutError(GSorceryError):
     pass
 
+class DBReplacedError(DBLayoutError):
+    pass
+
 class InvalidKeyError(DBError):
     pass
 
@@ -0,0 +1,390 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    fetcher.py
+    ~~~~~~~~~~
+
+    in-process HTTP client
+
+    :copyright: (c) 2013-2015 by Jauhien Piatlicki
+    :license: GPL-2, see LICENSE for more details.
+"""
+
+import base64
+import os
+import shutil
+import socket
+import threading
+import zlib
+
+from .compatibility import getproxies, http_client, lzma, proxy_bypass, unquote, \
+     urlopen, urlparse, Request, HTTPError, URLError
+from .exceptions import DownloadingError
+
+BLOCK_SIZE = 65536
+DEFAULT_TIMEOUT = 60
+MAX_REDIRECTS = 10
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+# files with these suffixes are stored as they are sent, servers often
+# mark them with Content-Encoding header although their content is the file
+COMPRESSED_SUFFIXES = ('.gz', '.tgz', '.xz', '.txz', '.lzma', '.bz2', '.tbz2', '.zip')
+
+DECODING_ERRORS = (zlib.error, EnvironmentError)
+if lzma is not None:
+    DECODING_ERRORS += (lzma.LZMAError,)
+
+
+class FetchResult(object):
+    """
+    Result of fetching.
+
+    Attributes:
+        url: URL a file was fetched from after redirects.
+        status: HTTP status, 200 for other schemes.
+        headers: Dictionary with lowercase response header names as keys.
+        path: Path of a written file, None if nothing was written.
+    """
+    __slots__ = ('url', 'status', 'headers', 'path')
+
+    def __init__(self, url, status, headers, path):
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.path = path
+
+
+class Fetcher(object):
+    """
+    HTTP client that keeps idle keep-alive connections per host.
+
+    Files are streamed to disk, gzip and xz content encodings are decoded.
+    Compressed files (see COMPRESSED_SUFFIXES) are requested without
+    content encoding and written as they are.
+    Fetcher can be used from several threads simultaneously: a connection
+    is used by one request at a time and returned to the pool afterwards.
+    Proxies are taken from http_proxy, https_proxy and no_proxy
+    environment variables, HTTPS requests go through a proxy tunnel.
+    URIs with schemes other than http and https are fetched with urllib.
+    """
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, max_idle=4):
+        """
+        Args:
+            timeout: Default timeout for socket operations,
+        DEFAULT_TIMEOUT if None.
+            max_idle: Maximal number of idle connections kept per host.
+        """
+        if timeout is None:
+            timeout = DEFAULT_TIMEOUT
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.lock = threading.Lock()
+        self.idle = {}
+
+    def fetch(self, uri, directory, output="", headers=None, timeout=None):
+        """
+        Fetch a file.
+
+        Args:
+            uri: URI, URIs without scheme are considered to be HTTP ones.
+            directory: Directory where file should be saved.
+            output: Name of output file, last component of URI path
+        by default (before redirects).
+            headers: Dictionary with additional request headers.
+            timeout: Timeout for socket operations, default one of
+        the fetcher if None.
+
+        Returns:
+            FetchResult instance. If server answers with 304 nothing is written.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        if not "://" in uri:
+            uri = "http://" + uri
+        output = output or _url_file_name(uri)
+        path = os.path.join(directory, output)
+        decode = not output.lower().endswith(COMPRESSED_SUFFIXES)
+        url = uri
+        for _ in range(MAX_REDIRECTS + 1):
+            parsed = urlparse(url)
+            if not parsed.scheme in ("http", "https"):
+                return self._fetch_other(url, path, headers, timeout)
+            proxy = _get_proxy(parsed)
+            key = (parsed.scheme, parsed.netloc)
+            if proxy is not None:
+                key += (proxy.netloc,)
+            connection, response = self._request(key, parsed, proxy, headers, timeout, decode)
+            try:
+                status = response.status
+                location = response.getheader("Location")
+                if status in REDIRECT_CODES and location:
+                    response.read()
+                    url = _join_url(url, location)
+                    continue
+                response_headers = dict((name.lower(), value)
+                                        for name, value in response.getheaders())
+                if status == 304:
+                    response.read()
+                    return FetchResult(url, status, response_headers, None)
+                if status >= 400:
+                    response.read()
+                    raise DownloadingError("downloading failed: " + uri + ": "
+                                           + str(status) + " " + response.reason)
+                encoding = ""
+                if decode:
+                    encoding = response_headers.get("content-encoding", "")
+                _write_decoded(response, path, encoding, uri)
+                return FetchResult(url, status, response_headers, path)
+            except (http_client.HTTPException, socket.error) as e:
+                connection.close()
+                raise DownloadingError("downloading failed: " + uri + ": " + str(e))
+            finally:
+                self._release(key, connection, response)
+        raise DownloadingError("downloading failed: " + uri + ": too many redirects")
+
+    def _request(self, key, parsed, proxy, headers, timeout, decode=True):
+        """
+        Send a GET request reusing an idle connection if possible.
+
+        Args:
+            key: Tuple (scheme, host) or (scheme, host, proxy) identifying a connection.
+            parsed: Parsed URL.
+            proxy: Parsed proxy URL, None if no proxy is used.
+            headers: Dictionary with additional request headers.
+            timeout: Timeout for socket operations.
+            decode: Whether content encodings are accepted.
+
+        Returns:
+            A pair (connection, response).
+        """
+        path = parsed.path or "/"
+        if parsed.query:
+            path += "?" + parsed.query
+        request_headers = {"Accept-Encoding": "identity",
+                           "Connection": "keep-alive"}
+        if proxy is not None and parsed.scheme == "http":
+            path = parsed.scheme + "://" + parsed.netloc + path
+            request_headers.update(_proxy_headers(proxy))
+        if decode:
+            request_headers["Accept-Encoding"] = _accept_encoding()
+        if headers:
+            request_headers.update(headers)
+
+        # an idle connection may have been closed by server, then retry with a new one
+        for reused in (True, False):
+            connection = None
+            if reused:
+                connection = self._take_idle(key)
+                if connection is None:
+                    continue
+            else:
+                connection = self._connect(parsed, proxy, timeout)
+            try:
+                if timeout is not None and connection.sock is not None:
+                    connection.sock.settimeout(timeout)
+                connection.request("GET", path, headers=request_headers)
+                response = connection.getresponse()
+            except (http_client.HTTPException, socket.error) as e:
+                connection.close()
+                if reused:
+                    continue
+                raise DownloadingError("downloading failed: " + parsed.geturl() + ": " + str(e))
+            return (connection, response)
+
+    def _connect(self, parsed, proxy, timeout):
+        """
+        Create a new connection.
+
+        Args:
+            parsed: Parsed URL.
+            proxy: Parsed proxy URL, None if no proxy is used.
+            timeout: Timeout for socket operations.
+        """
+        if parsed.scheme == "https" or (proxy is not None and proxy.scheme == "https"):
+            cls = http_client.HTTPSConnection
+        else:
+            cls = http_client.HTTPConnection
+        host = parsed.netloc
+        if proxy is not None:
+            host = proxy.netloc.rpartition("@")[2]
+        if timeout is None:
+            connection = cls(host)
+        else:
+            connection = cls(host, timeout=timeout)
+        if proxy is not None and parsed.scheme == "https":
+            connection.set_tunnel(parsed.netloc, headers=_proxy_headers(proxy))
+        return connection
+
+    def _take_idle(self, key):
+        """
+        Take an idle connection from the pool.
+        """
+        with self.lock:
+            connections = self.idle.get(key)
+            if connections:
+                return connections.pop()
+        return None
+
+    def _release(self, key, connection, response):
+        """
+        Put a connection back to the pool if response was read
+        completely and server keeps it open.
+        """
+        if connection.sock is None or response.will_close \
+           or not response.isclosed():
+            connection.close()
+            return
+        with self.lock:
+            connections = self.idle.setdefault(key, [])
+            if len(connections) < self.max_idle:
+                connections.append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        """
+        Close all idle connections.
+        """
+        with self.lock:
+            idle = self.idle
+            self.idle = {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+    def _fetch_other(self, url, path, headers, timeout):
+        """
+        Fetch a file with urllib.
+
+        Args:
+            url: URL.
+            path: Path of output file.
+            headers: Dictionary with additional request headers.
+            timeout: Timeout for socket operations.
+        """
+        try:
+            response = urlopen(Request(url, headers=headers or {}), timeout=timeout)
+        except (HTTPError, URLError, socket.error) as e:
+            raise DownloadingError("downloading failed: " + url + ": " + str(e))
+        try:
+            with open(path, "wb") as f:
+                shutil.copyfileobj(response, f, BLOCK_SIZE)
+        except (URLError, socket.error) as e:
+            raise DownloadingError("downloading failed: " + url + ": " + str(e))
+        finally:
+            response.close()
+        return FetchResult(url, 200, {}, path)
+
+
+def _accept_encoding():
+    """
+    Get value of Accept-Encoding header.
+    """
+    if lzma is None:
+        return "gzip"
+    return "gzip, xz"
+
+
+def _get_proxy(parsed):
+    """
+    Get proxy for a URL from environment.
+
+    Args:
+        parsed: Parsed URL.
+
+    Returns:
+        Parsed proxy URL, None if URL should be fetched directly.
+    """
+    proxy = getproxies().get(parsed.scheme)
+    if not proxy or proxy_bypass(parsed.netloc):
+        return None
+    if not "://" in proxy:
+        proxy = "http://" + proxy
+    return urlparse(proxy)
+
+
+def _proxy_headers(proxy):
+    """
+    Get headers with proxy credentials.
+
+    Args:
+        proxy: Parsed proxy URL.
+
+    Returns:
+        Dictionary with headers, empty if proxy URL has no credentials.
+    """
+    if not proxy.username:
+        return {}
+    credentials = unquote(proxy.username) + ":" + unquote(proxy.password or "")
+    token = base64.b64encode(credentials.encode("utf-8")).decode("ascii")
+    return {"Proxy-Authorization": "Basic " + token}
+
+
+def _join_url(url, location):
+    """
+    Get URL a redirect points to.
+    """
+    if "://" in location:
+        return location
+    parsed = urlparse(url)
+    if location.startswith("/"):
+        return parsed.scheme + "://" + parsed.netloc + location
+    base = parsed.path.rsplit("/", 1)[0]
+    return parsed.scheme + "://" + parsed.netloc + base + "/" + location
+
+
+def _url_file_name(url):
+    """
+    Get file name from URL.
+    """
+    return os.path.basename(urlparse(url).path) or "index.html"
+
+
+def _write_decoded(response, path, encoding, uri):
+    """
+    Stream response body to a file decoding it.
+
+    Args:
+        response: HTTP response.
+        path: File path.
+        encoding: Content encoding.
+        uri: URI (used in error messages).
+    """
+    encoding = encoding.strip().lower()
+    if encoding in ("", "identity"):
+        decompressor = None
+    elif encoding in ("gzip", "x-gzip"):
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif encoding in ("xz", "x-xz") and lzma is not None:
+        decompressor = lzma.LZMADecompressor()
+    else:
+        raise DownloadingError("unsupported content encoding " + encoding + ": " + uri)
+    try:
+        with open(path, "wb") as f:
+            while True:
+                block = response.read(BLOCK_SIZE)
+                if not block:
+                    break
+                if decompressor is not None:
+                    block = decompressor.decompress(block)
+                f.write(block)
+            if decompressor is not None and hasattr(decompressor, "flush"):
+                f.write(decompressor.flush())
+    except DECODING_ERRORS as e:
+        raise DownloadingError("downloading failed: " + uri + ": " + str(e))
+
+
+_fetcher = None
+_fetcher_lock = threading.Lock()
+
+
+def get_fetcher():
+    """
+    Get the fetcher shared by all the downloads of a process.
+    """
+    global _fetcher
+    with _fetcher_lock:
+        if _fetcher is None:
+            _fetcher = Fetcher()
+        return _fetcher
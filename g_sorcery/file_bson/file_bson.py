@@ -11,6 +11,8 @@
     :license: GPL-2, see LICENSE for more details.
 """
 
+import hashlib
+
 import bson
 
 from g_sorcery.exceptions import FileJSONError
@@ -45,3 +47,4 @@ class FileBSON(FileJSONData):
         bcnt = bson.BSON.encode(rawcnt)
         with open(self.path, 'wb') as f:
             f.write(bcnt)
+        self.checksum = hashlib.md5(bcnt).hexdigest()
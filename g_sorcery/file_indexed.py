@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    file_indexed.py
+    ~~~~~~~~~~~~~~~
+
+    indexed binary file format with lazy decoding
+
+    :copyright: (c) 2013-2015 by Jauhien Piatlicki
+    :license: GPL-2, see LICENSE for more details.
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+
+from .compatibility import Mapping, MutableMapping
+from .exceptions import FileJSONError
+from .fileutils import FileJSONData, HashingWriter
+from .serialization import deserializeHook, to_raw_serializable
+
+MAGIC = b'GSIDX\x00\x01\x00'
+TRAILER = struct.Struct('>QQ')
+
+
+class IndexedMapping(MutableMapping):
+    """
+    Dictionary whose values are decoded from a memory mapped
+    file when they are accessed for the first time.
+
+    Decoded and changed values are kept in memory, file
+    is never modified. Index is shared with the file it comes
+    from and is copied before the first deletion.
+    """
+
+    def __init__(self, buf, index):
+        """
+        Args:
+            buf: Memory mapped file.
+            index: Dictionary with keys as keys and
+        [offset, length] pairs of encoded values as values.
+        """
+        self.buf = buf
+        self.index = index
+        self.index_owned = False
+        self.data = {}
+        self.converter = None
+
+    def __getitem__(self, key):
+        try:
+            return self.data[key]
+        except KeyError:
+            pass
+        offset, length = self.index[key]
+        value = json.loads(self.buf[offset:offset + length].decode('utf-8'),
+                           object_hook=deserializeHook)
+        if self.converter is not None:
+            value = self.converter(value)
+        self.data[key] = value
+        return value
+
+    def __contains__(self, key):
+        return key in self.data or key in self.index
+
+    def __iter__(self):
+        for key in self.index:
+            yield key
+        for key in self.data:
+            if not key in self.index:
+                yield key
+
+    def __len__(self):
+        return len(self.index) + len([key for key in self.data if not key in self.index])
+
+    def __setitem__(self, key, value):
+        self.data[key] = value
+
+    def __delitem__(self, key):
+        if not key in self:
+            raise KeyError(key)
+        self.data.pop(key, None)
+        if key in self.index:
+            if not self.index_owned:
+                self.index = dict(self.index)
+                self.index_owned = True
+            del self.index[key]
+
+    def __repr__(self):
+        return 'IndexedMapping(' + repr(list(self)) + ')'
+
+    def serialize(self):
+        return dict(self.items())
+
+    def close(self):
+        """
+        Close memory mapped file. Values that have not been
+        decoded yet can not be accessed after that.
+        """
+        self.buf.close()
+
+
+class FileIndexed(FileJSONData):
+    """
+    Class for indexed binary files.
+
+    Content should be a dictionary. Values of its entries
+    that are dictionaries themselves are encoded one by one
+    and read lazily as IndexedMapping instances, other values
+    are read at once.
+
+    File structure:
+        magic
+        encoded values
+        JSON header with other values and offsets of encoded values
+        offset and length of header
+
+    Values are encoded as JSON with custom serialization
+    provided by g_sorcery.serialization.
+
+    Memory mapped files stay open until close() is called.
+    """
+
+    def __init__(self, directory, name, mandatories=None):
+        super(FileIndexed, self).__init__(directory, name, mandatories)
+        self.buffers = []
+
+    def close(self):
+        """
+        Close memory mapped files of all the content read.
+        """
+        for buf in self.buffers:
+            buf.close()
+        self.buffers = []
+
+    def read_content(self):
+        """
+        Read indexed file.
+        """
+        with open(self.path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < len(MAGIC) + TRAILER.size:
+                raise FileJSONError('bad indexed file: ' + self.path)
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if buf[:len(MAGIC)] != MAGIC:
+            buf.close()
+            raise FileJSONError('bad indexed file: ' + self.path)
+        offset, length = TRAILER.unpack(buf[size - TRAILER.size:])
+        if offset < len(MAGIC) or offset + length > size - TRAILER.size:
+            buf.close()
+            raise FileJSONError('bad indexed file: ' + self.path)
+        self.buffers.append(buf)
+        header = json.loads(buf[offset:offset + length].decode('utf-8'),
+                            object_hook=deserializeHook)
+        content = header['values']
+        for key, index in header['index'].items():
+            content[key] = IndexedMapping(buf, index)
+        return content
+
+    def write_content(self, content):
+        """
+        Write indexed file.
+        """
+        if not isinstance(content, Mapping):
+            raise FileJSONError('indexed file content should be a dictionary: ' + self.path)
+        encode = json.JSONEncoder(separators=(',', ':')).encode
+        values = {}
+        indices = {}
+        with open(self.path, 'wb') as f:
+            writer = HashingWriter(f, hashlib.md5())
+            writer.write(MAGIC)
+            offset = len(MAGIC)
+            for key, value in content.items():
+                if not isinstance(value, Mapping):
+                    values[key] = to_raw_serializable(value)
+                    continue
+                index = {}
+                for entry_key, entry in value.items():
+                    data = encode(to_raw_serializable(entry)).encode('utf-8')
+                    writer.write(data)
+                    index[entry_key] = [offset, len(data)]
+                    offset += len(data)
+                indices[key] = index
+            header = encode({'values': values, 'index': indices}).encode('utf-8')
+            writer.write(header)
+            writer.write(TRAILER.pack(offset, len(header)))
+            writer.flush()
+        self.checksum = writer.hexdigest()
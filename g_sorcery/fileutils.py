@@ -11,19 +11,86 @@
     :license: GPL-2, see LICENSE for more details.
 """
 
+import ctypes
+import errno
 import glob
+import io
 import json
 import hashlib
 import os
+import pickle
+import shutil
+import sys
 import tarfile
 
-from .compatibility import TemporaryDirectory
+from .compatibility import TemporaryDirectory, lzma, urlparse
 from .exceptions import FileJSONError, DownloadingError
+from .fetcher import get_fetcher
+from .logger import Logger
 from .serialization import JSONSerializer, deserializeHook
 
+class HashingWriter(object):
+    """
+    File object wrapper that hashes all the data written through it.
+
+    Data is collected into blocks before being hashed and written,
+    so flush() should be called before a file is closed.
+    """
+    def __init__(self, f, hasher, blocksize=65536):
+        """
+        Args:
+            f: File object opened in binary mode.
+            hasher: Hasher.
+            blocksize: Size of blocks data is collected into.
+        """
+        self.f = f
+        self.hasher = hasher
+        self.blocksize = blocksize
+        self.chunks = []
+        self.size = 0
+        self.binary = False
+
+    def write(self, data):
+        """
+        Write data. Text is encoded as utf-8.
+        """
+        binary = isinstance(data, bytes)
+        if binary != self.binary:
+            self.flush()
+            self.binary = binary
+        self.chunks.append(data)
+        self.size += len(data)
+        if self.size >= self.blocksize:
+            self.flush()
+
+    def flush(self):
+        """
+        Hash and write collected data.
+        """
+        if not self.chunks:
+            return
+        if self.binary:
+            data = b''.join(self.chunks)
+        else:
+            data = u''.join(self.chunks).encode('utf-8')
+        self.chunks = []
+        self.size = 0
+        self.hasher.update(data)
+        self.f.write(data)
+
+    def hexdigest(self):
+        """
+        Get hash of the written data.
+        """
+        return self.hasher.hexdigest()
+
+
 class FileJSONData(object):
     """
     Class for files with JSON compatible data.
+
+    After a successful write checksum attribute contains MD5 hash
+    of a written file if write_content supports it, otherwise None.
     """
     def __init__(self, directory, name, mandatories=None):
         """
@@ -35,6 +102,7 @@ class FileJSONData(object):
         self.directory = os.path.abspath(directory)
         self.name = name
         self.path = os.path.join(directory, name)
+        self.checksum = None
         if not mandatories:
             self.mandatories = []
         else:
@@ -74,6 +142,7 @@ class FileJSONData(object):
                 raise FileJSONError('lack of mandatory key: ' + key)
         if not os.path.exists(self.directory):
             os.makedirs(self.directory)
+        self.checksum = None
         self.write_content(content)
 
     def write_content(self, content):
@@ -102,8 +171,11 @@ class FileJSON(FileJSONData):
         """
         Write JSON file.
         """
-        with open(self.path, 'w') as f:
-            json.dump(content, f, indent=2, sort_keys=True, cls=JSONSerializer)
+        with open(self.path, 'wb') as f:
+            writer = HashingWriter(f, hashlib.md5())
+            writer.write(JSONSerializer(indent=2, sort_keys=True).encode(content))
+            writer.flush()
+        self.checksum = writer.hexdigest()
 
 
 def hash_file(name, hasher, blocksize=65536):
@@ -125,40 +197,132 @@ def hash_file(name, hasher, blocksize=65536):
             buf = f.read(blocksize)
     return hasher.hexdigest()
 
-def copy_all(src, dst):
+def copy_all(src, dst, hardlink=False):
     """
     Copy entire tree.
 
+    Content of a source directory is copied to a destination directory,
+    hidden entries in the top level of a source directory are skipped.
+
     Args:
        src: Source.
        dst: Destination.
+       hardlink: Whether files should be hardlinked instead of copying
+    if possible.
     """
-    os.system("cp -rv " + src + "/* " + dst)
+    if not os.path.isdir(dst):
+        os.makedirs(dst)
+    for root, dirs, files in os.walk(src):
+        rel_root = os.path.relpath(root, src)
+        if rel_root == os.curdir:
+            rel_root = ''
+            dirs[:] = [d for d in dirs if not d.startswith('.')]
+            files = [f for f in files if not f.startswith('.')]
+        dst_root = os.path.join(dst, rel_root)
+        for d in dirs:
+            path = os.path.join(root, d)
+            if os.path.islink(path):
+                os.symlink(os.readlink(path), os.path.join(dst_root, d))
+            else:
+                os.mkdir(os.path.join(dst_root, d))
+        dirs[:] = [d for d in dirs if not os.path.islink(os.path.join(root, d))]
+        for f in files:
+            path = os.path.join(root, f)
+            dst_path = os.path.join(dst_root, f)
+            if os.path.islink(path):
+                os.symlink(os.readlink(path), dst_path)
+                continue
+            if hardlink:
+                try:
+                    os.link(path, dst_path)
+                    continue
+                except OSError:
+                    hardlink = False
+            shutil.copy2(path, dst_path)
+
+
+def _rename_exchange(src, dst):
+    """
+    Atomically exchange two paths.
+
+    Uses renameat2 system call with RENAME_EXCHANGE flag available on Linux.
+
+    Args:
+       src: First path.
+       dst: Second path.
+
+    Returns:
+       True if paths were exchanged, False if it is not supported.
+    """
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        renameat2 = libc.renameat2
+    except (AttributeError, OSError):
+        return False
+    at_fdcwd = -100
+    rename_exchange = 2
+    encoding = sys.getfilesystemencoding()
+    if not isinstance(src, bytes):
+        src = src.encode(encoding)
+    if not isinstance(dst, bytes):
+        dst = dst.encode(encoding)
+    if renameat2(at_fdcwd, src, at_fdcwd, dst, rename_exchange) == 0:
+        return True
+    error = ctypes.get_errno()
+    if error in (errno.ENOSYS, errno.EINVAL):
+        return False
+    raise OSError(error, os.strerror(error), dst)
+
+
+def replace_directory(src, dst):
+    """
+    Replace a directory with another one.
+
+    Replacement is atomic if the platform supports exchange of paths,
+    otherwise destination is missing for the time between two renames.
+    Both directories should be on the same filesystem.
+
+    Args:
+       src: New directory. After a call it contains the old content of
+    destination directory or does not exist if there was no destination.
+       dst: Directory to be replaced.
+    """
+    if not os.path.exists(dst):
+        os.rename(src, dst)
+        return
+    if _rename_exchange(src, dst):
+        return
+    backup = src + '.old'
+    os.rename(dst, backup)
+    try:
+        os.rename(src, dst)
+    except OSError:
+        os.rename(backup, dst)
+        raise
+    os.rename(backup, src)
 
 def wget(uri, directory, output="", timeout = None):
     """
     Fetch a file.
 
+    Files are fetched in-process by the shared fetcher.Fetcher,
+    the name is kept for compatibility.
+
     Args:
         uri: URI.
         directory: Directory where file should be saved.
         output: Name of output file.
-        timeout: Timeout for wget.
+        timeout: Timeout for socket operations.
 
     Returns:
         Nonzero in case of a failure.
     """
-    if timeout is None:
-        timeout_str = ' '
-    else:
-        timeout_str = ' -T ' + str(timeout)
-
-    if output:
-        ret = os.system('wget ' + uri +
-                        ' -O ' + os.path.join(directory, output) + timeout_str)
-    else:
-        ret = os.system('wget -P ' + directory + ' ' + uri + timeout_str)
-    return ret
+    try:
+        get_fetcher().fetch(uri, directory, output, timeout=timeout)
+    except DownloadingError as e:
+        Logger().error(str(e))
+        return 1
+    return 0
 
 def get_pkgpath(root = None):
     """
@@ -176,6 +340,27 @@ def get_pkgpath(root = None):
         root = os.path.realpath(root)
     return os.path.dirname(os.path.abspath(root))
 
+def new_whirlpool():
+    """
+    Get Whirlpool hasher.
+
+    hashlib provides Whirlpool only if OpenSSL supports it,
+    otherwise implementation from portage is used.
+
+    Returns:
+        Hasher.
+    """
+    try:
+        return hashlib.new('whirlpool')
+    except ValueError:
+        from portage.util import whirlpool
+        if getattr(whirlpool, 'WhirlpoolExt', None) is not None:
+            return whirlpool.CWhirlpool()
+        if hasattr(whirlpool, 'new'):
+            return whirlpool.new()
+        return whirlpool.PyWhirlpool()
+
+
 class ManifestEntry(object):
     """
     A manifest entry for a file.
@@ -190,25 +375,83 @@ class ManifestEntry(object):
         self.ftype = ftype
         self.digest()
 
-    def digest(self):
+    def digest(self, blocksize=65536):
         """
         Digest a file associated with a manifest entry.
+        File is read once in blocks, each block is fed to all the hashers.
+
+        Args:
+            blocksize: Blocksize.
         """
         h_sha256 = hashlib.new('SHA256')
         h_sha512 = hashlib.new('SHA512')
-        h_whirlpool = hashlib.new('whirlpool')
+        h_whirlpool = new_whirlpool()
+        size = 0
         with open(os.path.join(self.directory, self.name), 'rb') as f:
-            src = f.read()
-        h_sha256.update(src)
-        h_sha512.update(src)
-        h_whirlpool.update(src)
-        self.size = str(len(src))
+            buf = f.read(blocksize)
+            while len(buf) > 0:
+                size += len(buf)
+                h_sha256.update(buf)
+                h_sha512.update(buf)
+                h_whirlpool.update(buf)
+                buf = f.read(blocksize)
+        self.size = str(size)
         self.sha256 = h_sha256.hexdigest()
         self.sha512 = h_sha512.hexdigest()
         self.whirlpool = h_whirlpool.hexdigest()
 
 
-def fast_manifest(directory):
+def _ctime(path):
+    """
+    Get inode change time of a file with the best available precision.
+
+    Unlike modification time it can not be set to an older value,
+    so files restored with their original timestamps are still seen as new.
+    """
+    st = os.stat(path)
+    return getattr(st, 'st_ctime_ns', st.st_ctime)
+
+
+def manifest_up_to_date(directory, files):
+    """
+    Check whether Manifest of a package directory describes its files.
+
+    Manifest is up to date if it has entries exactly for the given files,
+    recorded sizes match and all the files were changed before Manifest
+    was written. Change time is compared, so a file changed in the same
+    clock tick as Manifest or restored with an older modification time
+    makes Manifest out of date.
+
+    Args:
+        directory: Package directory.
+        files: List of files to be digested.
+
+    Returns:
+        Boolean value.
+    """
+    manifest = os.path.join(directory, "Manifest")
+    if not os.path.isfile(manifest):
+        return False
+    manifest_ctime = _ctime(manifest)
+    sizes = {}
+    with open(manifest, 'r') as f:
+        for line in f:
+            entry = line.split()
+            if len(entry) < 3:
+                return False
+            sizes[entry[1]] = entry[2]
+    if len(sizes) != len(files):
+        return False
+    for path in files:
+        name = os.path.basename(path)
+        if sizes.get(name) != str(os.path.getsize(path)):
+            return False
+        if _ctime(path) >= manifest_ctime:
+            return False
+    return True
+
+
+def fast_manifest(directory, force=False):
     """
     Digest package directory.
     This function is intended to be used in place of repoman manifest,
@@ -216,14 +459,23 @@ def fast_manifest(directory):
 
     Args:
         directory: Directory.
+        force: Whether Manifest should be written even if it is
+    up to date.
     """
-    manifest = []
+    aux_files = glob.glob(os.path.join(directory, "files/*"))
+    ebuilds = glob.glob(os.path.join(directory, "*.ebuild"))
     metadata = os.path.join(directory, "metadata.xml")
+    files = aux_files + ebuilds
+    if (os.path.isfile(metadata)):
+        files.append(metadata)
+    if not force and manifest_up_to_date(directory, files):
+        return
 
-    for aux in glob.glob(os.path.join(directory, "files/*")):
+    manifest = []
+    for aux in aux_files:
         manifest.append(ManifestEntry(os.path.dirname(aux),
                             os.path.basename(aux), "AUX"))
-    for ebuild in glob.glob(os.path.join(directory, "*.ebuild")):
+    for ebuild in ebuilds:
         manifest.append(ManifestEntry(directory,
                             os.path.basename(ebuild), "EBUILD"))
     if (os.path.isfile(metadata)):
@@ -238,6 +490,130 @@ def fast_manifest(directory):
         f.write('\n'.join(manifest) + '\n')
 
 
+# maximal size of data unpacked from a downloaded file
+MAX_UNPACKED_SIZE = 4 * 1024 ** 3
+
+# version of HTTP cache entries, change it when their format changes
+HTTP_CACHE_VERSION = 1
+
+
+class SizeLimitedStream(io.RawIOBase):
+    """
+    Binary stream that fails if more than a given
+    number of bytes is read from an underlying stream.
+    """
+
+    def __init__(self, stream, max_size, name):
+        """
+        Args:
+            stream: Underlying binary stream.
+            max_size: Maximal number of bytes.
+            name: Stream name (used in error messages).
+        """
+        super(SizeLimitedStream, self).__init__()
+        self.stream = stream
+        self.max_size = max_size
+        self.name = name
+        self.size = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buf):
+        data = self.stream.read(len(buf))
+        self.size += len(data)
+        if self.size > self.max_size:
+            raise DownloadingError("unpacked data is too big: " + self.name)
+        buf[:len(data)] = data
+        return len(data)
+
+
+def open_stream(stream, name, open_mode='r', max_size=MAX_UNPACKED_SIZE):
+    """
+    Wrap a binary stream into a file object with size guard.
+
+    Args:
+        stream: Binary stream.
+        name: Stream name (used in error messages).
+        open_mode: Open mode, text mode if it has no 'b'.
+        max_size: Maximal number of bytes to be read.
+
+    Returns:
+        File object.
+    """
+    buffered = io.BufferedReader(SizeLimitedStream(stream, max_size, name))
+    if 'b' in open_mode:
+        return buffered
+    return io.TextIOWrapper(buffered)
+
+
+def copy_stream(stream, f_name, name, max_size=MAX_UNPACKED_SIZE):
+    """
+    Write a binary stream into a file with size guard.
+
+    Args:
+        stream: Binary stream.
+        f_name: File name.
+        name: Stream name (used in error messages).
+        max_size: Maximal number of bytes to be written.
+    """
+    with open(f_name, 'wb') as f:
+        shutil.copyfileobj(SizeLimitedStream(stream, max_size, name), f)
+
+
+def _safe_members(tar, max_size=MAX_UNPACKED_SIZE):
+    """
+    Check members of a tarball before extraction.
+
+    Args:
+        tar: tarfile.TarFile instance.
+        max_size: Maximal summary size of members.
+
+    Returns:
+        List of members that are regular files, directories or links.
+    """
+    members = []
+    size = 0
+    for member in tar.getmembers():
+        name = os.path.normpath(member.name)
+        if os.path.isabs(name) or name == '..' or name.startswith('..' + os.sep):
+            raise DownloadingError("unsafe path in tarball: " + member.name)
+        if member.islnk() or member.issym():
+            target = os.path.normpath(os.path.join(os.path.dirname(name),
+                                                   member.linkname))
+            if member.islnk():
+                target = os.path.normpath(member.linkname)
+            if os.path.isabs(member.linkname) or target == '..' \
+               or target.startswith('..' + os.sep):
+                raise DownloadingError("unsafe link in tarball: " + member.name)
+        elif not (member.isfile() or member.isdir()):
+            continue
+        size += member.size
+        if size > max_size:
+            raise DownloadingError("unpacked data is too big: " + tar.name)
+        members.append(member)
+    return members
+
+
+def extract_tarball(f_name, directory, max_size=MAX_UNPACKED_SIZE):
+    """
+    Extract a tarball in-process.
+
+    Members with paths outside of a target directory are rejected,
+    special files are skipped.
+
+    Args:
+        f_name: Tarball file name, any compression supported by tarfile.
+        directory: Target directory.
+        max_size: Maximal summary size of extracted files.
+    """
+    try:
+        with tarfile.open(f_name) as tar:
+            tar.extractall(directory, _safe_members(tar, max_size))
+    except (tarfile.TarError, EnvironmentError) as e:
+        raise DownloadingError("unpacking failed: " + f_name + ": " + str(e))
+
+
 def _call_parser(f_name, parser, open_file = True, open_mode = 'r'):
     """
     Call parser on a given file.
@@ -261,7 +637,29 @@ def _call_parser(f_name, parser, open_file = True, open_mode = 'r'):
     return {os.path.basename(f_name): data}
 
 
-def load_remote_file(uri, parser, open_file = True, open_mode = 'r', output = "", timeout = None):
+def _call_stream_parser(name, stream, parser, open_mode = 'r',
+                        max_size = MAX_UNPACKED_SIZE):
+    """
+    Call parser on a decompressed stream.
+
+    Args:
+        name: Name of a file the stream is read from.
+        stream: Binary stream.
+        parser: Parser function that accepts file objects.
+        open_mode: Open mode for a file.
+        max_size: Maximal number of bytes to be read.
+
+    Returns:
+        A dictionary with one entry. Key if a file name, content is
+    content returned by parser.
+    """
+    with open_stream(stream, name, open_mode, max_size) as f:
+        data = parser(f)
+    return {os.path.basename(name): data}
+
+
+def load_remote_file(uri, parser, open_file = True, open_mode = 'r', output = "", timeout = None,
+                     cache_dir = None, max_size = MAX_UNPACKED_SIZE):
     """
     Load files from an URI.
 
@@ -273,31 +671,221 @@ def load_remote_file(uri, parser, open_file = True, open_mode = 'r', output = ""
         output: What output name should downloaded file have.
         timeout: URI access timeout.
     (it will be a key identifying data loaded from this file)
+        cache_dir: Directory for HTTP cache. If given, HTTP URIs are
+    fetched conditionally and parsed data is reused if a file has not changed.
+        max_size: Maximal size of data unpacked from tarballs and xz files.
 
     Returns:
         Dictionary with a loaded data. Key is filename, content is data returned by parser.
     """
+    if cache_dir is not None and _http_url(uri):
+        return _load_cached_remote_file(uri, parser, open_file, open_mode,
+                                        output, timeout, cache_dir, max_size)
     download_dir = TemporaryDirectory()
+    get_fetcher().fetch(uri, download_dir.name, output, timeout=timeout)
+    loaded_data = _load_downloaded_files(download_dir.name, uri, parser,
+                                         open_file, open_mode, max_size)
+    del download_dir
+    return loaded_data
+
+
+def _load_downloaded_files(directory, uri, parser, open_file, open_mode,
+                           max_size = MAX_UNPACKED_SIZE):
+    """
+    Parse files downloaded into a directory.
+
+    Top level files from tarballs and xz files are decompressed
+    in-process. If parser accepts file objects decompressed data
+    is passed to it without writing it to disk.
+
+    Args:
+        directory: Download directory.
+        uri: URI files were downloaded from.
+        parser: Parser that will be applied to downloaded files.
+        open_file: Whether parser accepts a file descriptor.
+        open_mode: Open mode for a file.
+        max_size: Maximal size of unpacked data.
+
+    Returns:
+        Dictionary with a loaded data. Key is filename, content is data returned by parser.
+    """
     loaded_data = {}
-    if wget(uri, download_dir.name, output, timeout=timeout):
-        raise DownloadingError("wget failed: " + uri)
-    for f_name in glob.glob(os.path.join(download_dir.name, "*")):
+    for f_name in glob.glob(os.path.join(directory, "*")):
         if tarfile.is_tarfile(f_name):
-            unpack_dir = TemporaryDirectory()
-            with tarfile.open(f_name) as f:
-                f.extractall(unpack_dir.name)
-            for uf_name in glob.glob(os.path.join(unpack_dir, "*")):
-                loaded_data.update(_call_parser(uf_name, parser,
-                                    open_file=open_file, open_mode=open_mode))
-            del unpack_dir
+            if open_file:
+                loaded_data.update(_parse_tarball(f_name, uri, parser,
+                                                  open_mode, max_size))
+            else:
+                unpack_dir = TemporaryDirectory()
+                extract_tarball(f_name, unpack_dir.name, max_size)
+                for uf_name in glob.glob(os.path.join(unpack_dir.name, "*")):
+                    loaded_data.update(_call_parser(uf_name, parser,
+                                        open_file=open_file, open_mode=open_mode))
+                del unpack_dir
         else:
             name, extention = os.path.splitext(f_name)
             if extention in [".xz", ".lzma"]:
-                if (os.system("xz -d " + f_name)):
-                    raise DownloadingError("xz failed: "
+                if lzma is None:
+                    raise DownloadingError("lzma module is not available: "
                                 + f_name + " from " + uri)
+                try:
+                    with lzma.open(f_name, 'rb') as stream:
+                        if open_file:
+                            loaded_data.update(_call_stream_parser(name, stream, parser,
+                                                                   open_mode, max_size))
+                            continue
+                        copy_stream(stream, name, f_name, max_size)
+                except lzma.LZMAError as e:
+                    raise DownloadingError("xz failed: "
+                                + f_name + " from " + uri + ": " + str(e))
                 f_name = name
             loaded_data.update(_call_parser(f_name, parser,
                                 open_file=open_file, open_mode=open_mode))
+    return loaded_data
+
+
+def _parse_tarball(f_name, uri, parser, open_mode, max_size = MAX_UNPACKED_SIZE):
+    """
+    Parse top level files of a tarball without extracting them.
+
+    Args:
+        f_name: Tarball file name.
+        uri: URI a tarball was downloaded from.
+        parser: Parser function that accepts file objects.
+        open_mode: Open mode for a file.
+        max_size: Maximal size of unpacked data.
+
+    Returns:
+        Dictionary with a loaded data. Key is filename, content is data returned by parser.
+    """
+    loaded_data = {}
+    try:
+        with tarfile.open(f_name) as tar:
+            members = [member for member in _safe_members(tar, max_size)
+                       if member.isfile() and \
+                       not os.sep in os.path.normpath(member.name)]
+            for member in members:
+                loaded_data.update(_call_stream_parser(member.name,
+                                                       tar.extractfile(member),
+                                                       parser, open_mode, max_size))
+    except tarfile.TarError as e:
+        raise DownloadingError("unpacking failed: " + f_name + " from " + uri
+                               + ": " + str(e))
+    return loaded_data
+
+
+def _http_url(uri):
+    """
+    Get HTTP URL for an URI.
+
+    Args:
+        uri: URI, URIs without scheme are considered to be HTTP ones.
+
+    Returns:
+        URL or None if URI is not an HTTP one.
+    """
+    if not "://" in uri:
+        return "http://" + uri
+    if urlparse(uri).scheme in ("http", "https"):
+        return uri
+    return None
+
+
+def _parser_id(parser):
+    """
+    Get a string identifying a parser.
+
+    Args:
+        parser: Parser function, method, functools.partial or callable object.
+
+    Returns:
+        Module and qualified name of a parser.
+    """
+    func = getattr(parser, 'func', parser)
+    if not hasattr(func, '__name__'):
+        func = type(func)
+    name = getattr(func, '__qualname__', func.__name__)
+    return str(getattr(func, '__module__', '')) + '.' + name
+
+
+def _load_cached_remote_file(uri, parser, open_file, open_mode, output, timeout, cache_dir,
+                             max_size = MAX_UNPACKED_SIZE):
+    """
+    Load files from an HTTP URI using cache.
+
+    ETag and Last-Modified headers of a response are stored in cache
+    together with parsed data. Next time they are sent in a request
+    and if server answers that file has not been modified parsed
+    data is loaded from cache.
+
+    Cache entries are identified by URL, output name, parser and
+    HTTP_CACHE_VERSION. An entry whose data can not be unpickled
+    is discarded and the file is downloaded again.
+
+    Args:
+        uri: URI.
+        parser: Parser that will be applied to downloaded files.
+        open_file: Whether parser accepts a file descriptor.
+        open_mode: Open mode for a file.
+        output: What output name should downloaded file have.
+        timeout: URI access timeout.
+        cache_dir: Cache directory.
+        max_size: Maximal size of unpacked data.
+
+    Returns:
+        Dictionary with a loaded data. Key is filename, content is data returned by parser.
+    """
+    url = _http_url(uri)
+    key = "\n".join([str(HTTP_CACHE_VERSION), url, output, _parser_id(parser)])
+    key = hashlib.md5(key.encode("utf-8")).hexdigest()
+    info_f = FileJSON(cache_dir, key + ".json", [])
+    payload_path = os.path.join(cache_dir, key + ".pickle")
+
+    info = {}
+    if os.path.isfile(info_f.path) and os.path.isfile(payload_path):
+        info = info_f.read()
+    headers = {}
+    if info.get("etag"):
+        headers["If-None-Match"] = info["etag"]
+    if info.get("last_modified"):
+        headers["If-Modified-Since"] = info["last_modified"]
+
+    download_dir = TemporaryDirectory()
+    result = get_fetcher().fetch(url, download_dir.name, output,
+                                 headers=headers, timeout=timeout)
+    if result.status == 304:
+        if info:
+            try:
+                with open(payload_path, "rb") as f:
+                    return pickle.load(f)
+            except Exception:
+                # cached data is broken or was pickled by incompatible code
+                del download_dir
+                for path in (info_f.path, payload_path):
+                    if os.path.isfile(path):
+                        os.remove(path)
+                return _load_cached_remote_file(uri, parser, open_file, open_mode, output,
+                                                timeout, cache_dir, max_size)
+        raise DownloadingError("downloading failed: " + uri + ": unexpected 304")
+    loaded_data = _load_downloaded_files(download_dir.name, uri, parser,
+                                         open_file, open_mode, max_size)
     del download_dir
+
+    info = {"uri": url,
+            "etag": result.headers.get("etag"),
+            "last_modified": result.headers.get("last-modified")}
+    for path in (info_f.path, payload_path):
+        if os.path.isfile(path):
+            os.remove(path)
+    if info["etag"] or info["last_modified"]:
+        try:
+            payload = pickle.dumps(loaded_data, pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            # parsed data can not be cached
+            return loaded_data
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        with open(payload_path, "wb") as f:
+            f.write(payload)
+        info_f.write(info)
     return loaded_data
@@ -15,8 +15,12 @@
     :license: GPL-2, see LICENSE for more details.
 """
 
+import weakref
+
 import portage
 
+from .serialization import register_class
+
 class elist(list):
     '''Custom list type which adds a customized __str__()
     and takes an optional separator argument
@@ -46,6 +50,7 @@ class elist(list):
         return self._sep_.join(map(str, self))
 
 
+@register_class
 class serializable_elist(object):
     """
     A JSON serializable version of elist.
@@ -84,6 +89,7 @@ class serializable_elist(object):
 
 #todo: replace Package with something better
 
+@register_class
 class Package(object):
     """
     Class to store full package name: category/package-version
@@ -114,29 +120,63 @@ class Package(object):
         return Package(*value)
 
 
-#todo equality operator for Dependency, as it can be used in backend dependency solving algorithm
-
+@register_class
 class Dependency(object):
     """
     Class to store a dependency. Uses portage Atom.
+
+    Instances are immutable and interned: creating or deserializing
+    a dependency that is equal to an existing one returns the same
+    instance, so atom string of a dependency is parsed only once.
     """
 
-    __slots__ = ('atom', 'category', 'package', 'version', 'operator')
+    __slots__ = ('atom', 'category', 'package', 'version', 'operator',
+                 '__weakref__')
+
+    # (class, atom string) -> instance
+    _interned = weakref.WeakValueDictionary()
 
-    def __init__(self, category, package, version="", operator=""):
+    def __new__(cls, category, package, version="", operator=""):
         atom_str = operator + category + "/" + package
         if version:
             atom_str += "-" + str(version)
+        key = (cls, atom_str)
+        self = cls._interned.get(key)
+        if self is not None:
+            return self
+        self = object.__new__(cls)
         object.__setattr__(self, "atom", portage.dep.Atom(atom_str))
         object.__setattr__(self, "category", category)
         object.__setattr__(self, "package", package)
         object.__setattr__(self, "version", version)
         object.__setattr__(self, "operator", operator)
+        cls._interned[key] = self
+        return self
 
     def __setattr__(self, name, value):
         raise AttributeError("Dependency instances are immutable",
                              self.__class__, name, value)
 
+    def __reduce__(self):
+        return (self.__class__,
+                (self.category, self.package, self.version, self.operator))
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if not isinstance(other, Dependency):
+            return NotImplemented
+        return str(self.atom) == str(other.atom)
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    def __hash__(self):
+        return hash(str(self.atom))
+
     def __str__(self):
         return str(self.atom)
 
@@ -145,16 +185,23 @@ class Dependency(object):
 
     @classmethod
     def deserialize(cls, value):
+        self = cls._interned.get((cls, value))
+        if self is not None:
+            return self
+
         atom = portage.dep.Atom(value)
-        operator = portage.dep.get_operator(atom)
-        cpv = portage.dep.dep_getcpv(atom)
-        category, rest = portage.catsplit(cpv)
+        operator = atom.operator
+        category, rest = portage.catsplit(atom.cpv)
 
         if operator:
             package, version, revision = portage.pkgsplit(rest)
+            if revision != "r0":
+                version += "-" + revision
         else:
             package = rest
             version = ""
             operator = ""
 
-        return Dependency(category, package, version, operator)
+        self = cls(category, package, version, operator)
+        cls._interned[(cls, value)] = self
+        return self
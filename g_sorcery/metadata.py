@@ -11,6 +11,7 @@
     :license: GPL-2, see LICENSE for more details.
 """
 
+from .compatibility import basestring
 from .exceptions import XMLGeneratorError
 
 import xml.etree.ElementTree as ET
@@ -30,6 +31,83 @@ def prettify(tree):
     reparsed = minidom.parseString(rough_str)
     return reparsed.toprettyxml(encoding="utf-8").decode("utf-8")
 
+
+def _escape(data):
+    """
+    Escape data the same way minidom does it.
+    """
+    return data.replace("&", "&amp;").replace("<", "&lt;"). \
+        replace("\"", "&quot;").replace(">", "&gt;")
+
+
+def _normalize_text(text):
+    """
+    Normalize line ends in text the same way XML parser does it.
+    """
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return text
+
+
+def _write_element(chunks, element, indent):
+    """
+    Write an element with its children to a list of chunks.
+
+    Returns:
+        False if an element can not be serialized directly.
+    """
+    tag = element.tag
+    if not isinstance(tag, basestring) or '{' in tag:
+        return False
+    chunks.append(indent + "<" + tag)
+    for name, value in element.items():
+        if not isinstance(value, basestring):
+            return False
+        chunks.append(" " + name + "=\"" + _escape(value) + "\"")
+
+    children = []
+    if element.text:
+        children.append(element.text)
+    for child in element:
+        children.append(child)
+        if child.tail:
+            children.append(child.tail)
+
+    if not children:
+        chunks.append("/>\n")
+    elif len(children) == 1 and isinstance(children[0], basestring):
+        chunks.append(">" + _escape(_normalize_text(children[0])) +
+                      "</" + tag + ">\n")
+    else:
+        chunks.append(">\n")
+        for child in children:
+            if isinstance(child, basestring):
+                chunks.append(_escape(indent + "\t" + _normalize_text(child) + "\n"))
+            elif not _write_element(chunks, child, indent + "\t"):
+                return False
+        chunks.append(indent + "</" + tag + ">\n")
+    return True
+
+
+def serialize(tree):
+    """
+    Convert XML tree to a string in one pass.
+
+    Result is the same as the one of prettify, but the tree is
+    written directly. Trees with constructions not supported by
+    this function (namespaces, comments, etc.) are passed to prettify.
+
+    Args:
+        tree: xml.etree.ElementTree.Element instance
+
+    Returns:
+        A string with XML source.
+    """
+    chunks = ['<?xml version="1.0" encoding="utf-8"?>\n']
+    if not _write_element(chunks, tree, ""):
+        return prettify(tree)
+    return "".join(chunks)
+
 class XMLGenerator(object):
     """
     XML generator. Generates an XML tree according a given
@@ -215,16 +293,19 @@ class MetadataGenerator(object):
     """
     Metada generator. Generates metadata for a given package.
     """
-    def __init__(self, package_db, schema = None):
+    def __init__(self, package_db, schema = None, fast_serializer = False):
         """
         Args:
             package_db: Package database.
             schema: Schema of an XML tree.
+            fast_serializer: Whether XML tree should be converted to
+        a string directly instead of using minidom.
         """
         if not schema:
             schema = default_schema
         self.package_db = package_db
         self.xmlg = XMLGenerator('pkgmetadata', schema)
+        self.fast_serializer = fast_serializer
 
     def generate(self, package):
         """
@@ -236,10 +317,13 @@ class MetadataGenerator(object):
         Returns:
             Metadata source as a list of strings.
         """
-        description = self.package_db.get_package_description(package)
+        description = self.package_db.get_package_view(package)
         metadata = self.process(package, description)
         metadata = self.postprocess(package, description, metadata)
-        metadata = prettify(metadata)
+        if self.fast_serializer:
+            metadata = serialize(metadata)
+        else:
+            metadata = prettify(metadata)
         metadata = metadata.split('\n')
         if metadata[-1] == '':
             metadata = metadata[:-1]
@@ -11,21 +11,168 @@
     :license: GPL-2, see LICENSE for more details.
 """
 
+import functools
 import os
+import re
+import shutil
+import tempfile
+from multiprocessing.pool import ThreadPool
 
-import portage
-
-from .compatibility import basestring, py2k
+from .compact_storage import CompactStorage
+from .compatibility import basestring, py2k, MutableMapping
 
 from .db_layout import DBLayout, JSON_FILE_SUFFIX, SUPPORTED_DB_LAYOUTS, SUPPORTED_FILE_FORMATS
-from .exceptions import DBError, DBLayoutError, DBStructureError, InvalidKeyError, SyncError
-from .fileutils import FileJSON, load_remote_file, copy_all
+from .exceptions import DBError, DBLayoutError, DBReplacedError, DBStructureError, \
+     InvalidKeyError, SyncError
+from .file_indexed import IndexedMapping
+from .fileutils import FileJSON, load_remote_file, copy_all, replace_directory
 from .g_collections import Package
 from .logger import Logger
 from .syncer import SUPPORTED_SYNCERS
 
 SUPPORTED_DB_STRUCTURES=[0, 1]
 
+# how many times reading is started again if database is replaced meanwhile
+READ_ATTEMPTS = 3
+
+# version syntax and suffix order of portage.versions
+VERSION_RE = re.compile(r'^(\d+)((\.\d+)*)([a-z]?)((_(pre|p|beta|alpha|rc)\d*)*)(-r(\d+))?$')
+SUFFIX_RE = re.compile(r'^(alpha|beta|rc|pre|p)(\d*)$')
+SUFFIX_VALUES = {'alpha': -4, 'beta': -3, 'pre': -2, 'rc': -1, 'p': 0}
+# implicit _p-1 after the last suffix, so that 1_p1 > 1_p1_alpha
+SUFFIX_END = (0, -1)
+
+def version_key(version):
+    """
+    Get a sort key for a package version.
+
+    Version is parsed only once, keys are ordered as portage.vercmp
+    orders versions. Versions portage can not parse are compared
+    as strings and are considered to be older than valid ones.
+
+    Args:
+        version: Version string.
+
+    Returns:
+        Tuple that can be compared with keys of other versions.
+    """
+    match = VERSION_RE.match(version)
+    if match is None:
+        return (0, version)
+    components = []
+    if match.group(2):
+        for component in match.group(2)[1:].split('.'):
+            # portage compares components with leading zeros as decimal
+            # fractions, they are less than any component without them
+            if component.startswith('0'):
+                components.append((0, component.rstrip('0')))
+            else:
+                components.append((1, int(component)))
+    letter = match.group(4)
+    suffixes = []
+    if match.group(5):
+        for suffix in match.group(5)[1:].split('_'):
+            name, number = SUFFIX_RE.match(suffix).groups()
+            suffixes.append((SUFFIX_VALUES[name], int(number or 0)))
+    suffixes.append(SUFFIX_END)
+    revision = int(match.group(9) or 0)
+    return (1, (int(match.group(1)), tuple(components), ord(letter) if letter else 0,
+                tuple(suffixes), revision))
+
+
+def compare_versions(version1, version2):
+    """
+    Compare two package versions.
+
+    Versions portage can not parse are compared as strings
+    and are considered to be older than valid ones.
+
+    Returns:
+        Negative, zero or positive number as for cmp.
+    """
+    key1 = version_key(version1)
+    key2 = version_key(version2)
+    return (key1 > key2) - (key1 < key2)
+
+
+class PackageView(MutableMapping):
+    """
+    Package ebuild data layered over category common data.
+
+    Values from common data take precedence. The view does not copy
+    underlying dictionaries until it is changed: the first change
+    turns it into a private dictionary, so DB entries are never modified.
+    """
+
+    __slots__ = ('ebuild_data', 'common_data', 'data')
+
+    def __init__(self, ebuild_data, common_data):
+        """
+        Args:
+            ebuild_data: Package ebuild data.
+            common_data: Category common data.
+        """
+        self.ebuild_data = ebuild_data
+        self.common_data = common_data
+        self.data = None
+
+    def __getitem__(self, key):
+        if self.data is not None:
+            return self.data[key]
+        if key in self.common_data:
+            return self.common_data[key]
+        return self.ebuild_data[key]
+
+    def __contains__(self, key):
+        if self.data is not None:
+            return key in self.data
+        return key in self.common_data or key in self.ebuild_data
+
+    def __iter__(self):
+        if self.data is not None:
+            for key in self.data:
+                yield key
+            return
+        for key in self.ebuild_data:
+            if not key in self.common_data:
+                yield key
+        for key in self.common_data:
+            yield key
+
+    def __len__(self):
+        if self.data is not None:
+            return len(self.data)
+        return len(self.common_data) + \
+            len([key for key in self.ebuild_data if not key in self.common_data])
+
+    def __setitem__(self, key, value):
+        self._copy()[key] = value
+
+    def __delitem__(self, key):
+        del self._copy()[key]
+
+    def __repr__(self):
+        return repr(dict(self))
+
+    def copy(self):
+        """
+        Get a dictionary with package data, as dict.copy does.
+        """
+        return dict(self)
+
+    def _copy(self):
+        """
+        Turn the view into a private dictionary.
+        """
+        if self.data is None:
+            self.data = dict(self.ebuild_data)
+            self.data.update(self.common_data)
+        return self.data
+
+    def serialize(self):
+        return dict(self)
+
+
 class PackageDB(object):
     """
     Package database.
@@ -45,6 +192,16 @@ class PackageDB(object):
                 packages -- dictionary with packages (content of category dictionary in v. 0)
 
     For DB layout v. 0 only DB structure v. 0 is possible.
+
+    DB can be read lazily: then only metadata and list of categories
+    are read at once and packages file of every category is read
+    on the first access to this category.
+
+    If compact_json is set, JSON packages files are written
+    without indentation by CompactCategoryJSON.
+
+    If compact_storage is set, package descriptions are kept in memory
+    as read-only PackedEntry mappings created by CompactStorage.
     """
 
     class Iterator(object):
@@ -52,7 +209,7 @@ class PackageDB(object):
         Iterator class over the package database.
         """
         def __init__(self, package_db):
-            self.cats_iter = iter(package_db.database.items())
+            self.cats_iter = package_db._iter_category_data()
             try:
                 self.cat_name, self.cat_data = next(self.cats_iter)
             except StopIteration:
@@ -106,8 +263,7 @@ class PackageDB(object):
                             self.pkg_name, self.pkg_data = next(self.pkgs_iter)
                             self.vers_iter = iter(self.pkg_data.items())
 
-                ebuild_data = dict(ebuild_data)
-                ebuild_data.update(self.cat_data['common_data'])
+                ebuild_data = PackageView(ebuild_data, self.cat_data['common_data'])
                 return (Package(self.cat_name, self.pkg_name, ver), ebuild_data)
 
         else:
@@ -131,8 +287,7 @@ class PackageDB(object):
                             self.pkg_name, self.pkg_data = next(self.pkgs_iter)
                             self.vers_iter = iter(self.pkg_data.items())
 
-                ebuild_data = dict(ebuild_data)
-                ebuild_data.update(self.cat_data['common_data'])
+                ebuild_data = PackageView(ebuild_data, self.cat_data['common_data'])
                 return (Package(self.cat_name, self.pkg_name, ver), ebuild_data)
 
 
@@ -140,7 +295,9 @@ class PackageDB(object):
                  persistent_datadir = None,
                  preferred_layout_version=1,
                  preferred_db_version=1,
-                 preferred_category_format=JSON_FILE_SUFFIX):
+                 preferred_category_format=JSON_FILE_SUFFIX,
+                 compact_json=False,
+                 compact_storage=False):
 
         if preferred_layout_version == 0 \
            and preferred_db_version != 0:
@@ -166,7 +323,9 @@ class PackageDB(object):
         self.preferred_layout_version = preferred_layout_version
         self.preferred_db_version = preferred_db_version
         self.preferred_category_format = preferred_category_format
-        self.db_layout = DBLayout(self.directory)
+        self.compact_json = compact_json
+        self.compact_storage = compact_storage
+        self.db_layout = DBLayout(self.directory, compact_json)
         self.reset_db()
 
 
@@ -178,14 +337,30 @@ class PackageDB(object):
         """
         Reset database.
         """
+        self.db_layout.close()
         self.database = {}
         self.categories = {}
+        self.metadata = None
+        self.unloaded_categories = set()
+        self.package_index = {}
+        self.reverse_index = {}
+        self.sorted_versions = {}
+        self.dirty_categories = set()
+        if self.compact_storage:
+            self.storage = CompactStorage()
+        else:
+            self.storage = None
 
 
     def sync(self, db_uri, repository_config = None, sync_method="tgz"):
         """
         Synchronize local database with remote database.
 
+        Synced database is copied to a staging directory next to the
+        local database, its manifest is checked there and then it replaces
+        the local database with a rename. If anything fails the local
+        database is left untouched.
+
         Args:
             db_uri: URI for synchronization with remote database.
             repository_config: repository config.
@@ -211,10 +386,18 @@ class PackageDB(object):
         tempdb.db_layout.check_manifest()
 
         self.logger.info("copy files to an actual database")
-        self.clean()
-        copy_all(tempdb_dir, self.directory)
-
-        self.db_layout.check_manifest()
+        parent_dir = os.path.dirname(self.directory)
+        if not os.path.exists(parent_dir):
+            os.makedirs(parent_dir)
+        staging_dir = tempfile.mkdtemp(prefix='.' + os.path.basename(self.directory) + '.sync-',
+                                       dir=parent_dir)
+        try:
+            copy_all(tempdb_dir, staging_dir, hardlink=synced_data.transient)
+            DBLayout(staging_dir).check_manifest()
+            replace_directory(staging_dir, self.directory)
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+        self.reset_db()
 
         del synced_data
 
@@ -223,52 +406,361 @@ class PackageDB(object):
         """
         Clean database.
         """
+        self.db_layout.close()
         self.db_layout.clean()
         self.reset_db()
 
 
-    def write(self):
+    def close(self):
         """
-        Write and digest database.
+        Close files of a database that has been read.
+
+        Packages that have not been accessed yet can not
+        be read after that.
         """
-        if self.database:
-            self.logger.info("writing database...")
+        self.db_layout.close()
 
+
+    def write(self, incremental=False):
+        """
+        Write and digest database.
+
+        Args:
+            incremental: Whether only categories changed since the database
+        was read should be written. Unchanged files are hardlinked
+        into an updated database that atomically replaces the old one. Full write is done if database was not read
+        or if its layout, structure or file format differ from preferred ones.
+        """
         metadata = {'db_version': self.preferred_db_version,
                     'layout_version': self.preferred_layout_version,
                     'category_format': self.preferred_category_format}
 
-        if self.preferred_db_version == 0:
-            packages = dict(self.database)
-            for category, cat_data in packages.items():
-                for _, versions in cat_data['packages'].items():
-                    for version, ebuild_data in versions.items():
-                        ebuild_data.update(cat_data['common_data'])
-                packages[category] = cat_data['packages']
-        else:
-            packages = dict(self.database)
+        if incremental and self.metadata == metadata \
+           and self.preferred_layout_version != 0:
+            self._write_dirty_categories(metadata)
+            return
 
-        self.db_layout.write(metadata, self.categories, packages)
+        self._load_all_categories()
+        if self.database:
+            self.logger.info("writing database...")
+
+        packages = {}
+        for category, cat_data in self.database.items():
+            packages[category] = self._get_category_content(cat_data)
+
+        self.package_index = self._build_package_index()
+        self.reverse_index = self._build_reverse_index()
+        index = {'packages': self.package_index,
+                 'reverse_dependencies': self.reverse_index}
+
+        self.db_layout.write(metadata, self.categories, packages, index)
+        self.metadata = metadata
+        self.dirty_categories = set()
 
         if self.database:
             self.logger.info("database written")
 
 
-    def read(self):
+    def _write_dirty_categories(self, metadata):
+        """
+        Write categories changed since the database was read.
+
+        Args:
+            metadata: DB metadata.
+        """
+        if not self.dirty_categories:
+            return
+        self.logger.info("updating database...")
+
+        packages = {}
+        for category in self.dirty_categories:
+            cat_data = self._get_category_data(category)
+            if cat_data is None:
+                raise DBStructureError('Empty category: ' + category)
+            packages[category] = self._get_category_content(cat_data)
+
+        if self.package_index is None:
+            self.package_index = self._build_package_index()
+        old_index = self.db_layout.read_index(metadata)
+        if old_index is None or not 'reverse_dependencies' in old_index:
+            self.reverse_index = self._build_reverse_index()
+        else:
+            self.reverse_index = self._patch_reverse_index(old_index['reverse_dependencies'],
+                                                           self.dirty_categories)
+        index = {'packages': self.package_index,
+                 'reverse_dependencies': self.reverse_index}
+
+        self.db_layout.update(metadata, self.categories, packages, index)
+        self.dirty_categories = set()
+
+        self.logger.info("database updated")
+
+
+    def _get_category_content(self, cat_data):
+        """
+        Convert in memory category data to the content of a category file.
+
+        Args:
+            cat_data: Category dictionary.
+
+        Returns:
+            Content of a category file for preferred DB version.
+        """
+        if self.preferred_db_version != 0:
+            return cat_data
+        packages = {}
+        for name, versions in cat_data['packages'].items():
+            packages[name] = {}
+            for version, ebuild_data in versions.items():
+                ebuild_data = dict(ebuild_data)
+                ebuild_data.update(cat_data['common_data'])
+                packages[name][version] = ebuild_data
+        return packages
+
+
+    def read(self, lazy=False, full_verify=False):
         """
         Read database.
+
+        If database is replaced by sync or by incremental write
+        of another process while it is being read, reading starts again.
+        Lazily read database is read again if it is replaced before
+        all the categories are loaded and it has no unwritten changes.
+
+        Args:
+            lazy: Whether category files should be read only
+        when they are accessed for the first time.
+            full_verify: Whether all the files should be hashed
+        during manifest check, even those that were verified before.
         """
-        metadata, self.categories, packages = self.db_layout.read()
+        for attempt in range(READ_ATTEMPTS):
+            try:
+                self._read(lazy, full_verify)
+                return
+            except DBReplacedError:
+                if attempt == READ_ATTEMPTS - 1:
+                    raise
+                self.logger.info("database was replaced, reading it again")
 
-        db_version = metadata['db_version']
-        self.database = packages
-        if db_version == 0:
-            for category, cat_data in self.database.items():
-                self.database[category] = {'common_data': {}, 'packages': cat_data}
-        elif db_version == 1:
-            pass
+
+    def _read(self, lazy, full_verify):
+        """
+        Read database once.
+
+        Args:
+            lazy: Whether category files should be read only
+        when they are accessed for the first time.
+            full_verify: Whether all the files should be hashed
+        during manifest check.
+        """
+        self.db_layout.close()
+        self.db_layout.full_verify = full_verify
+        if lazy:
+            metadata, self.categories = self.db_layout.read_metadata()
+            self.database = {}
+            self.unloaded_categories = set(self.categories)
         else:
+            metadata, self.categories, packages = self.db_layout.read()
+            self.database = {}
+            self.unloaded_categories = set()
+
+        self.sorted_versions = {}
+
+        db_version = metadata['db_version']
+        if not db_version in SUPPORTED_DB_STRUCTURES:
             raise DBStructureError("Unsupported DB version: " + str(db_version))
+        self.metadata = metadata
+
+        if lazy:
+            index = self.db_layout.read_index(metadata)
+            if index is None:
+                self.package_index = None
+                self.reverse_index = None
+            else:
+                self.package_index = index['packages']
+                self.reverse_index = index.get('reverse_dependencies')
+        else:
+            for category, cat_data in packages.items():
+                self.database[category] = self._convert_category_data(category, cat_data)
+            self.package_index = self._build_package_index()
+            index = self.db_layout.read_index(metadata, check=False)
+            if index is None:
+                self.reverse_index = None
+            else:
+                self.reverse_index = index.get('reverse_dependencies')
+        self.dirty_categories = set()
+
+
+    def _build_package_index(self):
+        """
+        Build package name index.
+
+        Returns:
+            Dictionary with package names as keys and lists
+        of categories that contain a package as values.
+        """
+        index = {}
+        for category, cat_data in self._iter_category_data():
+            for name in cat_data['packages']:
+                index.setdefault(name, []).append(category)
+        return index
+
+
+    def _build_reverse_index(self):
+        """
+        Build reverse dependency index.
+
+        Returns:
+            Dictionary with category/name of a package as keys and
+        sorted lists of category/name of packages that depend on it
+        as values.
+        """
+        index = {}
+        for category, cat_data in self._iter_category_data():
+            self._add_reverse_dependencies(index, category, cat_data)
+        return dict((key, sorted(value)) for key, value in index.items())
+
+
+    def _patch_reverse_index(self, reverse_index, categories):
+        """
+        Update reverse dependency index for changed categories.
+
+        Args:
+            reverse_index: Reverse dependency index before changes.
+            categories: Changed categories, they should be loaded.
+
+        Returns:
+            Updated reverse dependency index.
+        """
+        index = {}
+        for key, dependents in reverse_index.items():
+            dependents = set(dependent for dependent in dependents
+                             if not dependent.split('/', 1)[0] in categories)
+            if dependents:
+                index[key] = dependents
+        for category in categories:
+            self._add_reverse_dependencies(index, category, self.database[category])
+        return dict((key, sorted(value)) for key, value in index.items())
+
+
+    def _add_reverse_dependencies(self, index, category, cat_data):
+        """
+        Add dependencies of packages from a category to reverse dependency index.
+
+        Args:
+            index: Dictionary with category/name of a package as keys and
+        sets of category/name of packages that depend on it as values.
+            category: Category name.
+            cat_data: Category dictionary.
+        """
+        common_data = cat_data['common_data']
+        for name, versions in cat_data['packages'].items():
+            catpkg = category + '/' + name
+            for ebuild_data in versions.values():
+                view = PackageView(ebuild_data, common_data)
+                for dependency in view.get('dependencies', []):
+                    dep_catpkg = dependency.category + '/' + dependency.package
+                    index.setdefault(dep_catpkg, set()).add(catpkg)
+
+
+    def _convert_category_data(self, category, cat_data):
+        """
+        Convert content of a category file to the in memory DB structure.
+
+        Args:
+            category: Category name.
+            cat_data: Content of a category file.
+
+        Returns:
+            Category dictionary with common_data and packages entries.
+        """
+        if self.metadata['db_version'] == 0:
+            cat_data = {'common_data': {}, 'packages': cat_data}
+        if self.storage is not None:
+            packages = cat_data['packages']
+            if isinstance(packages, IndexedMapping):
+                # pack packages from indexed files when they are decoded
+                packages.converter = functools.partial(self._pack_versions, category)
+            else:
+                for versions in packages.values():
+                    self._pack_versions(category, versions)
+        return cat_data
+
+
+    def _pack_versions(self, category, versions):
+        """
+        Pack ebuild data of all versions of a package.
+
+        Args:
+            category: Category name.
+            versions: Dictionary with versions as keys and ebuild data as values.
+
+        Returns:
+            Dictionary with packed ebuild data.
+        """
+        for version, ebuild_data in versions.items():
+            versions[version] = self.storage.pack(category, ebuild_data)
+        return versions
+
+
+    def _load_category(self, category):
+        """
+        Read a category that has not been read yet.
+
+        Args:
+            category: Category name.
+        """
+        try:
+            cat_data = self.db_layout.read_category(self.metadata, category)
+        except DBReplacedError:
+            if self.dirty_categories:
+                raise
+            # already loaded categories come from the replaced database
+            self.read(lazy=True, full_verify=self.db_layout.full_verify)
+            if not category in self.unloaded_categories:
+                return
+            cat_data = self.db_layout.read_category(self.metadata, category)
+        self.database[category] = self._convert_category_data(category, cat_data)
+        self.unloaded_categories.discard(category)
+
+
+    def _load_all_categories(self):
+        """
+        Read all the categories that have not been read yet.
+        """
+        for category in list(self.unloaded_categories):
+            self._load_category(category)
+
+
+    def _get_category_data(self, category):
+        """
+        Get category data reading it if needed.
+
+        Args:
+            category: Category name.
+
+        Returns:
+            Category dictionary or None if there is no data for the category.
+        """
+        if category in self.unloaded_categories:
+            self._load_category(category)
+        return self.database.get(category)
+
+
+    def _iter_category_data(self):
+        """
+        Iterate over categories with data reading them if needed.
+
+        Returns:
+            Iterator over (category name, category dictionary) pairs.
+        """
+        loaded = list(self.database)
+        unloaded = [category for category in self.categories
+                    if category in self.unloaded_categories]
+        for category in loaded + unloaded:
+            cat_data = self._get_category_data(category)
+            if cat_data is not None:
+                yield category, cat_data
 
 
     def add_category(self, category, description=None):
@@ -282,6 +774,7 @@ class PackageDB(object):
         if not description:
             description = {}
         self.categories[category] = description
+        self.dirty_categories.add(category)
 
 
     def set_common_data(self, category, common_data):
@@ -295,10 +788,13 @@ class PackageDB(object):
         if not category in self.categories:
             raise InvalidKeyError('Non-existent category: ' + category)
 
-        if not category in self.database:
+        cat_data = self._get_category_data(category)
+        if cat_data is None:
             self.database[category] = {'common_data': common_data, 'packages': {}}
         else:
-            self.database[category]['common_data'] = common_data
+            cat_data['common_data'] = common_data
+        self.dirty_categories.add(category)
+        self.reverse_index = None
 
 
     def get_common_data(self, category):
@@ -314,10 +810,11 @@ class PackageDB(object):
         if not category in self.categories:
             raise InvalidKeyError('Non-existent category: ' + category)
 
-        if not category in self.database:
+        cat_data = self._get_category_data(category)
+        if cat_data is None:
             return {}
         else:
-            return self.database[category]['common_data']
+            return cat_data['common_data']
 
 
     def add_package(self, package, ebuild_data=None):
@@ -330,6 +827,8 @@ class PackageDB(object):
         """
         if not ebuild_data:
             ebuild_data = {}
+        elif isinstance(ebuild_data, PackageView):
+            ebuild_data = dict(ebuild_data)
 
         category = package.category
         name = package.name
@@ -341,13 +840,22 @@ class PackageDB(object):
         if not category in self.categories:
             raise InvalidKeyError('Non-existent category: ' + category)
 
-        if not category in self.database:
-            self.database[category] = {'common_data': {}, 'packages': {}}
+        cat_data = self._get_category_data(category)
+        if cat_data is None:
+            cat_data = {'common_data': {}, 'packages': {}}
+            self.database[category] = cat_data
 
-        if not name in self.database[category]['packages']:
-            self.database[category]['packages'][name] = {}
+        if not name in cat_data['packages']:
+            cat_data['packages'][name] = {}
+            if self.package_index is not None:
+                self.package_index.setdefault(name, []).append(category)
+        self.reverse_index = None
 
-        self.database[category]['packages'][name][version] = ebuild_data
+        if self.storage is not None:
+            ebuild_data = self.storage.pack(category, ebuild_data)
+        cat_data['packages'][name][version] = ebuild_data
+        self.dirty_categories.add(category)
+        self.sorted_versions.pop((category, name), None)
 
 
     def list_categories(self):
@@ -374,10 +882,45 @@ class PackageDB(object):
         if not category or (not category in self.categories):
             raise InvalidKeyError('No such category: ' + category)
 
-        if not category in self.database:
+        cat_data = self._get_category_data(category)
+        if cat_data is None:
             return False
 
-        return name in self.database[category]['packages']
+        return name in cat_data['packages']
+
+
+    def list_package_categories(self, name):
+        """
+        List categories that contain a package with a given name.
+
+        Args:
+            name: Package name.
+
+        Returns:
+            List of category names.
+        """
+        if self.package_index is None:
+            self.package_index = self._build_package_index()
+        return list(self.package_index.get(name, []))
+
+
+    def reverse_dependencies(self, category, name):
+        """
+        List packages that depend on a given package.
+
+        Any version of a package that depends on any version
+        of a given package is taken into account.
+
+        Args:
+            category: Category name.
+            name: Package name.
+
+        Returns:
+            Sorted list of category/name of packages.
+        """
+        if self.reverse_index is None:
+            self.reverse_index = self._build_reverse_index()
+        return list(self.reverse_index.get(category + '/' + name, []))
 
 
     def list_package_names(self, category):
@@ -393,10 +936,11 @@ class PackageDB(object):
         if not category or (not category in self.categories):
             raise InvalidKeyError('No such category: ' + category)
 
-        if not category in self.database:
+        cat_data = self._get_category_data(category)
+        if cat_data is None:
             return []
 
-        return list(self.database[category]['packages'])
+        return list(cat_data['packages'])
 
 
     def list_catpkg_names(self):
@@ -407,19 +951,21 @@ class PackageDB(object):
             List with category/package entries.
         """
         result = []
-        for category, cat_data in self.database.items():
+        for category, cat_data in self._iter_category_data():
             for name in cat_data['packages']:
                 result.append(category + '/' + name)
         return result
 
 
-    def list_package_versions(self, category, name):
+    def list_package_versions(self, category, name, sorted=False):
         """
         List package versions.
 
         Args:
             category: Category name.
             name: package name.
+            sorted: Whether versions should be sorted from the oldest
+        to the recent one.
 
         Returns:
             List of package versions.
@@ -427,11 +973,36 @@ class PackageDB(object):
         if not category or (not category in self.categories):
             raise InvalidKeyError('No such category: ' + category)
 
-        if not category in self.database \
-           or not name in self.database[category]['packages']:
+        cat_data = self._get_category_data(category)
+        if cat_data is None or not name in cat_data['packages']:
             raise InvalidKeyError('No such package: ' + category + '/' + name)
 
-        return list(self.database[category]['packages'][name])
+        if sorted:
+            return list(self._get_sorted_versions(category, name,
+                                                  cat_data['packages'][name]))
+        return list(cat_data['packages'][name])
+
+
+    def _get_sorted_versions(self, category, name, versions):
+        """
+        Get sorted versions of a package.
+
+        Versions are sorted once and cached until the package changes.
+
+        Args:
+            category: Category name.
+            name: Package name.
+            versions: Versions dictionary of a package.
+
+        Returns:
+            Tuple of versions sorted from the oldest to the recent one.
+        """
+        key = (category, name)
+        result = self.sorted_versions.get(key)
+        if result is None:
+            result = tuple(sorted(versions, key=version_key))
+            self.sorted_versions[key] = result
+        return result
 
 
     def list_all_packages(self):
@@ -442,7 +1013,7 @@ class PackageDB(object):
             List of g_collections.Package instances.
         """
         result = []
-        for category, cat_data in self.database.items():
+        for category, cat_data in self._iter_category_data():
             for name, versions in cat_data['packages'].items():
                 for version in versions:
                     result.append(Package(category, name, version))
@@ -460,12 +1031,32 @@ class PackageDB(object):
             Dictionary with package ebuild data.
         """
         #a possible exception should be catched in the caller
-        desc = dict(self.database[package.category]['packages']\
-                    [package.name][package.version])
-        desc.update(self.database[package.category]['common_data'])
+        cat_data = self._get_category_data(package.category)
+        if cat_data is None:
+            raise KeyError(package.category)
+        desc = dict(cat_data['packages'][package.name][package.version])
+        desc.update(cat_data['common_data'])
         return desc
 
 
+    def get_package_view(self, package):
+        """
+        Get package ebuild data without copying it.
+
+        Args:
+            package: g_collections.Package instance.
+
+        Returns:
+            PackageView instance with package ebuild data.
+        """
+        #a possible exception should be catched in the caller
+        cat_data = self._get_category_data(package.category)
+        if cat_data is None:
+            raise KeyError(package.category)
+        return PackageView(cat_data['packages'][package.name][package.version],
+                           cat_data['common_data'])
+
+
     def get_max_version(self, category, name):
         """
         Get the recent available version of a package.
@@ -480,18 +1071,12 @@ class PackageDB(object):
         if not category or (not category in self.categories):
             raise InvalidKeyError('No such category: ' + category)
 
-        if not category in self.database \
-           or not name in self.database[category]['packages']:
+        cat_data = self._get_category_data(category)
+        if cat_data is None or not name in cat_data['packages']:
             raise InvalidKeyError('No such package: ' + category + '/' + name)
 
-        pkgname = category + '/' + name
-        versions = list(self.database[category]['packages'][name])
-        max_ver = versions[0]
-        for version in versions[1:]:
-            if portage.pkgcmp(portage.pkgsplit(pkgname + '-' + version),
-                              portage.pkgsplit(pkgname + '-' + max_ver)) > 0:
-                max_ver = version
-        return max_ver
+        return self._get_sorted_versions(category, name,
+                                         cat_data['packages'][name])[-1]
 
 
 class DBGenerator(object):
@@ -500,16 +1085,23 @@ class DBGenerator(object):
     Creates new databases or syncs with existing.
     """
 
-    __slots__ = ('package_db_class')
+    __slots__ = ('package_db_class', 'preferred_layout_version',
+                 'preferred_db_version', 'preferred_category_format',
+                 'compact_json', 'compact_storage', 'http_cache_dir')
 
     def __init__(self, package_db_class=PackageDB,
                  preferred_layout_version=1,
                  preferred_db_version=1,
-                 preferred_category_format=JSON_FILE_SUFFIX):
+                 preferred_category_format=JSON_FILE_SUFFIX,
+                 compact_json=False,
+                 compact_storage=False):
         self.package_db_class = package_db_class
         self.preferred_layout_version = preferred_layout_version
         self.preferred_db_version = preferred_db_version
         self.preferred_category_format = preferred_category_format
+        self.compact_json = compact_json
+        self.compact_storage = compact_storage
+        self.http_cache_dir = None
 
 
     def __call__(self, directory, repository,
@@ -543,7 +1135,9 @@ class DBGenerator(object):
                                        preferred_layout_version=self.preferred_layout_version,
                                        preferred_db_version=self.preferred_db_version,
                                        preferred_category_format=self.preferred_category_format,
-                                       persistent_datadir=persistent_datadir)
+                                       persistent_datadir=persistent_datadir,
+                                       compact_json=self.compact_json,
+                                       compact_storage=self.compact_storage)
 
         config_f = FileJSON(os.path.join(directory, repository),
                             "config.json", [])
@@ -574,9 +1168,29 @@ class DBGenerator(object):
             common_config: Backend config.
             config: Repository config.
         """
+        self.http_cache_dir = self.get_http_cache_dir(pkg_db, common_config, config)
         data = self.download_data(common_config, config)
         self.process_data(pkg_db, data, common_config, config)
 
+    def get_http_cache_dir(self, pkg_db, common_config, config):
+        """
+        Get directory for HTTP cache.
+
+        HTTP cache is used if http_cache entry of repository config
+        is true. It is kept in persistent data directory of a database.
+
+        Args:
+            pkg_db: Package database.
+            common_config: Backend config.
+            config: Repository config.
+
+        Returns:
+            Cache directory or None if cache should not be used.
+        """
+        if not config.get("http_cache") or pkg_db.persistent_datadir is None:
+            return None
+        return os.path.join(pkg_db.persistent_datadir, "http_cache")
+
     def download_data(self, common_config, config):
         """
         Obtain data for database generation.
@@ -590,11 +1204,55 @@ class DBGenerator(object):
         """
         uries = self.get_download_uries(common_config, config)
         uries = self.decode_download_uries(uries)
+        concurrency = self.get_download_concurrency(common_config, config)
         data = {}
-        for uri in uries:
-            self.process_uri(uri, data)
+        if concurrency <= 1 or len(uries) <= 1:
+            for uri in uries:
+                self.process_uri(uri, data)
+            return data
+
+        pool = ThreadPool(min(concurrency, len(uries)))
+        try:
+            for uri_data in pool.imap(self._download_uri, uries):
+                data.update(uri_data)
+        finally:
+            pool.close()
+            pool.join()
         return data
 
+    def _download_uri(self, uri):
+        """
+        Download and parse data from a given URI into a new dictionary.
+
+        Args:
+            uri: URI.
+
+        Returns:
+            Data dictionary.
+        """
+        data = {}
+        self.process_uri(uri, data)
+        return data
+
+    def get_download_concurrency(self, common_config, config):
+        """
+        Get number of URIes to be downloaded simultaneously.
+
+        It is taken from download_concurrency entry of repository
+        config, 1 by default. When it is greater than 1, process_uri
+        is called for every URI with its own empty data dictionary
+        and results are merged into the data dictionary in the order
+        of URIes.
+
+        Args:
+            common_config: Backend config.
+            config: Repository config.
+
+        Returns:
+            Number of simultaneous downloads.
+        """
+        return int(config.get("download_concurrency", 1))
+
     def process_uri(self, uri, data):
         """
         Download and parse data from a given URI.
@@ -603,6 +1261,8 @@ class DBGenerator(object):
             uri: URI.
             data: Data dictionary.
         """
+        if self.http_cache_dir is not None and not "cache_dir" in uri:
+            uri = dict(uri, cache_dir=self.http_cache_dir)
         data.update(load_remote_file(**uri))
 
     def get_download_uries(self, common_config, config):
@@ -16,6 +16,55 @@ import importlib
 
 from .compatibility import basestring
 
+# (module name, class name) -> class
+_class_registry = {}
+
+
+def register_class(cls, module=None, name=None):
+    """
+    Register a deserializable class.
+
+    Registered classes are resolved without the import machinery.
+    Can be used as a class decorator.
+
+    Args:
+        cls: Class.
+        module: Module name, cls.__module__ if not given.
+        name: Class name, cls.__name__ if not given.
+
+    Returns:
+        Registered class.
+    """
+    if module is None:
+        module = cls.__module__
+    if name is None:
+        name = cls.__name__
+    _class_registry[(module, name)] = cls
+    return cls
+
+
+def resolve_class(module, name):
+    """
+    Find a class by module and class names.
+
+    Classes that are not registered are imported once
+    and then cached in the registry.
+
+    Args:
+        module: Module name.
+        name: Class name.
+
+    Returns:
+        Class.
+    """
+    try:
+        return _class_registry[(module, name)]
+    except KeyError:
+        cls = getattr(importlib.import_module(module), name)
+        _class_registry[(module, name)] = cls
+        return cls
+
+
 def step_to_raw_serializable(obj):
     """
     Make one step of convertion of object
@@ -56,7 +105,7 @@ def to_raw_serializable(obj):
 
     else:
         sobj = step_to_raw_serializable(obj)
-        if not sobj:
+        if sobj is None:
             raise TypeError('Non serializable object: ', obj)
         return to_raw_serializable(sobj)
 
@@ -67,8 +116,7 @@ def step_from_raw_serializable(sobj):
     raw json serializable type.
     """
     if "python_class" in sobj:
-        module = importlib.import_module(sobj["python_module"])
-        cls = getattr(module, sobj["python_class"])
+        cls = resolve_class(sobj["python_module"], sobj["python_class"])
         return cls.deserialize(sobj["value"])
     return sobj
 
@@ -97,7 +145,7 @@ class JSONSerializer(json.JSONEncoder):
     """
     def default(self, obj):
         res = step_to_raw_serializable(obj)
-        if res:
+        if res is not None:
             return res
         else:
             return json.JSONEncoder.default(self, obj)
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    solver.py
+    ~~~~~~~~~
+
+    dependency solver
+
+    :copyright: (c) 2013-2015 by Jauhien Piatlicki
+    :license: GPL-2, see LICENSE for more details.
+"""
+
+from .exceptions import DependencyError, InvalidKeyError
+from .g_collections import Package
+from .logger import Logger
+
+
+class DependencySolver(object):
+    """
+    Dependency solver for a package database.
+
+    Dependency graph is built on demand: dependencies of a package are
+    looked up once and stored in an adjacency index. Graph is walked
+    iteratively with Tarjan's algorithm, so deep dependency chains do not
+    hit the recursion limit. Every strongly connected component with more
+    than one package or with a package depending on itself is reported
+    as a circular dependency. Closures of solved packages are cached,
+    so subgraphs shared by several packages are solved only once.
+    """
+
+    def __init__(self, package_db):
+        """
+        Args:
+            package_db: Package database.
+        """
+        self.package_db = package_db
+        self.logger = Logger()
+        # package -> list of packages it depends on, None if package is not found
+        self.adjacency = {}
+        # package -> frozenset with package and all its dependencies
+        self.closures = {}
+
+    def get_adjacent(self, package):
+        """
+        Get packages a given package depends on.
+
+        All versions of a dependency are returned, dependencies
+        that are not in the database are ignored.
+
+        Args:
+            package: g_collections.Package instance.
+
+        Returns:
+            List of packages or None if package is not found.
+        """
+        try:
+            return self.adjacency[package]
+        except KeyError:
+            pass
+
+        try:
+            desc = self.package_db.get_package_view(package)
+        except KeyError:
+            desc = None
+
+        if desc is None:
+            adjacent = None
+        else:
+            adjacent = []
+            for dependency in desc["dependencies"]:
+                try:
+                    versions = self.package_db.list_package_versions(dependency.category,
+                                                                    dependency.package)
+                except InvalidKeyError:
+                    # ignore non existing packages
+                    continue
+                for version in versions:
+                    adjacent.append(Package(dependency.category,
+                                            dependency.package, version))
+
+        self.adjacency[package] = adjacent
+        return adjacent
+
+    def solve(self, package):
+        """
+        Solve dependencies of a package.
+
+        Args:
+            package: g_collections.Package instance.
+
+        Returns:
+            Frozenset with a package and all the packages it depends on.
+        Empty if package is not found.
+        """
+        if package in self.closures:
+            return self.closures[package]
+
+        if self.get_adjacent(package) is None:
+            error = "package " + package.category + '/' + \
+                package.name + '-' + package.version + " not found"
+            self.logger.error(error)
+            # at the moment ignore unsolved dependencies, as those deps can be in other repo
+            # or can be external: portage will catch it
+            return frozenset()
+
+        index = {}
+        lowlink = {}
+        stack = []
+        on_stack = set()
+        counter = 0
+
+        work = [(package, iter(self.get_adjacent(package)))]
+        index[package] = lowlink[package] = counter
+        counter += 1
+        stack.append(package)
+        on_stack.add(package)
+
+        while work:
+            node, successors = work[-1]
+            descended = False
+            for successor in successors:
+                if successor in self.closures:
+                    continue
+                if self.get_adjacent(successor) is None:
+                    continue
+                if not successor in index:
+                    index[successor] = lowlink[successor] = counter
+                    counter += 1
+                    stack.append(successor)
+                    on_stack.add(successor)
+                    work.append((successor, iter(self.get_adjacent(successor))))
+                    descended = True
+                    break
+                elif successor in on_stack:
+                    lowlink[node] = min(lowlink[node], index[successor])
+            if descended:
+                continue
+
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                lowlink[parent] = min(lowlink[parent], lowlink[node])
+
+            if lowlink[node] == index[node]:
+                component = []
+                while True:
+                    member = stack.pop()
+                    on_stack.remove(member)
+                    component.append(member)
+                    if member == node:
+                        break
+                if len(component) > 1 or node in self.get_adjacent(node):
+                    error = 'circular dependency for ' + \
+                      ', '.join(sorted(str(member) for member in component))
+                    raise DependencyError(error)
+                closure = set([node])
+                for successor in self.get_adjacent(node):
+                    closure |= self.closures.get(successor, frozenset())
+                self.closures[node] = frozenset(closure)
+
+        return self.closures[package]
@@ -16,8 +16,9 @@ import os
 
 from .compatibility import TemporaryDirectory
 
-from .exceptions import SyncError
-from .fileutils import wget
+from .exceptions import DownloadingError, SyncError
+from .fetcher import get_fetcher
+from .fileutils import extract_tarball
 
 
 class SyncedData(object):
@@ -26,7 +27,13 @@ class SyncedData(object):
 
     Directory with sync data is guaranted to exist only as long as this
     object does.
+
+    If transient is True the directory is removed after use,
+    so its files can be hardlinked instead of copying.
     """
+
+    transient = False
+
     def __init__(self, directory):
         self.directory = os.path.abspath(directory)
 
@@ -39,6 +46,8 @@ class TmpSyncedData(SyncedData):
     Synced data that lives in a temporary directory.
     """
 
+    transient = True
+
     def __init__(self, directory, tmpdirobj):
         super(TmpSyncedData, self).__init__(directory)
         self.tmpdirobj = tmpdirobj
@@ -83,13 +92,17 @@ class TGZSyncer(Syncer):
             SyncedData object that gives access to the directory with data.
         """
         download_dir = TemporaryDirectory()
-        if wget(db_uri, download_dir.name):
-            raise SyncError('sync failed: ' + db_uri)
+        try:
+            get_fetcher().fetch(db_uri, download_dir.name)
+        except DownloadingError as e:
+            raise SyncError('sync failed: ' + db_uri + ': ' + str(e))
 
         tmp_dir = TemporaryDirectory()
         for f_name in glob.iglob(os.path.join(download_dir.name, '*.tar.gz')):
-            if os.system("tar -xvzf " + f_name + " -C " + tmp_dir.name):
-                raise SyncError('sync failed (unpacking)')
+            try:
+                extract_tarball(f_name, tmp_dir.name)
+            except DownloadingError as e:
+                raise SyncError('sync failed (unpacking): ' + str(e))
 
         tmp_path = os.path.join(tmp_dir.name, os.listdir(tmp_dir.name)[0])
         del download_dir
@@ -14,6 +14,7 @@
 import argparse
 import sys
 
+from g_sorcery.db_layout import SUPPORTED_FILE_FORMATS
 from g_sorcery.package_db import PackageDB
 
 def main():
@@ -45,13 +46,20 @@ def main():
     p_ebuild_data_for_all.add_argument('function')
     p_ebuild_data_for_all.set_defaults(func=for_all)
 
+    p_convert = subparsers.add_parser('convert')
+    p_convert.set_defaults(func=convert)
+    p_convert.add_argument('category_format', choices=sorted(SUPPORTED_FILE_FORMATS))
+
     p_sync = subparsers.add_parser('sync')
     p_sync.set_defaults(func=sync)
     p_sync.add_argument('uri')
 
     args = parser.parse_args()
     pkg_db = PackageDB(args.db_dir)
-    return args.func(pkg_db, args)
+    try:
+        return args.func(pkg_db, args)
+    finally:
+        pkg_db.close()
 
 
 def transform_db(function):
@@ -60,11 +68,21 @@ def transform_db(function):
     """
     def transformator(pkg_db, args):
         pkg_db.read()
+        keep_layout(pkg_db)
         function(pkg_db, args)
-        pkg_db.write()
+        pkg_db.write(incremental=True)
     return transformator
 
 
+def keep_layout(pkg_db):
+    """
+    Write database with the same layout, structure and file format it has.
+    """
+    pkg_db.preferred_layout_version = pkg_db.metadata['layout_version']
+    pkg_db.preferred_db_version = pkg_db.metadata['db_version']
+    pkg_db.preferred_category_format = pkg_db.metadata['category_format']
+
+
 def read_db(function):
     """
     Decorator for functions that read from database.
@@ -122,6 +140,17 @@ def show_all(pkg_db, args):
         print("")
 
 
+def convert(pkg_db, args):
+    """
+    Convert database to another packages file format.
+    """
+    pkg_db.read()
+    keep_layout(pkg_db)
+    pkg_db.preferred_layout_version = 1
+    pkg_db.preferred_category_format = args.category_format
+    pkg_db.write()
+
+
 def sync(pkg_db, args):
     """
     Synchronize database.
@@ -138,7 +167,7 @@ def rename_var(pkg_db, args):
         if args.old_name in ebuild_data:
             value = ebuild_data.pop(args.old_name)
             ebuild_data[args.new_name] = value
-        pkg_db.add_package(package, ebuild_data)
+            pkg_db.add_package(package, ebuild_data)
 
 
 if __name__ == "__main__":
@@ -14,7 +14,7 @@
 import os
 import threading
 
-from g_sorcery.compatibility import py2k
+from g_sorcery.compatibility import py2k, urlparse
 
 if py2k:
     from SocketServer import TCPServer as HTTPServer 
@@ -23,26 +23,45 @@ else:
     from http.server import HTTPServer
     from http.server import SimpleHTTPRequestHandler
 
-def HTTPRequestHandlerGenerator(direct):
+def HTTPRequestHandlerGenerator(direct, keep_alive=False, encodings=None, redirects=None):
 
     class HTTPRequestHandler(SimpleHTTPRequestHandler, object):
         directory = direct
+        if keep_alive:
+            protocol_version = "HTTP/1.1"
 
         def __init__(self, request, client_address, server):
             super(HTTPRequestHandler, self).__init__(request, client_address, server)
 
+        def do_GET(self):
+            if self.path in (redirects or {}):
+                self.send_response(302)
+                self.send_header("Location", redirects[self.path])
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            super(HTTPRequestHandler, self).do_GET()
+
         def translate_path(self, path):
-            return os.path.join(self.directory, path[1:])
+            # requests sent to a proxy contain absolute URIs
+            return os.path.join(direct, urlparse(path).path[1:])
+
+        def end_headers(self):
+            for suffix, encoding in (encodings or {}).items():
+                if self.path.endswith(suffix):
+                    self.send_header("Content-Encoding", encoding)
+            super(HTTPRequestHandler, self).end_headers()
 
     return HTTPRequestHandler
 
     
 class Server(threading.Thread):
-    def __init__(self, directory, port=8080):
+    def __init__(self, directory, port=8080, keep_alive=False, encodings=None, redirects=None):
         super(Server, self).__init__()
         HTTPServer.allow_reuse_address = True
         server_address = ('127.0.0.1', port)
-        self.httpd = HTTPServer(server_address, HTTPRequestHandlerGenerator(directory))
+        self.httpd = HTTPServer(server_address, HTTPRequestHandlerGenerator(directory, keep_alive,
+                                                                                encodings, redirects))
     
     def run(self):
         self.httpd.serve_forever()
@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    test_Backend.py
+    ~~~~~~~~~~~~~~~
+
+    backend test suite
+
+    :copyright: (c) 2013-2015 by Jauhien Piatlicki
+    :license: GPL-2, see LICENSE for more details.
+"""
+
+import json
+import os
+import unittest
+
+from g_sorcery.backend import Backend
+from g_sorcery.compatibility import configparser
+from g_sorcery.ebuild import DefaultEbuildGenerator
+from g_sorcery.eclass import EclassGenerator
+from g_sorcery.g_collections import Dependency, Package, serializable_elist
+from g_sorcery.metadata import MetadataGenerator
+from g_sorcery.package_db import DBGenerator, PackageDB
+
+from tests.base import BaseTest
+
+
+class Layout(object):
+    vars_after_description = ["homepage"]
+
+
+class OtherLayout(Layout):
+    eapi = 6
+
+
+class TstEbuildGenerator(DefaultEbuildGenerator):
+    layout_class = Layout
+
+    def __init__(self, package_db):
+        super(TstEbuildGenerator, self).__init__(package_db, self.layout_class())
+
+
+class ProcessingEbuildGenerator(TstEbuildGenerator):
+    def process_ebuild_data(self, ebuild_data):
+        result = dict(ebuild_data)
+        result["processed"] = True
+        return result
+
+    def get_template(self, package, ebuild_data):
+        # relies on a key added by process_ebuild_data
+        assert ebuild_data["processed"]
+        return super(ProcessingEbuildGenerator, self).get_template(package, ebuild_data)
+
+
+class TstEclassGenerator(EclassGenerator):
+    def __init__(self):
+        super(TstEclassGenerator, self).__init__(os.path.dirname(__file__))
+
+
+def ebuild_data(category, name, version):
+    dependencies = serializable_elist()
+    if name != "p4":
+        dependencies.append(Dependency(category, "p" + str(int(name[1:]) + 1)))
+    return {"description": "package " + name + " " + version,
+            "homepage": "http://example.org/" + name,
+            "longdescription": "long description of " + name,
+            "dependencies": dependencies,
+            "maintainer": [{"email": "test@example.org", "name": "tst"}]}
+
+
+class TestGenerateTree(BaseTest):
+
+    def setUp(self):
+        super(TestGenerateTree, self).setUp()
+        self.config = {"backend": "tst", "package": "tst",
+                       "repositories": {"tst-repo": {}}}
+        self.global_config = configparser.ConfigParser()
+
+    def make_overlay(self, directory, packages=None):
+        overlay = os.path.join(self.tempdir.name, directory, "overlay")
+        db_path = os.path.join(overlay, ".g-sorcery", "tst", "tst-repo", "db")
+        pkg_db = PackageDB(db_path)
+        if packages is None:
+            packages = self.get_packages()
+        for package in packages:
+            pkg_db.add_category(package.category)
+            pkg_db.add_package(package, ebuild_data(package.category,
+                                                    package.name, package.version))
+        pkg_db.write()
+        return overlay
+
+    def get_packages(self):
+        packages = []
+        for category in ["app-test1", "app-test2"]:
+            for name in ["p0", "p1", "p2", "p3", "p4"]:
+                for version in ["1", "2", "3"]:
+                    packages.append(Package(category, name, version))
+        return packages
+
+    def get_backend(self, ebuild_g_class=TstEbuildGenerator):
+        backend = Backend(DBGenerator, ebuild_g_class, ebuild_g_class,
+                          TstEclassGenerator, MetadataGenerator)
+        backend.overlays_info_dir = os.path.join(self.tempdir.name, "overlays")
+        return backend
+
+    def generate_tree(self, overlay, *options, **kwargs):
+        backend = self.get_backend(**kwargs)
+        args = backend.parser.parse_args(["-o", overlay, "-r", "tst-repo",
+                                          "generate-tree"] + list(options))
+        return backend.generate_tree(args, self.config, self.global_config)
+
+    def read_tree(self, overlay):
+        tree = {}
+        for root, dirs, files in os.walk(overlay):
+            if ".g-sorcery" in dirs:
+                dirs.remove(".g-sorcery")
+            for f_name in files:
+                path = os.path.join(root, f_name)
+                with open(path, "rb") as f:
+                    tree[os.path.relpath(path, overlay)] = f.read()
+        return tree
+
+    def test_jobs(self):
+        serial = self.make_overlay("serial")
+        parallel = self.make_overlay("parallel")
+        self.generate_tree(serial, "-j", "1")
+        self.generate_tree(parallel, "-j", "4")
+        serial_tree = self.read_tree(serial)
+        self.assertTrue(os.path.join("app-test1", "p0", "p0-1.ebuild") in serial_tree)
+        self.assertTrue(os.path.join("app-test2", "p4", "metadata.xml") in serial_tree)
+        self.assertTrue(os.path.join("app-test2", "p4", "Manifest") in serial_tree)
+        self.assertEqual(serial_tree, self.read_tree(parallel))
+
+        # hashes are computed during generation
+        hashes = self.read_hashes(serial)
+        self.assertEqual(len(hashes), 10)
+        self.assertEqual(hashes, self.read_hashes(parallel))
+        old_stat = self.stat_tree(serial)
+        self.generate_tree(serial, "-i")
+        new_stat = self.stat_tree(serial)
+        for name, value in old_stat.items():
+            if name.startswith("app-test"):
+                self.assertEqual(new_stat[name], value)
+
+    def read_hashes(self, overlay):
+        with open(os.path.join(overlay, ".g-sorcery", "tst", "tst-repo", "tree.json")) as f:
+            return json.load(f)
+
+    def stat_tree(self, overlay):
+        return dict((name, (os.stat(os.path.join(overlay, name)).st_ino,
+                            os.stat(os.path.join(overlay, name)).st_mtime_ns))
+                    for name in self.read_tree(overlay))
+
+    def test_incremental(self):
+        overlay = self.make_overlay("incremental")
+        with open(os.path.join(overlay, "stray"), "w") as f:
+            f.write("stray")
+        self.generate_tree(overlay, "-i")
+        self.assertFalse(os.path.exists(os.path.join(overlay, "stray")))
+        old_tree = self.read_tree(overlay)
+        old_stat = self.stat_tree(overlay)
+
+        packages = [package for package in self.get_packages()
+                    if package.category + "/" + package.name != "app-test2/p4"]
+        packages.append(Package("app-test1", "p1", "4"))
+        packages.append(Package("app-test1", "p5", "1"))
+        self.make_overlay("incremental", packages)
+        self.generate_tree(overlay, "-i")
+        new_tree = self.read_tree(overlay)
+        new_stat = self.stat_tree(overlay)
+
+        p1 = os.path.join("app-test1", "p1")
+        self.assertTrue(os.path.join(p1, "p1-4.ebuild") in new_tree)
+        self.assertNotEqual(new_tree[os.path.join(p1, "Manifest")],
+                            old_tree[os.path.join(p1, "Manifest")])
+        self.assertTrue(os.path.join("app-test1", "p5", "p5-1.ebuild") in new_tree)
+        self.assertFalse(os.path.exists(os.path.join(overlay, "app-test2", "p4")))
+        for name, value in old_stat.items():
+            if name.startswith(os.path.join("app-test1", "p0")) \
+               or name.startswith(os.path.join("app-test2", "p3")):
+                self.assertEqual(new_stat[name], value)
+
+        reference = self.make_overlay("reference", packages)
+        self.generate_tree(reference)
+        self.assertEqual(new_tree, self.read_tree(reference))
+
+    def test_incremental_template(self):
+        overlay = self.make_overlay("incremental")
+        self.generate_tree(overlay, "-i")
+        ebuild = os.path.join(overlay, "app-test1", "p0", "p0-1.ebuild")
+        with open(ebuild) as f:
+            self.assertTrue("EAPI=5" in f.read())
+        # template of the same generator changes, e.g. after backend update
+        TstEbuildGenerator.layout_class = OtherLayout
+        try:
+            self.generate_tree(overlay, "-i")
+        finally:
+            TstEbuildGenerator.layout_class = Layout
+        with open(ebuild) as f:
+            self.assertTrue("EAPI=6" in f.read())
+
+
+    def test_processed_data(self):
+        overlay = self.make_overlay("processed")
+        self.generate_tree(overlay, "-i", ebuild_g_class=ProcessingEbuildGenerator)
+        self.assertTrue(os.path.isfile(os.path.join(overlay, "app-test1", "p0", "p0-1.ebuild")))
+
+
+class CountingMetadataGenerator(MetadataGenerator):
+    generated = []
+
+    def generate(self, package):
+        CountingMetadataGenerator.generated.append(package)
+        return super(CountingMetadataGenerator, self).generate(package)
+
+
+class TestWriteMetadata(BaseTest):
+
+    def test_multiple_versions(self):
+        versions = ["1.9", "1.10", "1.2_rc1", "1.10_rc1"]
+        pkg_db = PackageDB(os.path.join(self.tempdir.name, "db"))
+        pkg_db.add_category("app-test")
+        for version in versions:
+            data = ebuild_data("app-test", "p0", version)
+            data["longdescription"] = "version " + version
+            pkg_db.add_package(Package("app-test", "p0", version), data)
+        packages = [Package("app-test", "p0", version) for version in versions]
+
+        backend = Backend(DBGenerator, TstEbuildGenerator, TstEbuildGenerator,
+                          TstEclassGenerator, CountingMetadataGenerator)
+        ebuild_g = TstEbuildGenerator(pkg_db)
+        metadata_g = CountingMetadataGenerator(pkg_db)
+        CountingMetadataGenerator.generated = []
+        serial = os.path.join(self.tempdir.name, "serial")
+        backend.write_packages(serial, ((package, pkg_db.get_package_view(package))
+                                        for package in packages),
+                               ebuild_g, metadata_g)
+        self.assertEqual(CountingMetadataGenerator.generated,
+                         [Package("app-test", "p0", "1.10")])
+        with open(os.path.join(serial, "app-test", "p0", "metadata.xml")) as f:
+            metadata = f.read()
+        self.assertTrue("version 1.10<" in metadata)
+        self.assertEqual(sorted(os.listdir(os.path.join(serial, "app-test", "p0"))),
+                         sorted(["metadata.xml"] + ["p0-" + version + ".ebuild"
+                                                    for version in versions]))
+
+        parallel = os.path.join(self.tempdir.name, "parallel")
+        backend.write_packages_parallel(parallel, pkg_db, packages, ebuild_g, metadata_g, 3)
+        with open(os.path.join(parallel, "app-test", "p0", "metadata.xml")) as f:
+            self.assertEqual(f.read(), metadata)
+
+
+class TestFastDigest(BaseTest):
+
+    def make_overlay(self, directory):
+        overlay = os.path.join(self.tempdir.name, directory)
+        pkgnames = []
+        for category in ["app-test1", "app-test2"]:
+            for name in ["p0", "p1", "p2", "p3", "p4"]:
+                pkgnames.append(category + "/" + name)
+                pkgdir = os.path.join(overlay, category, name)
+                os.makedirs(pkgdir)
+                for version in ["1", "2"]:
+                    with open(os.path.join(pkgdir, name + "-" + version + ".ebuild"), "w") as f:
+                        f.write(category + name + version)
+        return overlay, pkgnames
+
+    def read_manifests(self, overlay, pkgnames):
+        manifests = {}
+        for pkgname in pkgnames:
+            with open(os.path.join(overlay, pkgname, "Manifest")) as f:
+                manifests[pkgname] = f.read()
+        return manifests
+
+    def test_jobs(self):
+        backend = Backend(DBGenerator, None, None, None, None)
+        serial, pkgnames = self.make_overlay("serial")
+        parallel, pkgnames = self.make_overlay("parallel")
+        backend.fast_digest(serial, pkgnames, 1)
+        backend.fast_digest(parallel, pkgnames, 4)
+        manifests = self.read_manifests(serial, pkgnames)
+        self.assertEqual(len(manifests["app-test1/p0"].splitlines()), 2)
+        self.assertEqual(manifests, self.read_manifests(parallel, pkgnames))
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(TestGenerateTree('test_jobs'))
+    suite.addTest(TestGenerateTree('test_incremental'))
+    suite.addTest(TestGenerateTree('test_incremental_template'))
+    suite.addTest(TestGenerateTree('test_processed_data'))
+    suite.addTest(TestWriteMetadata('test_multiple_versions'))
+    suite.addTest(TestFastDigest('test_jobs'))
+    return suite
@@ -59,6 +59,29 @@ class TestingDBGenerator(DBGenerator):
         return ("external", dependency)
 
 
+class ParallelTestingDBGenerator(TestingDBGenerator):
+    def get_download_uries(self, common_config, config):
+        return [config["repo_uri"] + "/repo" + str(i) + ".data" for i in range(4)]
+
+    def process_uri(self, uri, data):
+        super(ParallelTestingDBGenerator, self).process_uri(uri, data)
+        data["last_uri"] = uri["uri"]
+
+    def process_data(self, pkg_db, data, common_config, config):
+        self.last_uri = data["last_uri"]
+        for i in range(4):
+            super(ParallelTestingDBGenerator, self).process_data(pkg_db,
+                        {"repo.data": data["repo" + str(i) + ".data"]}, common_config, config)
+
+
+class CachingTestingDBGenerator(TestingDBGenerator):
+    parsed = 0
+
+    def parse_data(self, data_f):
+        CachingTestingDBGenerator.parsed += 1
+        return super(CachingTestingDBGenerator, self).parse_data(data_f)
+
+
 class TestDBGenerator(BaseTest):
 
     def test_functionality(self):
@@ -122,8 +145,75 @@ class TestDBGenerator(BaseTest):
         self.assertTrue(db_generator.in_config(configs, "values", orig))
         self.assertFalse(db_generator.in_config(configs, "values", "invalid"))
 
+    def test_parallel_download(self):
+        db_generator = ParallelTestingDBGenerator()
+        config = {"repo_uri": "127.0.0.1:8081", "download_concurrency": 3}
+        ebuild_data = {"test1": "test1"}
+
+        orig_tempdir = TemporaryDirectory()
+        for i in range(4):
+            with open(os.path.join(orig_tempdir.name, "repo" + str(i) + ".data"), "w") as f:
+                for key, value in ebuild_data.items():
+                    f.write(key + " " + value + "\n")
+                f.write("packages\n")
+                f.write("app-test" + str(i) + " test 1\n")
+
+        srv = Server(orig_tempdir.name, port=8081)
+        srv.start()
+
+        try:
+            pkg_db = db_generator(self.tempdir.name, "test_repo",
+                                  common_config = {}, config = config)
+        finally:
+            srv.shutdown()
+            srv.join()
+
+        self.assertEqual(db_generator.last_uri, "127.0.0.1:8081/repo3.data")
+        self.assertEqual(set(pkg_db.list_categories()),
+                         set(["app-test" + str(i) for i in range(4)]))
+        self.assertEqual(pkg_db.get_package_description(Package("app-test2", "test", "1")),
+                         ebuild_data)
+
+
+    def test_http_cache(self):
+        db_generator = CachingTestingDBGenerator()
+        config = {"repo_uri": "127.0.0.1:8082", "http_cache": True}
+
+        orig_tempdir = TemporaryDirectory()
+        data_path = os.path.join(orig_tempdir.name, "repo.data")
+        with open(data_path, "w") as f:
+            f.write("test1 test1\npackages\napp-test1 test 1\n")
+        mtime = os.stat(data_path).st_mtime - 100
+        os.utime(data_path, (mtime, mtime))
+
+        srv = Server(orig_tempdir.name, port=8082)
+        srv.start()
+
+        try:
+            pkg_db = db_generator(self.tempdir.name, "test_repo",
+                                  common_config = {}, config = config)
+            self.assertEqual(CachingTestingDBGenerator.parsed, 1)
+            self.assertTrue(os.listdir(os.path.join(self.tempdir.name, "test_repo",
+                                                    "persistent", "http_cache")))
+            pkg_db = db_generator(self.tempdir.name, "test_repo",
+                                  common_config = {}, config = config)
+            self.assertEqual(CachingTestingDBGenerator.parsed, 1)
+            self.assertEqual(pkg_db.list_all_packages(), [Package("app-test1", "test", "1")])
+
+            with open(data_path, "w") as f:
+                f.write("test1 test1\npackages\napp-test1 test 2\n")
+            pkg_db = db_generator(self.tempdir.name, "test_repo",
+                                  common_config = {}, config = config)
+            self.assertEqual(CachingTestingDBGenerator.parsed, 2)
+            self.assertEqual(pkg_db.list_all_packages(), [Package("app-test1", "test", "2")])
+        finally:
+            srv.shutdown()
+            srv.join()
+
 
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(TestDBGenerator('test_functionality'))
+    suite.addTest(TestDBGenerator('test_parallel_download'))
+    suite.addTest(TestDBGenerator('test_http_cache'))
     return suite
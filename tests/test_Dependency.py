@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    test_Dependency.py
+    ~~~~~~~~~~~~~~~~~~
+
+    Dependency test suite
+
+    :copyright: (c) 2013-2015 by Jauhien Piatlicki
+    :license: GPL-2, see LICENSE for more details.
+"""
+
+import pickle
+import unittest
+
+from g_sorcery.g_collections import Dependency
+
+from tests.base import BaseTest
+
+
+class TestDependency(BaseTest):
+
+    def test_interning(self):
+        dep = Dependency("dev-python", "setuptools")
+        self.assertTrue(Dependency("dev-python", "setuptools") is dep)
+        self.assertTrue(Dependency.deserialize("dev-python/setuptools") is dep)
+        self.assertTrue(pickle.loads(pickle.dumps(dep)) is dep)
+        self.assertEqual(dep.operator, "")
+        self.assertEqual(dep.version, "")
+
+    def test_deserialize(self):
+        dep = Dependency.deserialize(">=dev-python/setuptools-1.0-r1")
+        self.assertEqual(dep.category, "dev-python")
+        self.assertEqual(dep.package, "setuptools")
+        self.assertEqual(dep.version, "1.0-r1")
+        self.assertEqual(dep.operator, ">=")
+        self.assertEqual(dep.serialize(), ">=dev-python/setuptools-1.0-r1")
+        self.assertTrue(Dependency("dev-python", "setuptools", "1.0-r1", ">=") is dep)
+
+    def test_equality(self):
+        dep1 = Dependency("dev-python", "setuptools", "1.0", ">=")
+        dep2 = Dependency.deserialize(">=dev-python/setuptools-1.0")
+        dep3 = Dependency("dev-python", "setuptools")
+        self.assertEqual(dep1, dep2)
+        self.assertNotEqual(dep1, dep3)
+        self.assertEqual(len(set([dep1, dep2, dep3])), 2)
+        self.assertRaises(AttributeError, setattr, dep1, "version", "2.0")
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(TestDependency('test_interning'))
+    suite.addTest(TestDependency('test_deserialize'))
+    suite.addTest(TestDependency('test_equality'))
+    return suite
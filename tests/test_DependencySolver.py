@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    test_DependencySolver.py
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+
+    DependencySolver test suite
+
+    :copyright: (c) 2013-2015 by Jauhien Piatlicki
+    :license: GPL-2, see LICENSE for more details.
+"""
+
+import os
+import unittest
+
+from g_sorcery.exceptions import DependencyError
+from g_sorcery.g_collections import Dependency, Package, serializable_elist
+from g_sorcery.package_db import PackageDB
+from g_sorcery.solver import DependencySolver
+
+from tests.base import BaseTest
+
+
+class TestDependencySolver(BaseTest):
+
+    def setUp(self):
+        super(TestDependencySolver, self).setUp()
+        self.pkg_db = PackageDB(os.path.join(self.tempdir.name, "db"))
+        self.pkg_db.add_category("app-test")
+
+    def add(self, name, version, dependencies):
+        deps = serializable_elist([Dependency("app-test", dep) for dep in dependencies])
+        package = Package("app-test", name, version)
+        self.pkg_db.add_package(package, {"dependencies": deps})
+        return package
+
+    def test_solve(self):
+        a = self.add("a", "1", ["b", "c", "external"])
+        b1 = self.add("b", "1", ["c"])
+        b2 = self.add("b", "2", [])
+        c = self.add("c", "1", [])
+        d = self.add("d", "1", ["a"])
+        solver = DependencySolver(self.pkg_db)
+        self.assertEqual(solver.solve(a), set([a, b1, b2, c]))
+        self.assertEqual(solver.solve(d), set([a, b1, b2, c, d]))
+        self.assertEqual(solver.solve(Package("app-test", "invalid", "1")), set())
+
+    def test_deep_chain(self):
+        depth = 2000
+        for i in range(depth):
+            self.add("p" + str(i), "1", ["p" + str(i + 1)])
+        self.add("p" + str(depth), "1", [])
+        solver = DependencySolver(self.pkg_db)
+        self.assertEqual(len(solver.solve(Package("app-test", "p0", "1"))), depth + 1)
+
+    def test_cycle(self):
+        a = self.add("a", "1", ["b"])
+        self.add("b", "1", ["c"])
+        self.add("c", "1", ["a"])
+        s = self.add("s", "1", ["s"])
+        solver = DependencySolver(self.pkg_db)
+        self.assertRaises(DependencyError, solver.solve, a)
+        self.assertRaises(DependencyError, solver.solve, s)
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(TestDependencySolver('test_solve'))
+    suite.addTest(TestDependencySolver('test_deep_chain'))
+    suite.addTest(TestDependencySolver('test_cycle'))
+    return suite
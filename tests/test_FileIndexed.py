@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    test_FileIndexed.py
+    ~~~~~~~~~~~~~~~~~~~
+
+    indexed file test suite
+
+    :copyright: (c) 2013-2015 by Jauhien Piatlicki
+    :license: GPL-2, see LICENSE for more details.
+"""
+
+import hashlib
+import os
+import unittest
+
+from g_sorcery.exceptions import FileJSONError
+from g_sorcery.file_indexed import FileIndexed, IndexedMapping
+from g_sorcery.fileutils import hash_file
+from g_sorcery.g_collections import Package, serializable_elist
+from g_sorcery.package_db import PackageDB
+
+from tests.base import BaseTest
+from tests.serializable import DeserializableClass
+
+
+class TestFileIndexed(BaseTest):
+    def setUp(self):
+        super(TestFileIndexed, self).setUp()
+        self.directory = os.path.join(self.tempdir.name, 'tst')
+        self.name = 'tst.idx'
+        self.path = os.path.join(self.directory, self.name)
+
+    def test_write_read(self):
+        fi = FileIndexed(self.directory, self.name, ["mandatory"])
+        content = {"mandatory": "1",
+                   "entries": {"a": {"1": "tst"},
+                               "b": serializable_elist([DeserializableClass("1", "2")]),
+                               u"ж": [1, 2]}}
+        fi.write(content)
+        self.assertEqual(fi.checksum, hash_file(self.path, hashlib.md5()))
+
+        content_r = fi.read()
+        entries = content_r["entries"]
+        self.assertTrue(isinstance(entries, IndexedMapping))
+        self.assertEqual(entries.data, {})
+        self.assertEqual(entries["b"], content["entries"]["b"])
+        self.assertEqual(list(entries.data), ["b"])
+        self.assertEqual(content, content_r)
+
+        index = entries.index
+        shared = IndexedMapping(entries.buf, index)
+        entries["c"] = "new"
+        del entries["a"]
+        self.assertRaises(KeyError, entries.__getitem__, "a")
+        self.assertEqual(set(entries), set(["b", "c", u"ж"]))
+        self.assertEqual(len(entries), 3)
+        self.assertTrue("a" in index)
+        self.assertEqual(shared["a"], {"1": "tst"})
+
+        fi.close()
+        self.assertTrue(entries.buf.closed)
+
+    def test_bad_file(self):
+        os.makedirs(self.directory)
+        with open(self.path, "w") as f:
+            f.write("invalid content of an indexed file")
+        fi = FileIndexed(self.directory, self.name)
+        self.assertRaises(FileJSONError, fi.read)
+
+    def test_package_db(self):
+        orig_path = os.path.join(self.tempdir.name, "db")
+        orig_db = PackageDB(orig_path, preferred_category_format="idx")
+        orig_db.add_category("app-test1")
+        packages = [Package("app-test1", "test", "1"), Package("app-test1", "test1", "1")]
+        for package in packages:
+            orig_db.add_package(package, {"test1": "tst1", "test2": ["a", "b"]})
+        orig_db.set_common_data("app-test1", {"common1": "cmn1"})
+        orig_db.write()
+
+        for compact_storage in [False, True]:
+            test_db = PackageDB(orig_path, compact_storage=compact_storage)
+            test_db.read()
+            test_packages = test_db.database["app-test1"]["packages"]
+            self.assertEqual(test_packages.data, {})
+            self.assertEqual(test_db.get_package_description(packages[0]),
+                             {"test1": "tst1", "test2": ["a", "b"], "common1": "cmn1"})
+            self.assertEqual(list(test_packages.data), ["test"])
+            self.assertEqual(set(test_db.list_all_packages()), set(packages))
+
+    def test_close(self):
+        orig_path = os.path.join(self.tempdir.name, "db")
+        orig_db = PackageDB(orig_path, preferred_category_format="idx")
+        orig_db.add_category("app-test1")
+        package = Package("app-test1", "test", "1")
+        orig_db.add_package(package, {"test1": "tst1"})
+        orig_db.write()
+
+        test_db = PackageDB(orig_path)
+        test_db.read()
+        buf = test_db.database["app-test1"]["packages"].buf
+        test_db.read(lazy=True)
+        self.assertTrue(buf.closed)
+        self.assertEqual(test_db.get_package_description(package), {"test1": "tst1"})
+        buf = test_db.database["app-test1"]["packages"].buf
+        self.assertFalse(buf.closed)
+        test_db.close()
+        self.assertTrue(buf.closed)
+        test_db.close()
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(TestFileIndexed('test_write_read'))
+    suite.addTest(TestFileIndexed('test_bad_file'))
+    suite.addTest(TestFileIndexed('test_package_db'))
+    suite.addTest(TestFileIndexed('test_close'))
+    return suite
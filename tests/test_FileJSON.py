@@ -11,13 +11,15 @@
     :license: GPL-2, see LICENSE for more details.
 """
 
+import hashlib
 import json
 import os
 import unittest
 
-from g_sorcery.fileutils import FileJSON
+from g_sorcery.fileutils import FileJSON, hash_file
 from g_sorcery.exceptions import FileJSONError
 from g_sorcery.g_collections import serializable_elist
+from g_sorcery.serialization import from_raw_serializable, register_class, resolve_class
 
 from tests.base import BaseTest
 from tests.serializable import NonSerializableClass, SerializableClass, DeserializableClass
@@ -59,6 +61,14 @@ class TestFileJSON(BaseTest):
         content_r = fj.read()
         self.assertEqual(content, content_r)
 
+    def test_checksum(self):
+        fj = FileJSON(self.directory, self.name, [])
+        content = {"packages": dict(("p" + str(i), {u"ж": [i, "tst"]})
+                                    for i in range(10000))}
+        fj.write(content)
+        self.assertEqual(fj.checksum, hash_file(self.path, hashlib.md5()))
+        self.assertEqual(fj.read(), content)
+
     def test_serializable(self):
         fj = FileJSON(self.directory, self.name, [])
         content = SerializableClass("1", "2")
@@ -83,6 +93,20 @@ class TestFileJSON(BaseTest):
         content_r = fj.read()
         self.assertEqual(content, content_r)
 
+    def test_registered_class(self):
+        self.assertTrue(resolve_class("tests.serializable", "DeserializableClass") \
+                        is DeserializableClass)
+        register_class(DeserializableClass, "nonexistent_module", "Registered")
+        sobj = {"python_module": "nonexistent_module",
+                "python_class": "Registered",
+                "value": {"field1": "1", "field2": "2"}}
+        self.assertEqual(from_raw_serializable(sobj), DeserializableClass("1", "2"))
+        os.makedirs(self.directory)
+        with open(self.path, 'w') as f:
+            json.dump([sobj], f)
+        fj = FileJSON(self.directory, self.name, [])
+        self.assertEqual(fj.read(), [DeserializableClass("1", "2")])
+
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(TestFileJSON('test_read_nonexistent'))
@@ -90,7 +114,9 @@ def suite():
     suite.addTest(TestFileJSON('test_read_luck_of_mandatory_key'))
     suite.addTest(TestFileJSON('test_write_luck_of_mandatory_key'))
     suite.addTest(TestFileJSON('test_write_read'))
+    suite.addTest(TestFileJSON('test_checksum'))
     suite.addTest(TestFileJSON('test_serializable'))
     suite.addTest(TestFileJSON('test_deserializable'))
     suite.addTest(TestFileJSON('test_deserializable_collection'))
+    suite.addTest(TestFileJSON('test_registered_class'))
     return suite
@@ -11,21 +11,28 @@
     :license: GPL-2, see LICENSE for more details.
 """
 
+import hashlib
+import json
+import operator
 import os
 import time
 import unittest
 
+import portage
+
+from g_sorcery import db_layout
 from g_sorcery.compatibility import TemporaryDirectory
-from g_sorcery.db_layout import JSON_FILE_SUFFIX, BSON_FILE_SUFFIX
-from g_sorcery.exceptions import IntegrityError, InvalidKeyError, SyncError
-from g_sorcery.g_collections import Package, serializable_elist
-from g_sorcery.package_db import PackageDB
+from g_sorcery.db_layout import JSON_FILE_SUFFIX, BSON_FILE_SUFFIX, INDEXED_FILE_SUFFIX
+from g_sorcery.exceptions import DBReplacedError, IntegrityError, InvalidKeyError, SyncError
+from g_sorcery.fileutils import hash_file
+from g_sorcery.g_collections import Dependency, Package, serializable_elist
+from g_sorcery.package_db import compare_versions, PackageDB, version_key
 
 from tests.base import BaseTest
 from tests.serializable import DeserializableClass
 from tests.server import Server
 
-SUPPORTED_FILE_FORMATS = [JSON_FILE_SUFFIX]
+SUPPORTED_FILE_FORMATS = [JSON_FILE_SUFFIX, INDEXED_FILE_SUFFIX]
 # bson module is optional, we should check if it is installed
 try:
     from g_sorcery.file_bson.file_bson import FileBSON
@@ -83,6 +90,7 @@ class TestPackageDB(BaseTest):
             self.assertTrue(test_db.in_category("app-test1", "test"))
             self.assertFalse(test_db.in_category("app-test2", "test"))
             self.assertRaises(InvalidKeyError, test_db.in_category, "app-test3", "test")
+            self.assertEqual(test_db.list_package_categories("test2"), ["app-test2"])
             self.assertEqual(set(test_db.list_package_names("app-test1")), set(['test', 'test1']))
             self.assertEqual(set(test_db.list_catpkg_names()),set(['app-test1/test', 'app-test1/test1', 'app-test2/test2']))
             self.assertRaises(InvalidKeyError, test_db.list_package_versions, "invalid", "test")
@@ -93,6 +101,13 @@ class TestPackageDB(BaseTest):
             self.assertRaises(KeyError, test_db.get_package_description, Package("invalid", "invalid", "1"))
             self.assertEqual(test_db.get_max_version("app-test1", "test"), "2")
             self.assertEqual(test_db.get_max_version("app-test1", "test1"), "1")
+            self.assertEqual(test_db.list_package_versions("app-test1", "test", sorted=True), ['1', '2'])
+            test_db.add_package(Package("app-test1", "test", "10"), ebuild_data)
+            test_db.add_package(Package("app-test1", "test", "1.5"), ebuild_data)
+            self.assertEqual(test_db.get_max_version("app-test1", "test"), "10")
+            self.assertEqual(test_db.list_package_versions("app-test1", "test", sorted=True),
+                             ['1', '1.5', '2', '10'])
+            test_db.read()
             self.assertRaises(InvalidKeyError, test_db.get_max_version, "invalid", "invalid")
             pkg_set = set(packages)
             for package, data in test_db:
@@ -104,9 +119,363 @@ class TestPackageDB(BaseTest):
                 pkg_set.remove(package)
             self.assertTrue(not pkg_set)
             self.assertEqual(orig_db.database, test_db.database)
+            view = test_db.get_package_view(packages[0])
+            self.assertEqual(view, full_data)
+            self.assertEqual(set(view), set(full_data))
+            data = view.copy()
+            self.assertTrue(isinstance(data, dict))
+            self.assertEqual(data, full_data)
+            data["test1"] = "changed"
+            self.assertEqual(view, full_data)
+            view["test1"] = "changed"
+            del view["common1"]
+            self.assertEqual(test_db.get_package_description(packages[0]), full_data)
+            self.assertEqual(orig_db.database, test_db.database)
+
+            lazy_db = PackageDB(self.tempdir.name)
+            lazy_db.read(lazy=True)
+            self.assertEqual(lazy_db.unloaded_categories, set(["app-test1", "app-test2"]))
+            self.assertEqual(lazy_db.list_package_categories("test"), ["app-test1"])
+            self.assertEqual(lazy_db.list_package_categories("invalid"), [])
+            self.assertEqual(lazy_db.unloaded_categories, set(["app-test1", "app-test2"]))
+            self.assertEqual(lazy_db.get_package_description(packages[3]), ebuild_data)
+            self.assertEqual(lazy_db.unloaded_categories, set(["app-test1"]))
+            self.assertEqual(set(lazy_db.list_all_packages()), set(packages))
+            self.assertEqual(orig_db.database, lazy_db.database)
             port = port + 1
 
+    def test_compact_json(self):
+        orig_path = os.path.join(self.tempdir.name, "db")
+        orig_db = PackageDB(orig_path, compact_json=True)
+        orig_db.add_category("app-test1")
+        ebuild_data = {"test1": "tst1",
+                       "test2": serializable_elist([DeserializableClass("1", "2")])}
+        common_data = {"common1": serializable_elist([DeserializableClass("c1", "c2")])}
+        packages = [Package("app-test1", "test", "1"), Package("app-test1", "test", "2"),
+                    Package("app-test1", "test1", "1")]
+        for package in packages:
+            orig_db.add_package(package, ebuild_data)
+        orig_db.set_common_data("app-test1", common_data)
+        orig_db.write()
+
+        with open(os.path.join(orig_path, "app-test1", "packages.json")) as f:
+            self.assertEqual(len(f.read().splitlines()), 1)
+
+        test_db = PackageDB(orig_path)
+        test_db.read()
+        self.assertEqual(orig_db.database, test_db.database)
+        full_data = dict(ebuild_data)
+        full_data.update(common_data)
+        self.assertEqual(test_db.get_package_description(packages[0]), full_data)
+
+    def test_compact_storage(self):
+        orig_path = os.path.join(self.tempdir.name, "db")
+        orig_db = PackageDB(orig_path, compact_storage=True)
+        orig_db.add_category("app-test1")
+        ebuild_data = {"test1": "tst1", "test2": ["a", "b"], "test3": {},
+                       "test4": serializable_elist([DeserializableClass("1", "2")])}
+        packages = [Package("app-test1", "test", "1"), Package("app-test1", "test", "2"),
+                    Package("app-test1", "test1", "1")]
+        for package in packages:
+            orig_db.add_package(package, dict(ebuild_data))
+        orig_db.add_package(Package("app-test1", "test2", "1"))
+
+        versions = orig_db.database["app-test1"]["packages"]["test"]
+        self.assertTrue(versions["1"].schema is versions["2"].schema)
+        self.assertTrue(versions["1"].values[1] is versions["2"].values[1])
+        description = orig_db.get_package_description(packages[0])
+        self.assertEqual(description, ebuild_data)
+        # shared values are frozen and are not copied on access
+        self.assertTrue(description["test2"] is versions["2"]["test2"])
+        self.assertEqual(description["test2"], ["a", "b"])
+        self.assertRaises(AttributeError, getattr, description["test2"], "append")
+        self.assertRaises(TypeError, operator.setitem, description["test3"], "a", "b")
+        separators = [versions[version]["test4"].data._sep_ for version in ["1", "2"]]
+        self.assertTrue(separators[0] is separators[1])
+        self.assertEqual(orig_db.get_package_description(Package("app-test1", "test2", "1")), {})
+        orig_db.write()
+
+        test_db = PackageDB(orig_path, compact_storage=True)
+        test_db.read()
+        plain_db = PackageDB(orig_path)
+        plain_db.read()
+        self.assertEqual(test_db.database, plain_db.database)
+        self.assertEqual(orig_db.database, test_db.database)
+        for package, data in test_db:
+            self.assertEqual(data, plain_db.get_package_description(package))
+
+    def test_reverse_dependencies(self):
+        orig_path = os.path.join(self.tempdir.name, "db")
+        orig_db = PackageDB(orig_path)
+        orig_db.add_category("app-test1")
+        orig_db.add_category("app-test2")
+        orig_db.add_package(Package("app-test1", "a", "1"),
+                            {"dependencies": serializable_elist([Dependency("app-test1", "b")])})
+        orig_db.add_package(Package("app-test1", "a", "2"),
+                            {"dependencies": serializable_elist([Dependency("app-test2", "c")])})
+        orig_db.add_package(Package("app-test1", "b", "1"),
+                            {"dependencies": serializable_elist([Dependency("app-test2", "c")])})
+        orig_db.add_package(Package("app-test2", "c", "1"), {})
+        self.assertEqual(orig_db.reverse_dependencies("app-test2", "c"),
+                         ["app-test1/a", "app-test1/b"])
+        orig_db.add_package(Package("app-test2", "d", "1"),
+                            {"dependencies": serializable_elist([Dependency("app-test1", "b")])})
+        self.assertEqual(orig_db.reverse_dependencies("app-test1", "b"),
+                         ["app-test1/a", "app-test2/d"])
+        orig_db.write()
+
+        test_db = PackageDB(orig_path)
+        test_db.read(lazy=True)
+        self.assertEqual(test_db.reverse_dependencies("app-test2", "c"),
+                         ["app-test1/a", "app-test1/b"])
+        self.assertEqual(test_db.reverse_dependencies("app-test1", "a"), [])
+        self.assertEqual(test_db.unloaded_categories, set(["app-test1", "app-test2"]))
+
+    def test_verified_state(self):
+        orig_path = os.path.join(self.tempdir.name, "db")
+        orig_db = PackageDB(orig_path)
+        orig_db.add_category("app-test1")
+        orig_db.add_package(Package("app-test1", "test", "1"), {"test1": "tst1"})
+        orig_db.write()
+
+        test_db = PackageDB(orig_path)
+        test_db.read()
+        self.assertTrue(os.path.isfile(os.path.join(orig_path, "verified.json")))
+
+        packages_path = os.path.join(orig_path, "app-test1", "packages.json")
+        st = os.stat(packages_path)
+        with open(packages_path, "r+") as f:
+            content = f.read()
+            f.seek(0)
+            f.write(content.replace("tst1", "tst2"))
+        os.utime(packages_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+        test_db = PackageDB(orig_path)
+        test_db.read()
+        self.assertEqual(test_db.get_package_description(Package("app-test1", "test", "1")),
+                         {"test1": "tst2"})
+        self.assertRaises(IntegrityError, test_db.read, full_verify=True)
+        self.assertRaises(IntegrityError, test_db.read)
+
+        os.remove(os.path.join(orig_path, "verified.json"))
+        with open(packages_path, "w") as f:
+            f.write(content)
+        test_db.read(lazy=True)
+        self.assertEqual(test_db.get_package_description(Package("app-test1", "test", "1")),
+                         {"test1": "tst1"})
+
+
+    def test_manifest_digests(self):
+        for compact_json in [False, True]:
+            orig_path = os.path.join(self.tempdir.name, "db" + str(compact_json))
+            orig_db = PackageDB(orig_path, compact_json=compact_json)
+            orig_db.add_category("app-test1")
+            orig_db.add_package(Package("app-test1", "test", "1"),
+                                {"test1": u"tst\u0436",
+                                 "test2": serializable_elist([DeserializableClass("1", "2")])})
+            orig_db.write()
+
+            with open(os.path.join(orig_path, "manifest.json")) as f:
+                manifest = json.load(f)
+            self.assertEqual(set(manifest),
+                             set(["categories.json", "metadata.json", "index.json",
+                                  os.path.join("app-test1", "packages.json")]))
+            for name, value in manifest.items():
+                self.assertEqual(value, hash_file(os.path.join(orig_path, name), hashlib.md5()))
+            with open(os.path.join(orig_path, "verified.json")) as f:
+                self.assertEqual(set(json.load(f)), set(manifest))
+
+
+    def test_incremental_write(self):
+        orig_path = os.path.join(self.tempdir.name, "db")
+        orig_db = PackageDB(orig_path)
+        orig_db.add_category("app-test1")
+        orig_db.add_category("app-test2")
+        orig_db.add_package(Package("app-test1", "a", "1"),
+                            {"dependencies": serializable_elist([Dependency("app-test2", "c")])})
+        orig_db.add_package(Package("app-test2", "c", "1"), {})
+        orig_db.write()
+
+        other_path = os.path.join(orig_path, "app-test2", "packages.json")
+        st = os.stat(other_path)
+
+        test_db = PackageDB(orig_path)
+        test_db.read(lazy=True)
+        test_db.add_package(Package("app-test1", "b", "1"),
+                            {"dependencies": serializable_elist([Dependency("app-test2", "d")])})
+        test_db.add_package(Package("app-test1", "a", "1"), {})
+        test_db.write(incremental=True)
+        self.assertEqual(test_db.unloaded_categories, set(["app-test2"]))
+        self.assertEqual(os.stat(other_path).st_ino, st.st_ino)
+        self.assertEqual(os.stat(other_path).st_mtime, st.st_mtime)
+        self.assertEqual(sorted(os.listdir(orig_path)),
+                         ["app-test1", "app-test2", "categories.json", "index.json",
+                          "manifest.json", "metadata.json", "verified.json"])
+
+        new_db = PackageDB(orig_path)
+        new_db.read(full_verify=True)
+        self.assertEqual(set(new_db.list_all_packages()),
+                         set([Package("app-test1", "a", "1"), Package("app-test1", "b", "1"),
+                              Package("app-test2", "c", "1")]))
+        self.assertEqual(new_db.reverse_dependencies("app-test2", "c"), [])
+        self.assertEqual(new_db.reverse_dependencies("app-test2", "d"), ["app-test1/b"])
+
+        new_db.add_category("app-test3")
+        new_db.add_package(Package("app-test3", "e", "1"), {})
+        new_db.write(incremental=True)
+        new_db = PackageDB(orig_path)
+        new_db.read(lazy=True, full_verify=True)
+        self.assertEqual(new_db.list_package_categories("e"), ["app-test3"])
+        self.assertEqual(new_db.list_package_names("app-test3"), ["e"])
+
+
+    def test_interrupted_update(self):
+        orig_path = os.path.join(self.tempdir.name, "db")
+        orig_db = PackageDB(orig_path)
+        orig_db.add_category("app-test1")
+        orig_db.add_category("app-test2")
+        orig_db.add_package(Package("app-test1", "a", "1"), {"test": "1"})
+        orig_db.add_package(Package("app-test2", "c", "1"), {"test": "1"})
+        orig_db.write()
+        with open(os.path.join(orig_path, "manifest.json")) as f:
+            manifest = f.read()
+
+        def interrupt(src, dst):
+            raise OSError("interrupted")
+
+        test_db = PackageDB(orig_path)
+        test_db.read(lazy=True)
+        test_db.add_package(Package("app-test1", "b", "1"), {"test": "2"})
+        test_db.add_package(Package("app-test2", "d", "1"), {"test": "2"})
+        replace_directory = db_layout.replace_directory
+        db_layout.replace_directory = interrupt
+        try:
+            self.assertRaises(OSError, test_db.write, incremental=True)
+        finally:
+            db_layout.replace_directory = replace_directory
+        self.assertEqual(os.listdir(self.tempdir.name), ["db"])
+        with open(os.path.join(orig_path, "manifest.json")) as f:
+            self.assertEqual(f.read(), manifest)
+
+        new_db = PackageDB(orig_path)
+        new_db.read(full_verify=True)
+        self.assertEqual(set(new_db.list_all_packages()),
+                         set([Package("app-test1", "a", "1"), Package("app-test2", "c", "1")]))
+
+        test_db.write(incremental=True)
+        new_db = PackageDB(orig_path)
+        new_db.read(full_verify=True)
+        self.assertEqual(len(new_db.list_all_packages()), 4)
+
+
+    def test_sync_failure(self):
+        port = 8085
+        sync_address = "127.0.0.1:" + str(port) + "/dummy.tar.gz"
+        orig_tempdir = TemporaryDirectory()
+        orig_path = os.path.join(orig_tempdir.name, "db")
+        orig_db = PackageDB(orig_path)
+        orig_db.add_category("app-test1")
+        orig_db.add_package(Package("app-test1", "test", "1"), {"test1": "tst1"})
+        orig_db.write()
+        os.system("cd " + orig_tempdir.name + " && tar czf dummy.tar.gz db")
+        os.system("echo invalid >> " + orig_path + "/app-test1/packages.json")
+        os.system("cd " + orig_tempdir.name + " && tar czf bad.tar.gz db")
+
+        test_path = os.path.join(self.tempdir.name, "db")
+        test_db = PackageDB(test_path)
+        srv = Server(orig_tempdir.name, port=port)
+        srv.start()
+        try:
+            test_db.sync(sync_address)
+            os.rename(os.path.join(orig_tempdir.name, "bad.tar.gz"),
+                      os.path.join(orig_tempdir.name, "dummy.tar.gz"))
+            self.assertRaises(IntegrityError, test_db.sync, sync_address)
+        finally:
+            srv.shutdown()
+            srv.join()
+
+        self.assertEqual(os.listdir(self.tempdir.name), ["db"])
+        test_db.read(full_verify=True)
+        self.assertEqual(test_db.get_package_description(Package("app-test1", "test", "1")),
+                         {"test1": "tst1"})
+
+
+    def test_sync_during_lazy_read(self):
+        port = 8087
+        sync_address = "127.0.0.1:" + str(port) + "/dummy.tar.gz"
+        orig_tempdir = TemporaryDirectory()
+        orig_path = os.path.join(orig_tempdir.name, "db")
+        orig_db = PackageDB(orig_path, preferred_category_format=INDEXED_FILE_SUFFIX)
+        for category in ["app-test1", "app-test2", "app-test3"]:
+            orig_db.add_category(category)
+            orig_db.add_package(Package(category, "new", "2"), {"test": "new"})
+        orig_db.write()
+        os.system("cd " + orig_tempdir.name + " && tar czf dummy.tar.gz db")
+
+        test_path = os.path.join(self.tempdir.name, "db")
+        test_db = PackageDB(test_path)
+        for category in ["app-test1", "app-test2"]:
+            test_db.add_category(category)
+            test_db.add_package(Package(category, "old", "1"), {"test": "old"})
+        test_db.write()
+
+        test_db = PackageDB(test_path)
+        test_db.read(lazy=True)
+        self.assertEqual(test_db.list_package_names("app-test1"), ["old"])
+        srv = Server(orig_tempdir.name, port=port)
+        srv.start()
+        try:
+            PackageDB(test_path).sync(sync_address)
+            self.assertEqual(test_db.list_package_names("app-test2"), ["new"])
+            self.assertEqual(test_db.metadata["category_format"], INDEXED_FILE_SUFFIX)
+            self.assertEqual(set(test_db.list_all_packages()),
+                             set([Package(category, "new", "2")
+                                  for category in ["app-test1", "app-test2", "app-test3"]]))
+
+            # unwritten changes are not dropped silently
+            test_db = PackageDB(test_path)
+            test_db.read(lazy=True)
+            test_db.add_package(Package("app-test1", "changed", "1"), {})
+            PackageDB(test_path).sync(sync_address)
+            self.assertRaises(DBReplacedError, test_db.list_package_names, "app-test2")
+            self.assertRaises(DBReplacedError, test_db.write, incremental=True)
+        finally:
+            srv.shutdown()
+            srv.join()
+
+
+class TestVersionKey(BaseTest):
+
+    def test_vercmp(self):
+        versions = ["1", "1.0", "1.0.0", "1.00", "1.01", "1.010", "1.02", "1.1", "1.10",
+                    "1.2", "1.2b", "1.2.0", "12.2.5", "12.2b", "1.2_alpha", "1.2_beta2",
+                    "1.2_pre", "1.2_rc1", "1.2_p", "1.2_p0", "1.2_p1", "1.2_p1_alpha",
+                    "1.2_p1_p1", "1.2-r1", "1.2-r0", "1.2_rc1-r2", "2"]
+        for version1 in versions:
+            for version2 in versions:
+                result = portage.vercmp(version1, version2)
+                result = (result > 0) - (result < 0)
+                self.assertEqual(compare_versions(version1, version2), result,
+                                 version1 + " " + version2)
+
+    def test_invalid(self):
+        versions = ["1.2", "invalid", "1.0", "also-invalid", "1.10"]
+        self.assertEqual(sorted(versions, key=version_key),
+                         ["also-invalid", "invalid", "1.0", "1.2", "1.10"])
+
+
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(TestPackageDB('test_functionality'))
+    suite.addTest(TestPackageDB('test_compact_json'))
+    suite.addTest(TestPackageDB('test_compact_storage'))
+    suite.addTest(TestPackageDB('test_reverse_dependencies'))
+    suite.addTest(TestPackageDB('test_verified_state'))
+    suite.addTest(TestPackageDB('test_manifest_digests'))
+    suite.addTest(TestPackageDB('test_incremental_write'))
+    suite.addTest(TestPackageDB('test_interrupted_update'))
+    suite.addTest(TestPackageDB('test_sync_failure'))
+    suite.addTest(TestPackageDB('test_sync_during_lazy_read'))
+    suite.addTest(TestVersionKey('test_vercmp'))
+    suite.addTest(TestVersionKey('test_invalid'))
     return suite
@@ -16,8 +16,9 @@ import os
 import unittest
 
 from g_sorcery.compatibility import TemporaryDirectory
+from g_sorcery.exceptions import DependencyError
 from g_sorcery.g_collections import Package
-from g_sorcery.ebuild import EbuildGeneratorFromFile, DefaultEbuildGenerator
+from g_sorcery.ebuild import EbuildGenerator, EbuildGeneratorFromFile, DefaultEbuildGenerator
 from g_sorcery.package_db import PackageDB
 
 from tests.base import BaseTest
@@ -53,6 +54,16 @@ class TestEbuildGenerator(BaseTest):
         ebuild = ebuild_g.generate(self.package)
         self.assertEqual(ebuild, ['TEST_SUBST=(a b c d)'])
 
+    def test_substitution_error(self):
+        template = os.path.join(self.tempdir.name, "test.tmpl")
+        os.system("echo 'DESCRIPTION=none' > " + template)
+        os.system("echo 'TEST_SUBST=%(array)' >> " + template)
+
+        ebuild_g = EbuildGeneratorFromFile(self.pkg_db, template)
+        with self.assertRaises(DependencyError) as context:
+            ebuild_g.generate(self.package)
+        self.assertTrue("'TEST_SUBST=%(array)'" in str(context.exception))
+
     def test_default_ebuild_generator(self):
         vars_before_inherit = \
           [{"name":"test_raw_value", "value":"raw_value", "raw":True},
@@ -83,8 +94,33 @@ class TestEbuildGenerator(BaseTest):
                                   'ARRAY="(a b c d)"', 'ARRAY=(a b c d)', ''])
 
 
+    def test_template_cache(self):
+        ebuild_g = EbuildGenerator(self.pkg_db)
+        ebuild_g.max_compiled_templates = 2
+        template1 = ['DESCRIPTION="%(description)s"', 'HOMEPAGE="%(homepage)s"']
+        compiled = ebuild_g.compile_template(template1)
+        self.assertTrue(ebuild_g.compile_template(template1) is compiled)
+        self.assertTrue(ebuild_g.compile_template(list(template1)) is compiled)
+        self.assertEqual(len(ebuild_g.compiled_by_content), 1)
+
+        template2 = ['SLOT="0"']
+        ebuild_g.compile_template(template2)
+        ebuild_g.compile_template(template1)
+        ebuild_g.compile_template(['KEYWORDS="~amd64"'])
+        self.assertEqual(list(ebuild_g.compiled_by_content),
+                         [tuple(template1), ('KEYWORDS="~amd64"',)])
+        self.assertEqual(len(ebuild_g.compiled_templates), 2)
+
+        data = {"description": "first line\nsecond line", "homepage": "example.com"}
+        self.assertEqual('\n'.join(compiled.render(data)),
+                         '\n'.join([line % data for line in template1]))
+        self.assertEqual(ebuild_g.compile_template(template2).render(data), template2)
+
+
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(TestEbuildGenerator('test_ebuild_generator_from_file'))
+    suite.addTest(TestEbuildGenerator('test_substitution_error'))
     suite.addTest(TestEbuildGenerator('test_default_ebuild_generator'))
+    suite.addTest(TestEbuildGenerator('test_template_cache'))
     return suite
@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    test_fileutils.py
+    ~~~~~~~~~~~~~~~~~
+
+    file utilities test suite
+
+    :copyright: (c) 2013-2015 by Jauhien Piatlicki
+    :license: GPL-2, see LICENSE for more details.
+"""
+
+import glob
+import hashlib
+import io
+import os
+import tarfile
+import time
+import unittest
+
+from g_sorcery.compatibility import TemporaryDirectory, lzma
+from g_sorcery.exceptions import DownloadingError
+from g_sorcery.fileutils import copy_all, extract_tarball, fast_manifest, \
+     HashingWriter, load_remote_file, ManifestEntry, new_whirlpool, replace_directory
+
+from tests.base import BaseTest
+from tests.server import Server
+
+
+def read_parser(f):
+    return f.read()
+
+
+def upper_parser(f):
+    return f.read().upper()
+
+
+class TestLoadRemoteFile(BaseTest):
+
+    def setUp(self):
+        super(TestLoadRemoteFile, self).setUp()
+        self.orig_tempdir = TemporaryDirectory()
+        orig = self.orig_tempdir.name
+        os.makedirs(os.path.join(orig, "src", "dir"))
+        for name in ["file1", "file2", os.path.join("dir", "file3")]:
+            with open(os.path.join(orig, "src", name), "w") as f:
+                f.write("content of " + name)
+        with tarfile.open(os.path.join(orig, "data.tar.gz"), "w:gz") as tar:
+            for name in ["file1", "file2", "dir"]:
+                tar.add(os.path.join(orig, "src", name), name)
+        if lzma is not None:
+            with lzma.open(os.path.join(orig, "data.xz"), "wb") as f:
+                f.write(b"xz content")
+        self.server = Server(orig, port=8084)
+        self.server.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.join()
+        super(TestLoadRemoteFile, self).tearDown()
+
+    def test_tarball(self):
+        data = load_remote_file("127.0.0.1:8084/data.tar.gz", read_parser)
+        self.assertEqual(data, {"file1": "content of file1", "file2": "content of file2"})
+        data = load_remote_file("127.0.0.1:8084/data.tar.gz", os.path.basename,
+                                open_file=False)
+        self.assertEqual(data, {"file1": "file1", "file2": "file2", "dir": "dir"})
+        self.assertRaises(DownloadingError, load_remote_file,
+                          "127.0.0.1:8084/data.tar.gz", read_parser, max_size=20)
+
+    def test_xz(self):
+        if lzma is None:
+            return
+        data = load_remote_file("127.0.0.1:8084/data.xz", read_parser, open_mode="rb")
+        self.assertEqual(data, {"data": b"xz content"})
+        data = load_remote_file("127.0.0.1:8084/data.xz", os.path.basename, open_file=False)
+        self.assertEqual(data, {"data": "data"})
+        self.assertRaises(DownloadingError, load_remote_file,
+                          "127.0.0.1:8084/data.xz", read_parser, max_size=5)
+
+    def test_cache(self):
+        cache_dir = os.path.join(self.tempdir.name, "cache")
+        data = load_remote_file("127.0.0.1:8084/src/file1", read_parser, cache_dir=cache_dir)
+        self.assertEqual(data, {"file1": "content of file1"})
+        data = load_remote_file("127.0.0.1:8084/src/file1", upper_parser, cache_dir=cache_dir)
+        self.assertEqual(data, {"file1": "CONTENT OF FILE1"})
+        pickles = glob.glob(os.path.join(cache_dir, "*.pickle"))
+        self.assertEqual(len(pickles), 2)
+
+        for name in pickles:
+            with open(name, "wb") as f:
+                f.write(b"broken")
+        data = load_remote_file("127.0.0.1:8084/src/file1", read_parser, cache_dir=cache_dir)
+        self.assertEqual(data, {"file1": "content of file1"})
+        broken = []
+        for name in pickles:
+            with open(name, "rb") as f:
+                if f.read() == b"broken":
+                    broken.append(name)
+        self.assertEqual(len(broken), 1)
+        data = load_remote_file("127.0.0.1:8084/src/file1", read_parser, cache_dir=cache_dir)
+        self.assertEqual(data, {"file1": "content of file1"})
+
+    def test_extract_tarball(self):
+        extract_tarball(os.path.join(self.orig_tempdir.name, "data.tar.gz"), self.tempdir.name)
+        with open(os.path.join(self.tempdir.name, "dir", "file3")) as f:
+            self.assertEqual(f.read(), "content of " + os.path.join("dir", "file3"))
+
+        bad = os.path.join(self.orig_tempdir.name, "bad.tar")
+        with tarfile.open(bad, "w") as tar:
+            tar.add(os.path.join(self.orig_tempdir.name, "src", "file1"), "../file1")
+        self.assertRaises(DownloadingError, extract_tarball, bad, self.tempdir.name)
+        self.assertFalse(os.path.exists(os.path.join(self.tempdir.name, "..", "file1")))
+
+
+class TestHashingWriter(BaseTest):
+
+    def test_write(self):
+        f = io.BytesIO()
+        writer = HashingWriter(f, hashlib.md5(), blocksize=8)
+        for chunk in [u"ж", b"\x00\x01", "tst", "12345678", b"bin", "end"]:
+            writer.write(chunk)
+        writer.flush()
+        data = u"ж".encode("utf-8") + b"\x00\x01tst12345678binend"
+        self.assertEqual(f.getvalue(), data)
+        self.assertEqual(writer.hexdigest(), hashlib.md5(data).hexdigest())
+
+
+class TestCopy(BaseTest):
+
+    def test_copy_all(self):
+        src = os.path.join(self.tempdir.name, "src")
+        os.makedirs(os.path.join(src, "dir", ".git"))
+        os.makedirs(os.path.join(src, ".git"))
+        for name in ["file1", os.path.join("dir", "file2"), os.path.join("dir", ".hidden")]:
+            with open(os.path.join(src, name), "w") as f:
+                f.write(name)
+        for hardlink in [False, True]:
+            dst = os.path.join(self.tempdir.name, "dst" + str(hardlink))
+            copy_all(src, dst, hardlink=hardlink)
+            self.assertEqual(sorted(os.listdir(dst)), ["dir", "file1"])
+            self.assertEqual(sorted(os.listdir(os.path.join(dst, "dir"))),
+                             [".git", ".hidden", "file2"])
+            with open(os.path.join(dst, "dir", "file2")) as f:
+                self.assertEqual(f.read(), os.path.join("dir", "file2"))
+            self.assertEqual(os.stat(os.path.join(dst, "file1")).st_ino ==
+                             os.stat(os.path.join(src, "file1")).st_ino, hardlink)
+
+    def test_replace_directory(self):
+        old = os.path.join(self.tempdir.name, "old")
+        new = os.path.join(self.tempdir.name, "new")
+        for directory in [old, new]:
+            os.makedirs(directory)
+            with open(os.path.join(directory, "file"), "w") as f:
+                f.write(directory)
+        replace_directory(new, old)
+        with open(os.path.join(old, "file")) as f:
+            self.assertEqual(f.read(), new)
+        with open(os.path.join(new, "file")) as f:
+            self.assertEqual(f.read(), old)
+        missing = os.path.join(self.tempdir.name, "missing")
+        replace_directory(new, missing)
+        self.assertFalse(os.path.exists(new))
+        self.assertTrue(os.path.isfile(os.path.join(missing, "file")))
+
+
+class TestManifest(BaseTest):
+
+    def setUp(self):
+        super(TestManifest, self).setUp()
+        self.directory = os.path.join(self.tempdir.name, "app-test", "test")
+        os.makedirs(os.path.join(self.directory, "files"))
+        self.write("test-1.ebuild", "ebuild 1")
+        self.write("metadata.xml", "metadata")
+        self.write(os.path.join("files", "patch"), "patch")
+
+    def write(self, name, content):
+        with open(os.path.join(self.directory, name), "w") as f:
+            f.write(content)
+
+    def read_manifest(self):
+        with open(os.path.join(self.directory, "Manifest")) as f:
+            return f.read()
+
+    def manifest_written(self):
+        path = os.path.join(self.directory, "Manifest")
+        ctime = os.stat(path).st_ctime_ns
+        # make sure a rewritten Manifest gets a different change time
+        time.sleep(0.02)
+        fast_manifest(self.directory)
+        return os.stat(path).st_ctime_ns != ctime
+
+    def test_digest(self):
+        content = os.urandom(1000)
+        with open(os.path.join(self.directory, "data"), "wb") as f:
+            f.write(content)
+        entry = ManifestEntry(self.directory, "data", "MISC")
+        entry.digest(blocksize=7)
+        self.assertEqual(entry.size, "1000")
+        self.assertEqual(entry.sha256, hashlib.sha256(content).hexdigest())
+        self.assertEqual(entry.sha512, hashlib.sha512(content).hexdigest())
+        whirlpool = new_whirlpool()
+        whirlpool.update(content)
+        self.assertEqual(entry.whirlpool, whirlpool.hexdigest())
+
+    def test_skip(self):
+        fast_manifest(self.directory)
+        manifest = self.read_manifest()
+        self.assertEqual(sorted(line.split()[1] for line in manifest.splitlines()),
+                         ["metadata.xml", "patch", "test-1.ebuild"])
+        time.sleep(0.02)
+        self.assertFalse(self.manifest_written())
+
+        # same size and restored modification time
+        path = os.path.join(self.directory, "test-1.ebuild")
+        st = os.stat(path)
+        self.write("test-1.ebuild", "ebuild 2")
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+        self.assertTrue(self.manifest_written())
+        self.assertNotEqual(self.read_manifest(), manifest)
+        time.sleep(0.02)
+        self.assertFalse(self.manifest_written())
+
+        self.write("test-2.ebuild", "ebuild 2")
+        self.assertTrue(self.manifest_written())
+        self.assertTrue("test-2.ebuild" in self.read_manifest())
+        os.remove(os.path.join(self.directory, "test-2.ebuild"))
+        self.assertTrue(self.manifest_written())
+        self.assertFalse("test-2.ebuild" in self.read_manifest())
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(TestLoadRemoteFile('test_tarball'))
+    suite.addTest(TestLoadRemoteFile('test_xz'))
+    suite.addTest(TestLoadRemoteFile('test_cache'))
+    suite.addTest(TestLoadRemoteFile('test_extract_tarball'))
+    suite.addTest(TestHashingWriter('test_write'))
+    suite.addTest(TestCopy('test_copy_all'))
+    suite.addTest(TestCopy('test_replace_directory'))
+    suite.addTest(TestManifest('test_digest'))
+    suite.addTest(TestManifest('test_skip'))
+    return suite
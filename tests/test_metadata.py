@@ -13,10 +13,11 @@
 
 import os
 import unittest
+import xml.etree.ElementTree as ET
 
 from g_sorcery.compatibility import TemporaryDirectory
 from g_sorcery.g_collections import Package
-from g_sorcery.metadata import MetadataGenerator
+from g_sorcery.metadata import MetadataGenerator, prettify, serialize
 from g_sorcery.package_db import PackageDB
 
 from tests.base import BaseTest
@@ -47,7 +48,32 @@ class TestMetadataGenerator(BaseTest):
                           '</pkgmetadata>'])
 
 
+    def test_fast_serializer(self):
+        pkg_db = PackageDB(self.tempdir.name)
+        pkg_db.add_category("app-test")
+        ebuild_data = {"herd": ["testers", "<crackers> & \"co\""],
+                       'maintainer': [{'email': 'test@example.com',
+                                         'name': 'tux',
+                                         'description': 'line1\r\nline2\rline3'}],
+                       "longdescription": "",
+                       "use": {"flag": [("use1", "testing use1"), ("use\"2\" & <3>", "")]},
+                       "upstream": {"text": "upstream\ninfo",
+                                    "maintainer": [{"name": "tux"}],
+                                    "doc": "  "}}
+        package = Package("app-test", "metadata_tester", "0.1")
+        pkg_db.add_package(package, ebuild_data)
+        metadata_g = MetadataGenerator(pkg_db)
+        fast_metadata_g = MetadataGenerator(pkg_db, fast_serializer=True)
+        self.assertEqual(metadata_g.generate(package), fast_metadata_g.generate(package))
+
+        tree = metadata_g.process(package, pkg_db.get_package_description(package))
+        tree.find("herd").tail = "tail"
+        ET.SubElement(tree, "empty").set("attr", "a\tb\nc")
+        self.assertEqual(prettify(tree), serialize(tree))
+
+
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(TestMetadataGenerator('test_metadata'))
+    suite.addTest(TestMetadataGenerator('test_fast_serializer'))
     return suite